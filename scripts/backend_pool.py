@@ -0,0 +1,357 @@
+"""
+Shared ZMQ connection pool for the Groot2 WebSocket proxy.
+
+A single zmq.asyncio.Context is owned by the process. For every backend
+endpoint (--bt-ip/--req-port/--pub-port) the pool keeps a bounded set of
+pipelined DEALER connections shared by all client sessions, plus one SUB
+socket whose messages are fanned out to every session.
+
+With a TrafficCapture (--capture-file) every request, reply and PUB message
+of every pool is also appended to a capture file for offline replay.
+"""
+
+import asyncio
+import logging
+import time
+from uuid import UUID
+
+import zmq
+import zmq.asyncio
+
+from backend_transport import PipelinedTransport, DEFAULT_MAX_IN_FLIGHT, DEFAULT_REQUEST_TIMEOUT
+from single_flight import SingleFlight, request_key, DEFAULT_FRESHNESS
+from request_scheduler import RequestScheduler, request_class, DEFAULT_MAX_ACTIVE
+from metrics import REGISTRY
+from tracing import trace_event
+
+logger = logging.getLogger("proxy.backend_pool")
+
+# Default pool settings, overridable from the command line
+DEFAULT_POOL_SIZE = 2
+DEFAULT_IDLE_TIMEOUT = 30.0
+# Maximum number of PUB messages buffered per session before dropping
+LISTENER_QUEUE_SIZE = 256
+
+BACKEND_REQUEST_SECONDS = REGISTRY.histogram(
+    "groot2_proxy_backend_request_seconds",
+    "Round trip of backend requests once sent, by endpoint and priority class",
+    ("endpoint", "class"))
+
+
+class BackendPool:
+    """Pool of pipelined request connections and a shared SUB socket for one Groot2 backend."""
+
+    def __init__(self, context, bt_ip, req_port, pub_port,
+                 max_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, request_timeout=DEFAULT_REQUEST_TIMEOUT,
+                 coalesce_window=DEFAULT_FRESHNESS, class_limits=None, max_active=DEFAULT_MAX_ACTIVE,
+                 capture=None):
+        self.context = context
+        self.req_endpoint = f"tcp://{bt_ip}:{req_port}"
+        self.pub_endpoint = f"tcp://{bt_ip}:{pub_port}"
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        # The scheduler admits at most max_active requests; spreading them over
+        # max_size connections lets a connection fill up so the pool can grow
+        self.max_in_flight = min(max_in_flight, -(-max_active // max_size))
+        if self.max_in_flight < max_in_flight:
+            logger.warning(f"Pipelining to {self.req_endpoint} limited to {self.max_in_flight} requests per "
+                           f"connection (max_in_flight={max_in_flight}): max_active={max_active} is spread "
+                           f"over {max_size} connections")
+        self.request_timeout = request_timeout
+
+        self._transports = []
+        self._retired_stats = {}
+        self._single_flight = SingleFlight(coalesce_window)
+        self._scheduler = RequestScheduler(class_limits, max_active)
+        self._reaper_task = None
+
+        # Tree UUID reported by the most recent reply header
+        self._tree_id_bytes = None
+        self.tree_id = None
+        self.tree_id_seen_at = 0.0
+        self._tree_change_callbacks = []
+
+        self._sub_socket = None
+        self._sub_task = None
+        self._listeners = set()
+
+        self.capture = capture
+        self._capture_endpoint = capture.endpoint(self.req_endpoint, self.pub_endpoint) if capture else None
+
+        self._stats = {
+            "requests": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "created": 0,
+            "evicted": 0,
+            "pub_messages": 0,
+            "pub_dropped": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # Backend request connections
+    # ------------------------------------------------------------------
+
+    async def request(self, frames, timeout=None):
+        """Sends a multipart request on the least loaded connection and returns the reply parts.
+
+        The request first waits for a slot of its priority class (see
+        request_scheduler). A new connection is only opened when every
+        existing one has reached its in-flight limit of
+        min(max_in_flight, ceil(max_active / max_size)), so one pipelined
+        connection carries light traffic and heavy traffic is spread over
+        the whole pool.
+        """
+        self._ensure_reaper()
+        self._stats["requests"] += 1
+        cls = request_class(frames)
+        async with self._scheduler.slot(cls):
+            transport = self._select_transport()
+            if transport.saturated:
+                # Every connection is busy: count the time until this one frees a slot
+                self._stats["waits"] += 1
+                waiting_since = time.monotonic()
+                async with transport.slot():
+                    waited = time.monotonic() - waiting_since
+                    self._stats["wait_time_total"] += waited
+                    self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+                    reply_parts, elapsed = await self._send(transport, frames, timeout)
+            else:
+                async with transport.slot():
+                    reply_parts, elapsed = await self._send(transport, frames, timeout)
+        BACKEND_REQUEST_SECONDS.observe(elapsed, self.req_endpoint, cls)
+        self._observe_tree_id(reply_parts)
+        return reply_parts
+
+    async def _send(self, transport, frames, timeout):
+        """Sends on a transport slot already held; returns the reply parts and the round trip."""
+        sent_at = time.monotonic()
+        trace_event("backend_send", chr(frames[0][1]))
+        if self._capture_endpoint is not None:
+            capture_seq = self.capture.request(self._capture_endpoint, frames)
+        reply_parts = await transport.request_in_slot(frames, timeout=timeout)
+        elapsed = time.monotonic() - sent_at
+        if self._capture_endpoint is not None:
+            self.capture.reply(self._capture_endpoint, capture_seq, reply_parts)
+        trace_event("backend_reply", sum(len(part) for part in reply_parts))
+        return reply_parts, elapsed
+
+    async def request_shared(self, frames, timeout=None):
+        """request() for read-only queries: identical concurrent requests share one round trip.
+
+        Requests are identical when their type and body match; the reply
+        header (and its request id) is the one of the request actually sent.
+        """
+        return await self._single_flight.do(request_key(frames), lambda: self.request(frames, timeout=timeout))
+
+    def _observe_tree_id(self, reply_parts):
+        """Tracks the tree UUID carried by every reply header and reports changes."""
+        reply_raw = reply_parts[0]
+        if len(reply_raw) < 22:  # error replies carry no header
+            return
+        self.tree_id_seen_at = time.monotonic()
+        tree_id_bytes = bytes(reply_raw[6:22])
+        if tree_id_bytes == self._tree_id_bytes:
+            return
+
+        previous = self.tree_id
+        self._tree_id_bytes = tree_id_bytes
+        # Recent replies belong to the previous tree
+        self._single_flight.clear()
+        self.tree_id = str(UUID(bytes=tree_id_bytes))
+        if previous is not None:
+            logger.info(f"Backend {self.req_endpoint} switched tree: {previous} -> {self.tree_id}")
+        for callback in self._tree_change_callbacks:
+            try:
+                callback(self.tree_id)
+            except Exception as e:
+                logger.error(f"Tree change callback failed: {e}")
+
+    def add_tree_change_callback(self, callback):
+        """Registers callback(tree_id), invoked whenever a reply reports a different tree."""
+        self._tree_change_callbacks.append(callback)
+
+    def remove_tree_change_callback(self, callback):
+        if callback in self._tree_change_callbacks:
+            self._tree_change_callbacks.remove(callback)
+
+    def tree_id_age(self):
+        """Seconds since a reply last confirmed the current tree_id."""
+        return time.monotonic() - self.tree_id_seen_at
+
+    def _select_transport(self):
+        available = [t for t in self._transports if not t.saturated]
+        if available:
+            return min(available, key=lambda t: t.in_flight)
+        if len(self._transports) < self.max_size:
+            return self._create_transport()
+        return min(self._transports, key=lambda t: t.in_flight)
+
+    def _create_transport(self):
+        transport = PipelinedTransport(self.context, self.req_endpoint,
+                                       max_in_flight=self.max_in_flight,
+                                       default_timeout=self.request_timeout)
+        self._transports.append(transport)
+        self._stats["created"] += 1
+        logger.debug(f"Opened backend connection #{self._stats['created']} to {self.req_endpoint}")
+        return transport
+
+    def _ensure_reaper(self):
+        if self.idle_timeout > 0 and (self._reaper_task is None or self._reaper_task.done()):
+            self._reaper_task = asyncio.create_task(self._reap_idle_transports())
+
+    async def _reap_idle_transports(self):
+        """Periodically closes connections that have been idle longer than idle_timeout."""
+        interval = max(self.idle_timeout / 2, 0.5)
+        while True:
+            await asyncio.sleep(interval)
+            cutoff = time.monotonic() - self.idle_timeout
+            keep = []
+            for transport in self._transports:
+                if transport.in_flight == 0 and transport.last_used < cutoff:
+                    self._retire_transport(transport)
+                    self._stats["evicted"] += 1
+                else:
+                    keep.append(transport)
+            if len(keep) != len(self._transports):
+                logger.debug(f"Evicted {len(self._transports) - len(keep)} idle connections to {self.req_endpoint}")
+            self._transports = keep
+
+    def _retire_transport(self, transport):
+        for key, value in transport.stats().items():
+            if key != "in_flight":
+                self._retired_stats[key] = self._retired_stats.get(key, 0) + value
+        transport.close()
+
+    # ------------------------------------------------------------------
+    # Shared SUB socket fan-out
+    # ------------------------------------------------------------------
+
+    def add_listener(self):
+        """Registers a session for PUB messages and returns its queue."""
+        queue = asyncio.Queue(maxsize=LISTENER_QUEUE_SIZE)
+        self._listeners.add(queue)
+        if self._sub_task is None or self._sub_task.done():
+            if self._sub_socket is None:
+                self._sub_socket = self.context.socket(zmq.SUB)
+                self._sub_socket.setsockopt(zmq.LINGER, 0)
+                self._sub_socket.connect(self.pub_endpoint)
+                # Sessions filter by their own topics, so receive everything here
+                self._sub_socket.subscribe(b"")
+            self._sub_task = asyncio.create_task(self._dispatch_pub_messages())
+        return queue
+
+    def remove_listener(self, queue):
+        self._listeners.discard(queue)
+
+    async def _dispatch_pub_messages(self):
+        while True:
+            try:
+                frames = await self._sub_socket.recv_multipart()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error receiving from shared SUB socket {self.pub_endpoint}: {e}")
+                continue
+
+            self._stats["pub_messages"] += 1
+            if self._capture_endpoint is not None:
+                self.capture.pub(self._capture_endpoint, frames)
+            for queue in self._listeners:
+                try:
+                    queue.put_nowait(frames)
+                except asyncio.QueueFull:
+                    self._stats["pub_dropped"] += 1
+
+    # ------------------------------------------------------------------
+
+    def stats(self):
+        """Returns a snapshot of pool usage counters."""
+        requests = self._stats["requests"]
+        waits = self._stats["waits"]
+        transport_stats = dict(self._retired_stats)
+        for transport in self._transports:
+            for key, value in transport.stats().items():
+                transport_stats[key] = transport_stats.get(key, 0) + value
+        transport_stats.setdefault("in_flight", 0)
+        return {
+            "endpoint": self.req_endpoint,
+            "pub_endpoint": self.pub_endpoint,
+            "max_size": self.max_size,
+            "size": len(self._transports),
+            "max_in_flight": self.max_in_flight,
+            "listeners": len(self._listeners),
+            "tree_id": self.tree_id,
+            **self._stats,
+            "wait_ratio": waits / requests if requests else 0.0,
+            "wait_time_avg": self._stats["wait_time_total"] / waits if waits else 0.0,
+            "transport": transport_stats,
+            "coalescing": self._single_flight.stats(),
+            "scheduler": self._scheduler.stats(),
+            "capture": self.capture.stats() if self.capture else None,
+        }
+
+    def close(self):
+        for task in (self._reaper_task, self._sub_task):
+            if task is not None:
+                task.cancel()
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+        if self._sub_socket is not None:
+            self._sub_socket.close()
+            self._sub_socket = None
+
+
+class ConnectionPoolManager:
+    """Owns the process-wide ZMQ context and one BackendPool per backend endpoint."""
+
+    def __init__(self, max_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, request_timeout=DEFAULT_REQUEST_TIMEOUT,
+                 coalesce_window=DEFAULT_FRESHNESS, class_limits=None, max_active=DEFAULT_MAX_ACTIVE,
+                 capture=None):
+        """`capture` is a TrafficCapture shared by all pools (closed with the manager)."""
+        self.context = zmq.asyncio.Context()
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_in_flight = max_in_flight
+        self.request_timeout = request_timeout
+        self.coalesce_window = coalesce_window
+        self.class_limits = class_limits
+        self.max_active = max_active
+        self.capture = capture
+        self._pools = {}
+
+    def get_pool(self, bt_ip, req_port, pub_port):
+        key = (bt_ip, req_port, pub_port)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = BackendPool(self.context, bt_ip, req_port, pub_port,
+                               max_size=self.max_size, idle_timeout=self.idle_timeout,
+                               max_in_flight=self.max_in_flight, request_timeout=self.request_timeout,
+                               coalesce_window=self.coalesce_window,
+                               class_limits=self.class_limits, max_active=self.max_active,
+                               capture=self.capture)
+            self._pools[key] = pool
+            logger.info(f"Created connection pool for {pool.req_endpoint} (size={self.max_size}, idle_timeout={self.idle_timeout}s)")
+        return pool
+
+    def release_pool(self, bt_ip, req_port, pub_port):
+        """Closes and forgets the pool for a backend that is no longer used."""
+        pool = self._pools.pop((bt_ip, req_port, pub_port), None)
+        if pool is not None:
+            pool.close()
+            logger.info(f"Closed connection pool for {pool.req_endpoint}")
+
+    def stats(self):
+        return [pool.stats() for pool in self._pools.values()]
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
+        if self.capture is not None:
+            self.capture.close()
+        self.context.term()
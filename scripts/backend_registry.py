@@ -0,0 +1,226 @@
+"""
+Registry of the Groot2 backends one proxy process fronts.
+
+Each backend has a name and a ZMQ endpoint (host, request port, publisher
+port). Backends come from the command line (a single one named "default")
+or from a JSON config file:
+
+    {
+        "default": "robot1",
+        "backends": {
+            "robot1": {"host": "10.0.0.11", "req_port": 1667, "pub_port": 1668},
+            "robot2": {"host": "10.0.0.12"}
+        }
+    }
+
+Services for a backend (connection pool, pollers, caches) are built on
+first use, so an idle entry costs nothing, and torn down once no backend
+uses their endpoint any more. Names sharing an endpoint share its
+services, so the backend is still polled once. The registry can be edited
+at runtime and reloaded from its file; edits are written back to the file.
+Change callbacks run after every edit or reload with the services that
+were torn down, so sessions can follow their backend to its new services.
+"""
+
+import json
+import logging
+import os
+import re
+from collections import namedtuple
+
+logger = logging.getLogger("proxy.backend_registry")
+
+DEFAULT_BACKEND_NAME = "default"
+DEFAULT_REQ_PORT = 1667
+DEFAULT_PUB_PORT = 1668
+# Names end up in file names (see proxy.recording_path)
+BACKEND_NAME_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+BackendConfig = namedtuple("BackendConfig", ["name", "host", "req_port", "pub_port"])
+
+
+class UnknownBackendError(LookupError):
+    def __init__(self, name):
+        super().__init__(f"Unknown backend: {name}")
+        self.name = name
+
+
+def parse_backend_config(name, entry):
+    """Validates one backend entry of the config file or an addBackend request."""
+    if not isinstance(name, str) or not BACKEND_NAME_PATTERN.fullmatch(name):
+        raise ValueError(f"Invalid backend name {name!r}: use letters, digits, '_' and '-'")
+    if not isinstance(entry, dict) or not entry.get("host"):
+        raise ValueError(f"Backend '{name}' needs a host")
+    return BackendConfig(name, str(entry["host"]),
+                         int(entry.get("req_port", DEFAULT_REQ_PORT)),
+                         int(entry.get("pub_port", DEFAULT_PUB_PORT)))
+
+
+class BackendRegistry:
+    """Maps backend names to their lazily built per-backend services."""
+
+    def __init__(self, pool_manager, services_factory, config_path=None, editable=False):
+        """`services_factory(name, pool)` builds the services object for one backend;
+        it must provide stats() and close(). `editable` allows clients to add
+        and remove backends at runtime."""
+        self.pool_manager = pool_manager
+        self.services_factory = services_factory
+        self.config_path = config_path
+        self.editable = editable
+        self.default = None
+        self._configs = {}  # name -> BackendConfig
+        self._services = {}  # (host, req_port, pub_port) -> services, for endpoints in use
+        self._change_callbacks = []
+
+    # ------------------------------------------------------------------
+    # Configuration
+    # ------------------------------------------------------------------
+
+    def load(self):
+        """(Re)loads the config file, keeping the services of backends whose endpoint is unchanged."""
+        with open(self.config_path, encoding="utf-8") as f:
+            document = json.load(f)
+        self.update(document, source=self.config_path)
+
+    def update(self, document, source="config"):
+        """Replaces the backends with those of a config document (see document())."""
+        configs = {name: parse_backend_config(name, entry)
+                   for name, entry in document.get("backends", {}).items()}
+        if not configs:
+            raise ValueError(f"No backends defined in {source}")
+
+        self._configs = configs
+        default = document.get("default")
+        self.default = default if default in configs else next(iter(configs))
+        logger.info(f"Loaded {len(configs)} backends from {source} (default: {self.default})")
+        self._changed()
+
+    def document(self):
+        """The backends as a config document, the format of the config file."""
+        return {
+            "default": self.default,
+            "backends": {name: {"host": c.host, "req_port": c.req_port, "pub_port": c.pub_port}
+                         for name, c in self._configs.items()},
+        }
+
+    def save(self):
+        if not self.config_path:
+            return
+        temp_path = f"{self.config_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.document(), f, indent=2)
+        os.replace(temp_path, self.config_path)
+
+    def reload(self):
+        """Signal-handler friendly load(): errors are logged and the current registry is kept."""
+        try:
+            self.load()
+        except Exception as e:
+            logger.error(f"Failed to reload backends from {self.config_path}: {e}")
+
+    def add(self, name, host, req_port=DEFAULT_REQ_PORT, pub_port=DEFAULT_PUB_PORT):
+        """Adds or replaces a backend; replacing one with a new endpoint resets its services."""
+        config = parse_backend_config(name, {"host": host, "req_port": req_port, "pub_port": pub_port})
+        if self._configs.get(name) != config:
+            self._configs[name] = config
+            logger.info(f"Backend '{name}' -> tcp://{host}:{config.req_port}/{config.pub_port}")
+        if self.default is None:
+            self.default = name
+        self._changed()
+        return config
+
+    def remove(self, name):
+        if name not in self._configs:
+            raise UnknownBackendError(name)
+        if len(self._configs) == 1:
+            raise ValueError("Cannot remove the last backend")
+        del self._configs[name]
+        if self.default == name:
+            self.default = next(iter(self._configs))
+        logger.info(f"Backend '{name}' removed")
+        self._changed()
+
+    def _changed(self):
+        """Tears down the services of endpoints no backend points at any more and runs the change callbacks."""
+        in_use = {config[1:] for config in self._configs.values()}
+        dropped = self._drop([endpoint for endpoint in self._services if endpoint not in in_use])
+        for callback in list(self._change_callbacks):
+            try:
+                callback(dropped)
+            except Exception as e:
+                logger.error(f"Registry change callback failed: {e}")
+
+    def _drop(self, endpoints):
+        dropped = [self._services.pop(endpoint) for endpoint in endpoints]
+        for endpoint, services in zip(endpoints, dropped):
+            services.close()
+            self.pool_manager.release_pool(*endpoint)
+        return dropped
+
+    def add_change_callback(self, callback):
+        """Registers callback(dropped), invoked after every edit or reload with the services it tore down."""
+        self._change_callbacks.append(callback)
+
+    def remove_change_callback(self, callback):
+        if callback in self._change_callbacks:
+            self._change_callbacks.remove(callback)
+
+    # ------------------------------------------------------------------
+    # Lookup
+    # ------------------------------------------------------------------
+
+    def resolve(self, name=None):
+        """Returns the name of the backend to use, the default one when `name` is empty."""
+        name = name or self.default
+        if not isinstance(name, str) or name not in self._configs:
+            raise UnknownBackendError(name)
+        return name
+
+    def for_endpoint(self, host, req_port, pub_port):
+        """Returns the services of the backends at an endpoint, for callers that only know the endpoint."""
+        for config in self._configs.values():
+            if config[1:] == (host, req_port, pub_port):
+                return self.get(config.name)
+        raise UnknownBackendError(f"tcp://{host}:{req_port}")
+
+    def get(self, name=None):
+        """Returns the services of a backend, building them on first use."""
+        name = self.resolve(name)
+        endpoint = self._configs[name][1:]
+        services = self._services.get(endpoint)
+        if services is None:
+            pool = self.pool_manager.get_pool(*endpoint)
+            services = self._services[endpoint] = self.services_factory(name, pool)
+        return services
+
+    def active(self):
+        """(name, services) of the endpoints in use, named after the backend that built them."""
+        return [(services.name, services) for services in self._services.values()]
+
+    def describe(self):
+        """Backend list sent to clients."""
+        return [{
+            "name": config.name,
+            "host": config.host,
+            "reqPort": config.req_port,
+            "pubPort": config.pub_port,
+            "default": config.name == self.default,
+            "active": config[1:] in self._services,
+        } for config in self._configs.values()]
+
+    def __contains__(self, name):
+        return name in self._configs
+
+    def __len__(self):
+        return len(self._configs)
+
+    def stats(self):
+        return {
+            "backends": len(self._configs),
+            "active": len(self._services),
+            "default": self.default,
+            "editable": self.editable,
+        }
+
+    def close(self):
+        self._drop(list(self._services))
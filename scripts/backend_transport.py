@@ -0,0 +1,181 @@
+"""
+Pipelined DEALER transport for the Groot2 REQ/REP protocol.
+
+A REQ socket allows exactly one outstanding request. A DEALER socket talking
+to the backend's REP socket can keep many requests queued, as long as each
+message carries the empty envelope delimiter REP expects. Replies are matched
+back to their callers through the 6-byte request header (type + unique_id)
+that the backend echoes at the start of every 22-byte reply header.
+
+Error replies ("error", message) carry no header. REP answers strictly in
+arrival order, so those are attributed to the oldest request sent on this
+connection that has not been answered. A request that times out or is
+cancelled after being sent stays in that order as a tombstone: an error
+reply arriving for it after the deadline consumes the tombstone and is
+dropped as late instead of being handed to the next request, and the next
+header-carrying reply clears any tombstones sent before it.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import zmq
+
+logger = logging.getLogger("proxy.backend_transport")
+
+DEFAULT_REQUEST_TIMEOUT = 10.0
+DEFAULT_MAX_IN_FLIGHT = 32
+
+
+class BackendRequestTimeout(TimeoutError):
+    """Raised when the backend does not answer before the request deadline."""
+
+
+def _correlation_key(header):
+    # Bytes 1..5 of the request header: type char + unique_id
+    return bytes(header[1:6])
+
+
+class PipelinedTransport:
+    """One DEALER connection that multiplexes concurrent requests to a REP backend."""
+
+    def __init__(self, context, endpoint, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 default_timeout=DEFAULT_REQUEST_TIMEOUT):
+        self.endpoint = endpoint
+        self.max_in_flight = max_in_flight
+        self.default_timeout = default_timeout
+
+        self._socket = context.socket(zmq.DEALER)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        self._socket.connect(endpoint)
+
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._pending = {}  # correlation key -> Future
+        self._order = deque()  # correlation keys in send order
+        self._reader_task = None
+        self.last_used = time.monotonic()
+
+        self._stats = {
+            "requests": 0,
+            "replies": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "late_replies": 0,
+            "lost_replies": 0,
+            "slot_waits": 0,
+        }
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    @property
+    def saturated(self):
+        return self._slots.locked()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Holds one of the max_in_flight request slots, waiting while the connection is saturated."""
+        if self._slots.locked():
+            self._stats["slot_waits"] += 1
+        await self._slots.acquire()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    async def request(self, frames, timeout=None):
+        """Sends a request whose first frame is a 6-byte Groot2 header and awaits its reply parts."""
+        async with self.slot():
+            return await self.request_in_slot(frames, timeout)
+
+    async def request_in_slot(self, frames, timeout=None):
+        """request() for a caller already holding a slot()."""
+        if self._reader_task is None:
+            self._reader_task = asyncio.create_task(self._read_replies())
+
+        deadline = self.default_timeout if timeout is None else timeout
+        key = _correlation_key(frames[0])
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        self._order.append(key)
+        self._stats["requests"] += 1
+        self.last_used = time.monotonic()
+        sent = False
+        try:
+            await self._socket.send_multipart([b"", *frames])
+            sent = True
+            return await asyncio.wait_for(future, deadline)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            raise BackendRequestTimeout(
+                f"No reply from {self.endpoint} within {deadline:.1f}s") from None
+        finally:
+            # A reply arriving after this point is counted as late and dropped;
+            # once sent, the key stays in the send order as a tombstone
+            self._pending.pop(key, None)
+            if not sent and key in self._order:
+                self._order.remove(key)
+
+    async def _read_replies(self):
+        while True:
+            try:
+                frames = await self._socket.recv_multipart()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error receiving from {self.endpoint}: {e}")
+                continue
+
+            # Strip the empty envelope delimiter added by REP
+            parts = frames[1:] if frames and frames[0] == b"" else frames
+            if not parts:
+                continue
+            self._stats["replies"] += 1
+
+            if parts[0] == b"error":
+                self._stats["errors"] += 1
+                key = self._order.popleft() if self._order else None
+            elif len(parts[0]) >= 6:
+                key = _correlation_key(parts[0])
+                self._drain_order_until(key)
+            else:
+                logger.warning(f"Dropping reply with malformed header from {self.endpoint}: {parts[0][:22]!r}")
+                continue
+
+            future = self._pending.pop(key, None) if key is not None else None
+            if future is None:
+                self._stats["late_replies"] += 1
+                continue
+            if not future.done():
+                future.set_result(parts)
+            self.last_used = time.monotonic()
+
+    def _drain_order_until(self, key):
+        """Pops send-order entries up to key; requests skipped over can no longer be answered."""
+        if key not in self._order:
+            return
+        while self._order:
+            head = self._order.popleft()
+            if head == key:
+                return
+            future = self._pending.pop(head, None)
+            if future is not None and not future.done():
+                self._stats["lost_replies"] += 1
+                future.set_exception(ConnectionError(f"Reply from {self.endpoint} was lost"))
+
+    def stats(self):
+        return {"in_flight": self.in_flight, **self._stats}
+
+    def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Connection to {self.endpoint} closed"))
+        self._pending.clear()
+        self._order.clear()
+        self._socket.close()
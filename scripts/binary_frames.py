@@ -0,0 +1,111 @@
+"""
+Binary WebSocket frame protocol for the proxy's high-rate streams.
+
+Clients opt in per connection by offering the "groot2.binary.v1"
+WebSocket subprotocol. On such connections status updates, transitions and
+breakpoint events are sent as binary frames; control replies stay JSON text
+frames. Connections without the subprotocol get JSON only.
+
+Every binary frame starts with a one-byte kind; kinds stay below 0x7B ("{"),
+the first byte of every JSON frame (see frame_encoding.is_text_frame). Integers are big-endian and
+node records keep the 3-byte (uint16 uid, uint8 status) and 9-byte
+(48-bit timestamp, uint16 uid, uint8 status) layouts of the Groot2 STATUS
+and GET_TRANSITIONS replies, so STATUS bodies are forwarded as-is.
+
+    0x01 status keyframe   kind | u32 seq | 16B tree_id | 3-byte records...
+    0x02 status delta      kind | u32 seq | 16B tree_id | 3-byte records (changed nodes only)
+    0x03 transitions       kind | 16B tree_id | u64 index of first record | 9-byte records...
+    0x04 breakpoint event  kind | msgpack map
+    0x05 compressed tree   kind | 16B tree_id | 16B etag | gzip of the FULLTREE XML
+
+Compressed tree frames may be sent on JSON connections too: they follow a
+treeData reply to a getTree with "acceptEncoding": "gzip".
+"""
+
+import struct
+from uuid import UUID
+
+import msgpack
+
+BINARY_SUBPROTOCOL = "groot2.binary.v1"
+JSON_SUBPROTOCOL = "groot2.json.v1"
+SUBPROTOCOLS = [BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL]
+
+FRAME_STATUS_KEYFRAME = 0x01
+FRAME_STATUS_DELTA = 0x02
+FRAME_TRANSITIONS = 0x03
+FRAME_BREAKPOINT = 0x04
+FRAME_COMPRESSED_TREE = 0x05
+# Frames whose payload is already compressed; permessage-deflate skips them
+PRECOMPRESSED_KINDS = (FRAME_COMPRESSED_TREE,)
+
+_STATUS_HEADER = struct.Struct('!BI16s')
+_TRANSITIONS_HEADER = struct.Struct('!B16sQ')
+_COMPRESSED_TREE_HEADER = struct.Struct('!B16s16s')
+
+
+def select_subprotocol(connection, subprotocols):
+    """websockets.serve hook: picks the first supported subprotocol offered by the client.
+
+    Clients that offer none (such as the existing frontend) are accepted
+    without a subprotocol and get JSON frames.
+    """
+    for subprotocol in subprotocols:
+        if subprotocol in SUBPROTOCOLS:
+            return subprotocol
+    return None
+
+
+def is_binary(websocket):
+    """True when the client negotiated the binary subprotocol."""
+    return getattr(websocket, "subprotocol", None) == BINARY_SUBPROTOCOL
+
+
+def _tree_id_bytes(tree_id):
+    return UUID(tree_id).bytes if isinstance(tree_id, str) else tree_id
+
+
+def encode_status_keyframe(seq, tree_id, status_payload):
+    return _STATUS_HEADER.pack(FRAME_STATUS_KEYFRAME, seq & 0xFFFFFFFF, _tree_id_bytes(tree_id)) + status_payload
+
+
+def encode_status_delta(seq, tree_id, changes):
+    """Encodes [[uid, status], ...] changes as packed 3-byte records."""
+    records = struct.pack(f'!{len(changes) * "HB"}', *(value for change in changes for value in change))
+    return _STATUS_HEADER.pack(FRAME_STATUS_DELTA, seq & 0xFFFFFFFF, _tree_id_bytes(tree_id)) + records
+
+
+def encode_transitions(tree_id, first, transitions_payload):
+    """Encodes a page of packed transition records starting at recording index `first`."""
+    return _TRANSITIONS_HEADER.pack(FRAME_TRANSITIONS, _tree_id_bytes(tree_id) or bytes(16), first) + transitions_payload
+
+
+def encode_breakpoint(payload):
+    return bytes([FRAME_BREAKPOINT]) + msgpack.packb(payload)
+
+
+def encode_compressed_tree(tree_id, etag, compressed_xml):
+    """Encodes gzip-compressed tree XML; `etag` is the hex ETag from the treeData reply."""
+    return _COMPRESSED_TREE_HEADER.pack(FRAME_COMPRESSED_TREE, _tree_id_bytes(tree_id),
+                                        bytes.fromhex(etag)) + compressed_xml
+
+
+def decode_frame(data):
+    """Decodes a binary frame into (kind, fields); used by Python clients and tests."""
+    kind = data[0]
+    if kind in (FRAME_STATUS_KEYFRAME, FRAME_STATUS_DELTA):
+        _, seq, tree_id = _STATUS_HEADER.unpack_from(data)
+        body = data[_STATUS_HEADER.size:]
+        return kind, {"seq": seq, "tree_id": str(UUID(bytes=tree_id)),
+                      "records": [list(record) for record in struct.iter_unpack('!HB', body)]}
+    if kind == FRAME_TRANSITIONS:
+        _, tree_id, first = _TRANSITIONS_HEADER.unpack_from(data)
+        return kind, {"tree_id": str(UUID(bytes=tree_id)), "first": first,
+                      "records": data[_TRANSITIONS_HEADER.size:]}
+    if kind == FRAME_BREAKPOINT:
+        return kind, msgpack.unpackb(data[1:], raw=False)
+    if kind == FRAME_COMPRESSED_TREE:
+        _, tree_id, etag = _COMPRESSED_TREE_HEADER.unpack_from(data)
+        return kind, {"tree_id": str(UUID(bytes=tree_id)), "etag": etag.hex(),
+                      "data": data[_COMPRESSED_TREE_HEADER.size:]}
+    raise ValueError(f"Unknown binary frame kind: {kind:#04x}")
@@ -0,0 +1,403 @@
+"""
+Proxy-side blackboard poller with key-level diffs.
+
+One poller per backend requests BLACKBOARD ('B') for the union of the
+blackboard names its clients subscribed to, on a fixed cadence, and keeps
+a fingerprint of every value it has seen. Subscribers get a full
+blackboardUpdate keyframe when they join (or ask with resyncBlackboard)
+and afterwards a blackboardDelta per blackboard listing only the added,
+changed and removed keys.
+
+Values are compared without decoding them: the reply is walked with a
+streaming msgpack unpacker that records where each value's bytes are, and
+only values that changed are decoded. Small values are fingerprinted by
+their bytes, larger ones (costmaps, waypoint lists) by a short hash.
+
+Each subscription can narrow what it receives with glob patterns on the
+keys and cap the size of each value; a value over the cap is replaced by
+a summary (type, length, hash and a short preview) built from its
+msgpack headers. Clients with identical subscriptions share every encoded
+frame, and all subscriptions share one backend fetch per poll.
+"""
+
+import asyncio
+import fnmatch
+import functools
+import hashlib
+import logging
+from collections import namedtuple
+
+import msgpack
+
+from groot2_protocol import (
+    get_next_request_id,
+    serialize_request_header,
+    split_reply,
+    PROTOCOL_ID,
+)
+from frame_encoding import encode_json
+from send_queue import broadcast as queue_broadcast
+
+logger = logging.getLogger("proxy.blackboard_poller")
+
+DEFAULT_BLACKBOARD_INTERVAL = 0.5  # seconds between polls
+DEFAULT_BLACKBOARD_NAME = "MainTree"
+# Values up to this size are their own fingerprint; larger ones are hashed
+INLINE_FINGERPRINT_SIZE = 64
+DEFAULT_MAX_VALUE_BYTES = 0  # no cap
+# Oversized values are summarized with this many leading items or characters
+SUMMARY_PREVIEW_ITEMS = 8
+SUMMARY_PREVIEW_BYTES = 256
+
+BlackboardSubscription = namedtuple("BlackboardSubscription", ["names", "keys", "max_value_bytes"])
+BlackboardSubscription.__doc__ = """What one client receives: blackboard names, key glob patterns
+(None for every key) and the size cap for a single value in msgpack bytes (0 for none)."""
+
+
+def parse_blackboard_names(names):
+    """Normalizes a ';'-separated string or a list of blackboard names."""
+    if isinstance(names, str):
+        names = names.split(';')
+    names = [name.strip() for name in names or [] if name and name.strip()]
+    return names or [DEFAULT_BLACKBOARD_NAME]
+
+
+def make_subscription(names, keys=None, max_value_bytes=DEFAULT_MAX_VALUE_BYTES):
+    """Builds a normalized, hashable BlackboardSubscription from client parameters."""
+    if isinstance(keys, str):
+        keys = [keys]
+    keys = tuple(sorted({key for key in keys if key})) if keys else None
+    if keys is not None and "*" in keys:
+        keys = None
+    return BlackboardSubscription(tuple(parse_blackboard_names(names)), keys, max(0, int(max_value_bytes or 0)))
+
+
+@functools.lru_cache(maxsize=8192)
+def key_matches(patterns, key):
+    return patterns is None or any(fnmatch.fnmatchcase(key, pattern) for pattern in patterns)
+
+
+def index_blackboards(payload):
+    """Splits a BLACKBOARD reply into {name: {key: raw msgpack value}} without decoding the values."""
+    if not payload:
+        return {}
+    view = memoryview(payload)
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(payload)
+    try:
+        blackboards = {}
+        for _ in range(unpacker.read_map_header()):
+            name = unpacker.unpack()
+            entries = {}
+            for _ in range(unpacker.read_map_header()):
+                key = unpacker.unpack()
+                start = unpacker.tell()
+                unpacker.skip()
+                entries[key] = view[start:unpacker.tell()]
+            blackboards[name] = entries
+        return blackboards
+    except (msgpack.UnpackValueError, ValueError, TypeError):
+        # Not a map of maps; re-pack each decoded value instead
+        decoded = msgpack.unpackb(payload, raw=False)
+        if not isinstance(decoded, dict):
+            logger.warning(f"Ignoring BLACKBOARD reply that is not a map: {type(decoded).__name__}")
+            return {}
+        return {name: {key: msgpack.packb(value) for key, value in entries.items()}
+                for name, entries in decoded.items() if isinstance(entries, dict)}
+
+
+def fingerprint(raw_value):
+    if len(raw_value) <= INLINE_FINGERPRINT_SIZE:
+        return bytes(raw_value)
+    return hashlib.blake2b(raw_value, digest_size=16).digest()
+
+
+def diff_blackboard(previous, entries):
+    """Compares raw entries against the previous fingerprints.
+
+    Returns (added keys, changed keys, removed keys, new fingerprints).
+    """
+    fingerprints = {key: fingerprint(raw) for key, raw in entries.items()}
+    added = [key for key in fingerprints if key not in previous]
+    changed = [key for key, value in fingerprints.items() if key in previous and previous[key] != value]
+    removed = [key for key in previous if key not in fingerprints]
+    return added, changed, removed, fingerprints
+
+
+def _preview_item(raw, unpacker):
+    start = unpacker.tell()
+    unpacker.skip()
+    end = unpacker.tell()
+    if end - start > SUMMARY_PREVIEW_BYTES:
+        return {"truncated": True, "bytes": end - start}
+    return msgpack.unpackb(raw[start:end], raw=False)
+
+
+def summarize_value(raw):
+    """Describes an oversized msgpack value from its headers and first items."""
+    summary = {
+        "truncated": True,
+        "bytes": len(raw),
+        "hash": hashlib.blake2b(raw, digest_size=8).hexdigest(),
+    }
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(raw)
+    try:
+        length = unpacker.read_array_header()
+        summary.update(type="array", length=length,
+                       preview=[_preview_item(raw, unpacker) for _ in range(min(length, SUMMARY_PREVIEW_ITEMS))])
+        return summary
+    except ValueError:
+        pass
+    try:
+        length = unpacker.read_map_header()
+        keys = []
+        for _ in range(min(length, SUMMARY_PREVIEW_ITEMS)):
+            keys.append(_preview_item(raw, unpacker))
+            unpacker.skip()
+        summary.update(type="map", length=length, keys=keys)
+        return summary
+    except ValueError:
+        pass
+    value = unpacker.unpack()
+    if isinstance(value, str):
+        summary.update(type="str", length=len(value), preview=value[:SUMMARY_PREVIEW_BYTES])
+    else:
+        summary.update(type=type(value).__name__, length=len(value) if hasattr(value, "__len__") else None)
+    return summary
+
+
+class _ValueCache:
+    """Decodes or summarizes each raw value of one poll at most once."""
+
+    def __init__(self, blackboards, stats):
+        self.blackboards = blackboards
+        self.stats = stats
+        self._values = {}
+        self._summaries = {}
+
+    def get(self, name, key, max_value_bytes):
+        raw = self.blackboards[name][key]
+        if max_value_bytes and len(raw) > max_value_bytes:
+            cache, render, counter = self._summaries, summarize_value, "values_summarized"
+        else:
+            cache, render, counter = self._values, functools.partial(msgpack.unpackb, raw=False), "values_decoded"
+        if (name, key) not in cache:
+            cache[name, key] = render(raw)
+            self.stats[counter] += 1
+        return cache[name, key]
+
+    def render(self, subscription, name, keys=None):
+        """{key: value or summary} for the keys of a blackboard the subscription wants."""
+        entries = self.blackboards.get(name, {})
+        return {key: self.get(name, key, subscription.max_value_bytes)
+                for key in (entries if keys is None else keys)
+                if key_matches(subscription.keys, key)}
+
+
+def render_blackboards(payload, subscription):
+    """Decodes a BLACKBOARD reply for one subscription, applying its key filter and size cap."""
+    blackboards = index_blackboards(payload)
+    cache = _ValueCache(blackboards, {"values_decoded": 0, "values_summarized": 0})
+    return {name: cache.render(subscription, name) for name in subscription.names if name in blackboards}
+
+
+class BlackboardPoller:
+    """Polls one backend for the subscribed blackboards and pushes key-level diffs."""
+
+    def __init__(self, backend, interval=DEFAULT_BLACKBOARD_INTERVAL, max_value_bytes=DEFAULT_MAX_VALUE_BYTES,
+                 broadcast=None):
+        """`broadcast(websockets, frame)` replaces send_queue.broadcast, as for StatusPoller."""
+        self.backend = backend
+        self.broadcast = broadcast
+        self.interval = interval
+        self.max_value_bytes = max_value_bytes
+        self._subscribers = {}  # websocket -> BlackboardSubscription
+        self._needs_keyframe = set()
+        self._task = None
+
+        self._fingerprints = {}  # blackboard name -> {key: fingerprint}
+        self._seq = {}  # (subscription, blackboard name) -> delta sequence number
+        self._tree_id = None
+
+        self._stats = {
+            "polls": 0,
+            "errors": 0,
+            "bytes_received": 0,
+            "values_decoded": 0,
+            "values_summarized": 0,
+            "values_unchanged": 0,
+            "keyframes": 0,
+            "deltas": 0,
+            "frames_sent": 0,
+            "bytes_sent": 0,
+            "last_poll_duration": 0.0,
+        }
+
+    def subscribe(self, websocket, names, keys=None, max_value_bytes=None):
+        """Subscribes to the given blackboards, replacing any earlier subscription.
+
+        `keys` are glob patterns on the keys to receive; values larger than
+        `max_value_bytes` (the poller default when None) are summarized.
+        Returns the BlackboardSubscription.
+        """
+        if max_value_bytes is None:
+            max_value_bytes = self.max_value_bytes
+        subscription = make_subscription(names, keys, max_value_bytes)
+        self._subscribers[websocket] = subscription
+        self._needs_keyframe.add(websocket)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Blackboard poller started for {self.backend.req_endpoint} every {self.interval:g}s")
+        return subscription
+
+    def unsubscribe(self, websocket):
+        self._subscribers.pop(websocket, None)
+        self._needs_keyframe.discard(websocket)
+        self._forget_unused()
+
+    def request_keyframe(self, websocket):
+        if websocket in self._subscribers:
+            self._needs_keyframe.add(websocket)
+
+    def _forget_unused(self):
+        wanted = self._wanted_names()
+        for name in [name for name in self._fingerprints if name not in wanted]:
+            del self._fingerprints[name]
+        active = set(self._subscribers.values())
+        for key in [key for key in self._seq if key[0] not in active]:
+            del self._seq[key]
+
+    def _wanted_names(self):
+        return sorted({name for subscription in self._subscribers.values() for name in subscription.names})
+
+    async def poll_once(self, names):
+        """Requests the given blackboards once and returns (header, raw msgpack body)."""
+        header = serialize_request_header(PROTOCOL_ID, 'B', get_next_request_id())
+        reply_parts = await self.backend.request([header, ';'.join(names).encode('utf-8')],
+                                                 timeout=max(self.interval * 5, 1.0))
+        return split_reply(reply_parts)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_error = None
+        while self._subscribers:
+            started = loop.time()
+            try:
+                names = self._wanted_names()
+                header_data, payload = await self.poll_once(names)
+                self._stats["bytes_received"] += len(payload)
+                self._publish(names, header_data, index_blackboards(payload))
+                last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["errors"] += 1
+                if str(e) != last_error:
+                    last_error = str(e)
+                    logger.warning(f"Blackboard poll against {self.backend.req_endpoint} failed: {e}")
+                    self._broadcast(list(self._subscribers), encode_json({
+                        "type": "error",
+                        "replyTo": "subscribeBlackboard",
+                        "payload": {"message": f"Blackboard poll failed: {e}"}
+                    }))
+            finally:
+                self._stats["polls"] += 1
+                self._stats["last_poll_duration"] = loop.time() - started
+
+            await asyncio.sleep(max(0.0, self.interval - (loop.time() - started)))
+        logger.info(f"Blackboard poller stopped for {self.backend.req_endpoint}: no subscribers left")
+
+    def _publish(self, names, header_data, blackboards):
+        if header_data["tree_id"] != self._tree_id:
+            # Another tree means other blackboards: everyone starts over
+            self._tree_id = header_data["tree_id"]
+            self._fingerprints.clear()
+            self._seq.clear()
+            self._needs_keyframe.update(self._subscribers)
+
+        changes = {}  # blackboard name -> (added, changed, removed)
+        for name in names:
+            entries = blackboards.setdefault(name, {})
+            previous = self._fingerprints.get(name)
+            added, changed, removed, self._fingerprints[name] = diff_blackboard(previous or {}, entries)
+            if previous is None:
+                continue
+            self._stats["values_unchanged"] += len(entries) - len(added) - len(changed)
+            if added or changed or removed:
+                changes[name] = (added, changed, removed)
+
+        # Subscriptions that arrived while the poll was in flight wait for the next one
+        polled = set(names)
+        groups = {}  # subscription -> (keyframe targets, delta targets)
+        for ws, subscription in self._subscribers.items():
+            if ws in self._needs_keyframe:
+                if polled.issuperset(subscription.names):
+                    self._needs_keyframe.discard(ws)
+                    groups.setdefault(subscription, ([], []))[0].append(ws)
+            else:
+                groups.setdefault(subscription, ([], []))[1].append(ws)
+
+        values = _ValueCache(blackboards, self._stats)
+        for subscription, (keyframe_targets, delta_targets) in groups.items():
+            if delta_targets:
+                for name in subscription.names:
+                    if name in changes:
+                        self._send_delta(subscription, name, changes[name], values, delta_targets)
+            if keyframe_targets:
+                self._broadcast(keyframe_targets, encode_json({
+                    "type": "blackboardUpdate",
+                    "payload": {
+                        "data": {name: values.render(subscription, name) for name in subscription.names},
+                        "header": header_data,
+                        "seq": {name: self._seq.get((subscription, name), 0) for name in subscription.names},
+                        "keyframe": True,
+                    }
+                }))
+                self._stats["keyframes"] += len(keyframe_targets)
+
+    def _send_delta(self, subscription, name, change, values, targets):
+        added, changed, removed = change
+        removed = [key for key in removed if key_matches(subscription.keys, key)]
+        added = values.render(subscription, name, added)
+        changed = values.render(subscription, name, changed)
+        if not (added or changed or removed):
+            return  # nothing this subscription watches changed
+
+        seq = self._seq[subscription, name] = self._seq.get((subscription, name), 0) + 1
+        self._broadcast(targets, encode_json({
+            "type": "blackboardDelta",
+            "payload": {
+                "name": name,
+                "seq": seq,
+                "added": added,
+                "changed": changed,
+                "removed": removed,
+                "treeId": self._tree_id,
+            }
+        }))
+        self._stats["deltas"] += 1
+
+    def _broadcast(self, websockets_, frame):
+        if not websockets_:
+            return
+        (self.broadcast or queue_broadcast)(websockets_, frame)
+        self._stats["frames_sent"] += len(websockets_)
+        self._stats["bytes_sent"] += len(frame) * len(websockets_)
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "max_value_bytes": self.max_value_bytes,
+            "subscribers": len(self._subscribers),
+            "subscriptions": len(set(self._subscribers.values())),
+            "blackboards": self._wanted_names(),
+            "running": self._task is not None and not self._task.done(),
+            **self._stats,
+        }
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        self._subscribers.clear()
+        self._needs_keyframe.clear()
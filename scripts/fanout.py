@@ -0,0 +1,621 @@
+"""
+Multi-process mode: WebSocket worker processes in front of one backend hub.
+
+With --workers N the proxy process becomes the hub: it owns the backend
+registry, connection pools, pollers, hook tables and recorders, and it is
+the only ZMQ client of every Groot2 backend. N worker processes share the
+WebSocket port (SO_REUSEPORT) and run the client sessions themselves:
+handshakes, framing, permessage-deflate, command parsing, reply encoding
+and the per-client send queues.
+
+A worker runs most commands against a RemotePool, whose requests the hub
+sends through its own pool, so request scheduling, pipelining and
+coalescing still span all workers. Tree caches are kept per worker.
+Commands that need state only the hub has (hook table, recorder, poller
+subscriptions, registry edits) are forwarded whole; the hub runs them and
+returns their replies, which the worker tags and sends (see
+proxy.HUB_COMMANDS). Backend PUB messages are relayed once per worker
+while any of its clients listens.
+
+Workers and hub talk over two ipc sockets:
+
+    worker DEALER <-> hub ROUTER   reliable and in order
+      worker -> hub   [kind, ...]
+        b"hello"     worker started (repeated until welcomed)
+        b"open"      client id, subprotocol, remote address
+        b"close"     client id: the client disconnected
+        b"call"      call id, client id (empty for the worker itself),
+                     msgpack [endpoint, method, args] (see HubLink.call)
+        b"stats"     JSON {"sendQueues": ..., "metrics": ...}
+      hub -> worker   [kind, ...]
+        b"registry"  the registry document (BackendRegistry.document())
+        b"result"    call id, msgpack [ok, value or [error type, message]]
+        b"event"     endpoint key, one PUB message of that backend
+        b"send"      control frames, as below
+
+    hub PUB -> worker SUB          [worker id, kind, ...]
+        b"welcome"
+        b"send"      packed client ids (u32 each), frame, stream name
+
+Only stream frames (status and blackboard updates) go over PUB. It never
+blocks the hub, so a worker more than PUB_HIGH_WATER_MARK frames behind
+loses some of them, and the streams' sequence numbers let its clients
+notice and resync. Command replies, hook events and call results go over
+the ROUTER socket, which queues them instead. When the hub cannot reach a
+worker any more it releases all of that worker's clients.
+
+Worker ids have a fixed width (worker_topic()): SUB subscriptions match by
+prefix, so with ids of different lengths worker b"w1" would also receive
+frames for b"w10". Client ids are only unique within a worker, so workers
+also compare the topic exactly before delivering anything.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import time
+from uuid import UUID
+
+import msgpack
+import websockets
+import zmq
+import zmq.asyncio
+
+from backend_pool import LISTENER_QUEUE_SIZE
+from binary_frames import select_subprotocol
+from metrics import REGISTRY
+from send_queue import SendQueues
+from ws_compression import server_extensions
+from tracing import queue_logging
+
+logger = logging.getLogger("proxy.fanout")
+
+_ID = struct.Struct('!I')
+MAX_WORKERS = 10000  # worker ids are "w" and four digits
+# Stream frames buffered per worker before the hub starts dropping them:
+# PUB cannot block, so a worker this far behind loses status updates
+PUB_HIGH_WATER_MARK = 100000
+HELLO_INTERVAL = 0.1
+PARENT_CHECK_INTERVAL = 1.0
+STATS_INTERVAL = 5.0
+
+
+def ipc_endpoints(directory):
+    return f"ipc://{os.path.join(directory, 'hub')}", f"ipc://{os.path.join(directory, 'events')}"
+
+
+def worker_topic(index):
+    """Topic of worker `index`; all ids have the same length, so none is a prefix of another."""
+    if not 0 <= index < MAX_WORKERS:
+        raise ValueError(f"Worker index must be below {MAX_WORKERS}")
+    return f"w{index:04d}".encode()
+
+
+def endpoint_key(endpoint):
+    """Wire name of a backend endpoint (host, req_port, pub_port)."""
+    host, req_port, pub_port = endpoint
+    return f"{host}:{req_port}:{pub_port}".encode()
+
+
+class HubCallError(RuntimeError):
+    """A call that failed in the hub; `kind` names the exception raised there."""
+
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+
+# ----------------------------------------------------------------------
+# Hub side
+# ----------------------------------------------------------------------
+
+class RemoteClient:
+    """Hub-side handle of a client connected to a worker: a target for pollers and hook tables."""
+
+    def __init__(self, hub, worker_id, client_id, subprotocol, remote_address):
+        self.hub = hub
+        self.worker_id = worker_id
+        self.client_id = client_id
+        self.subprotocol = subprotocol or None
+        self.remote_address = remote_address
+
+    async def send(self, message):
+        self.hub.publish(self.worker_id, [self.client_id], message)
+
+
+class Hub:
+    """Serves the workers' calls against this process's backend services and relays frames to their clients."""
+
+    def __init__(self, directory, handler=None, metrics=REGISTRY):
+        """`handler` serves the calls: `await handler.call(worker_id, client, endpoint, method, args)`
+        returns a msgpack-able result, and `handler.release(client)` runs when a client is gone.
+        Worker metrics are rendered by `metrics` (see MetricsRegistry.set_remote)."""
+        self.directory = directory
+        self.handler = handler
+        self.metrics = metrics
+        self.hub_endpoint, self.events_endpoint = ipc_endpoints(directory)
+        self._context = zmq.asyncio.Context()
+        self._router = self._context.socket(zmq.ROUTER)
+        # Fail sends to unknown workers instead of dropping them, and never drop for a full queue
+        self._router.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self._router.setsockopt(zmq.SNDHWM, 0)
+        self._router.setsockopt(zmq.LINGER, 0)
+        self._router.bind(self.hub_endpoint)
+        # PUB never blocks, so a plain socket lets synchronous broadcasts publish
+        self._pub = zmq.Context.shadow(self._context.underlying).socket(zmq.PUB)
+        self._pub.setsockopt(zmq.SNDHWM, PUB_HIGH_WATER_MARK)
+        self._pub.setsockopt(zmq.LINGER, 0)
+        self._pub.bind(self.events_endpoint)
+        self.registry_document = None
+        self._clients = {}  # (worker id, client id) -> RemoteClient
+        self._workers = set()
+        self._worker_stats = {}  # worker id -> send queue stats
+        self._forwarders = {}  # (worker id, endpoint key) -> (pool, listener queue, task)
+        self._stats = {"messages_in": 0, "calls": 0, "call_errors": 0, "frames_out": 0, "bytes_out": 0,
+                       "stream_frames_out": 0, "sessions": 0, "bad_messages": 0, "undeliverable": 0}
+
+    async def run(self):
+        while True:
+            parts = await self._router.recv_multipart()
+            self._stats["messages_in"] += 1
+            try:
+                self._handle(parts)
+            except Exception as e:
+                # One bad message must not end the hub, and with it every worker
+                self._stats["bad_messages"] += 1
+                logger.error(f"Dropping bad message from a worker: {e!r}")
+
+    def _handle(self, parts):
+        worker_id, kind, *rest = parts
+        if kind == b"call":
+            call_id, client_id, body = rest
+            endpoint, method, args = msgpack.unpackb(body)
+            client = self._clients.get((worker_id, client_id)) if client_id else None
+            asyncio.create_task(self._call(worker_id, call_id, client, tuple(endpoint), method, args))
+        elif kind == b"open":
+            client_id, subprotocol, remote_address = rest
+            self._clients[(worker_id, client_id)] = RemoteClient(self, worker_id, client_id, subprotocol.decode(),
+                                                                 remote_address.decode())
+            self._stats["sessions"] += 1
+        elif kind == b"close":
+            client = self._clients.pop((worker_id, rest[0]), None)
+            if client is not None:
+                self.handler.release(client)
+        elif kind == b"stats":
+            stats = json.loads(rest[0])
+            self._worker_stats[worker_id.decode()] = stats["sendQueues"]
+            self.metrics.set_remote(worker_id.decode(), stats["metrics"])
+        elif kind == b"hello":
+            if worker_id not in self._workers:
+                self._workers.add(worker_id)
+                logger.info(f"Worker {worker_id.decode()} connected")
+                if self.registry_document is not None:
+                    self._send(worker_id, [b"registry", self.registry_document])
+            self._pub.send_multipart([worker_id, b"welcome"])
+        else:
+            raise ValueError(f"Unknown message kind {kind!r}")
+
+    async def _call(self, worker_id, call_id, client, endpoint, method, args):
+        self._stats["calls"] += 1
+        try:
+            result = await self.handler.call(worker_id, client, endpoint, method, args)
+            body = msgpack.packb([True, result])
+        except Exception as e:
+            self._stats["call_errors"] += 1
+            body = msgpack.packb([False, [type(e).__name__, str(e)]])
+        self._send(worker_id, [b"result", call_id, body])
+
+    def _send(self, worker_id, parts):
+        """Sends to one worker over the ROUTER socket; a worker that cannot be reached is dropped."""
+        if worker_id not in self._workers:
+            return False
+        # Without a high-water mark the send completes at once, so errors show right away
+        sent = self._router.send_multipart([worker_id, *parts], flags=zmq.NOBLOCK)
+        error = sent.exception() if sent.done() else None
+        if error is None:
+            return True
+        self._stats["undeliverable"] += 1
+        logger.error(f"Worker {worker_id.decode()} cannot be reached ({error}), releasing its clients")
+        self._drop_worker(worker_id)
+        return False
+
+    def _drop_worker(self, worker_id):
+        self._workers.discard(worker_id)
+        self._stop_forwarders(lambda key, pool: key[0] == worker_id)
+        for key in [key for key in self._clients if key[0] == worker_id]:
+            self.handler.release(self._clients.pop(key))
+
+    def publish(self, worker_id, client_ids, frame, stream=None):
+        """Sends `frame` to clients of one worker: stream frames over PUB, anything else over ROUTER."""
+        if isinstance(frame, str):
+            frame = frame.encode('utf-8')
+        parts = [b"send", b''.join(client_ids), frame, stream.encode() if stream else b""]
+        if stream:
+            self._pub.send_multipart([worker_id, *parts])
+            self._stats["stream_frames_out"] += 1
+        elif not self._send(worker_id, parts):
+            return
+        self._stats["frames_out"] += 1
+        self._stats["bytes_out"] += len(frame)
+
+    def broadcast(self, targets, frame, stream=None):
+        """send_queue.broadcast replacement: one message per worker for all its targeted clients."""
+        by_worker = {}
+        for target in targets:
+            by_worker.setdefault(target.worker_id, []).append(target.client_id)
+        for worker_id, client_ids in by_worker.items():
+            self.publish(worker_id, client_ids, frame, stream)
+
+    def push_registry(self, document):
+        """Sends the registry document to every worker, and to workers connecting later."""
+        self.registry_document = json.dumps(document).encode()
+        for worker_id in list(self._workers):
+            self._send(worker_id, [b"registry", self.registry_document])
+
+    # ------------------------------------------------------------------
+    # Backend PUB messages
+    # ------------------------------------------------------------------
+
+    def forward_events(self, worker_id, key, pool):
+        """Relays the PUB messages of `pool` to a worker until stop_events()."""
+        if (worker_id, key) in self._forwarders:
+            return
+        queue = pool.add_listener()
+        task = asyncio.create_task(self._forward_events(worker_id, key, queue))
+        self._forwarders[(worker_id, key)] = (pool, queue, task)
+
+    async def _forward_events(self, worker_id, key, queue):
+        while True:
+            frames = await queue.get()
+            self._send(worker_id, [b"event", key, *frames])
+
+    def stop_events(self, worker_id=None, key=None, pool=None):
+        """Stops the relays matching every given argument."""
+        self._stop_forwarders(lambda forwarder, forwarded: (worker_id in (None, forwarder[0])
+                                                            and key in (None, forwarder[1])
+                                                            and pool in (None, forwarded)))
+
+    def _stop_forwarders(self, matches):
+        for forwarder in [forwarder for forwarder, (pool, _, _) in self._forwarders.items() if matches(forwarder, pool)]:
+            pool, queue, task = self._forwarders.pop(forwarder)
+            task.cancel()
+            pool.remove_listener(queue)
+
+    def stats(self):
+        return {"workers": len(self._workers), "clients": len(self._clients), "eventRelays": len(self._forwarders),
+                **self._stats, "sendQueues": self._worker_stats}
+
+    def close(self):
+        self._stop_forwarders(lambda forwarder, pool: True)
+        self._router.close()
+        self._pub.close()
+        self._context.term()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def make_ipc_directory():
+    return tempfile.mkdtemp(prefix="groot2-proxy-")
+
+
+# ----------------------------------------------------------------------
+# Worker side
+# ----------------------------------------------------------------------
+
+def _log_failed_call(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Hub call failed: {future.exception()}")
+
+
+class HubLink:
+    """A worker's connection to the hub: calls into it, and the frames it sends to this worker's clients."""
+
+    def __init__(self, worker_id, directory):
+        hub_endpoint, events_endpoint = ipc_endpoints(directory)
+        self.worker_id = worker_id
+        self._context = zmq.asyncio.Context()
+        self._dealer = self._context.socket(zmq.DEALER)
+        self._dealer.setsockopt(zmq.IDENTITY, worker_id)
+        self._dealer.setsockopt(zmq.SNDHWM, 0)
+        self._dealer.setsockopt(zmq.LINGER, 0)
+        self._dealer.connect(hub_endpoint)
+        self._sub = self._context.socket(zmq.SUB)
+        self._sub.setsockopt(zmq.LINGER, 0)
+        self._sub.connect(events_endpoint)
+        self._sub.subscribe(worker_id)
+        self.registry_document = None
+        self.on_registry = None  # callback(document), run when the hub's registry changes
+        self.pools = {}  # endpoint key -> RemotePool, for the PUB messages the hub relays
+        self._calls = {}  # call id -> Future
+        self._next_call = 0
+        self._next_client = 0
+        self._clients = {}  # client id -> SendQueue
+        self._client_ids = {}  # SendQueue -> client id
+
+    def _send(self, parts):
+        # Without a high-water mark the DEALER queues everything at once, in order
+        error = self._dealer.send_multipart(parts, flags=zmq.NOBLOCK).exception()
+        if error is not None:
+            raise ConnectionError(f"Hub cannot be reached: {error}")
+
+    async def connect(self):
+        """Waits until the hub has seen this worker and sent it the registry.
+
+        A SUB socket misses whatever is published before its subscription
+        reaches the hub, so hellos are repeated until the welcome arrives.
+        """
+        while True:
+            self._send([b"hello"])
+            if await self._sub.poll(HELLO_INTERVAL * 1000):
+                if (await self._sub.recv_multipart())[:2] == [self.worker_id, b"welcome"]:
+                    break
+        while self.registry_document is None:
+            self._dispatch(await self._dealer.recv_multipart())
+
+    async def run(self):
+        await asyncio.gather(self._read_hub(), self._read_events())
+
+    async def _read_hub(self):
+        while True:
+            parts = await self._dealer.recv_multipart()
+            try:
+                self._dispatch(parts)
+            except Exception as e:
+                logger.error(f"Dropping bad message from the hub: {e!r}")
+
+    async def _read_events(self):
+        while True:
+            topic, *parts = await self._sub.recv_multipart()
+            if topic == self.worker_id:
+                try:
+                    self._dispatch(parts)
+                except Exception as e:
+                    logger.error(f"Dropping bad message from the hub: {e!r}")
+
+    def _dispatch(self, parts):
+        kind, *rest = parts
+        if kind == b"send":
+            client_ids, frame, stream = rest
+            stream = stream.decode() or None
+            for i in range(0, len(client_ids), 4):
+                queue = self._clients.get(client_ids[i:i + 4])
+                if queue is not None:
+                    queue.push(frame, stream)
+        elif kind == b"result":
+            call_id, body = rest
+            future = self._calls.pop(call_id, None)
+            if future is not None and not future.done():
+                ok, value = msgpack.unpackb(body)
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(HubCallError(*value))
+        elif kind == b"event":
+            key, *frames = rest
+            pool = self.pools.get(key)
+            if pool is not None:
+                pool.deliver(frames)
+        elif kind == b"registry":
+            self.registry_document = json.loads(rest[0])
+            if self.on_registry is not None:
+                self.on_registry(self.registry_document)
+
+    def _start_call(self, client, endpoint, method, args):
+        self._next_call += 1
+        call_id = _ID.pack(self._next_call & 0xFFFFFFFF)
+        client_id = self._client_ids.get(client, b"") if client is not None else b""
+        self._send([b"call", call_id, client_id, msgpack.packb([list(endpoint), method, list(args)])])
+        future = self._calls[call_id] = asyncio.get_running_loop().create_future()
+        return call_id, future
+
+    async def call(self, client, endpoint, method, *args):
+        """Runs `method` in the hub for `client` (a SendQueue opened with open_client(), or None)
+        against the backend at `endpoint` and returns its result; see proxy.HubCalls."""
+        call_id, future = self._start_call(client, endpoint, method, args)
+        try:
+            return await future
+        finally:
+            self._calls.pop(call_id, None)
+
+    def notify(self, client, endpoint, method, *args):
+        """call() without waiting for the result; the hub sees it in order with everything sent after it."""
+        _, future = self._start_call(client, endpoint, method, args)
+        future.add_done_callback(_log_failed_call)
+
+    def open_client(self, queue):
+        """Registers a client's SendQueue with the hub, so the hub can send it frames."""
+        self._next_client += 1
+        client_id = _ID.pack(self._next_client & 0xFFFFFFFF)
+        self._clients[client_id] = queue
+        self._client_ids[queue] = client_id
+        self._send([b"open", client_id, (queue.subprotocol or "").encode(), str(queue.remote_address).encode()])
+
+    def close_client(self, queue):
+        """Lets the hub release everything the client held (subscriptions, hook events)."""
+        client_id = self._client_ids.pop(queue, None)
+        if client_id is not None:
+            del self._clients[client_id]
+            self._send([b"close", client_id])
+
+    def report(self, stats):
+        self._send([b"stats", json.dumps(stats).encode()])
+
+    def close(self):
+        for future in self._calls.values():
+            future.cancel()
+        self._dealer.close()
+        self._sub.close()
+        self._context.term()
+
+
+class RemotePool:
+    """Worker-side stand-in for the hub's BackendPool of one endpoint.
+
+    Requests are sent by the hub through its pool. Replies update tree_id
+    the way BackendPool's do, so a TreeCache can sit on top. PUB messages
+    are relayed by the hub while this pool has listeners.
+    """
+
+    def __init__(self, link, bt_ip, req_port, pub_port):
+        self.link = link
+        self.endpoint = (bt_ip, req_port, pub_port)
+        self.key = endpoint_key(self.endpoint)
+        self.req_endpoint = f"tcp://{bt_ip}:{req_port}"
+        self.pub_endpoint = f"tcp://{bt_ip}:{pub_port}"
+        self._tree_id_bytes = None
+        self.tree_id = None
+        self.tree_id_seen_at = 0.0
+        self._tree_change_callbacks = []
+        self._listeners = set()
+        self._stats = {"requests": 0, "pub_messages": 0, "pub_dropped": 0}
+        link.pools[self.key] = self
+
+    async def request(self, frames, timeout=None):
+        self._stats["requests"] += 1
+        reply_parts = await self.link.call(None, self.endpoint, "request", frames, timeout)
+        self._observe_tree_id(reply_parts)
+        return reply_parts
+
+    async def request_shared(self, frames, timeout=None):
+        """request() coalesced in the hub with identical requests of every worker."""
+        self._stats["requests"] += 1
+        reply_parts = await self.link.call(None, self.endpoint, "request_shared", frames, timeout)
+        self._observe_tree_id(reply_parts)
+        return reply_parts
+
+    def _observe_tree_id(self, reply_parts):
+        reply_raw = reply_parts[0]
+        if len(reply_raw) < 22:  # error replies carry no header
+            return
+        self.tree_id_seen_at = time.monotonic()
+        tree_id_bytes = bytes(reply_raw[6:22])
+        if tree_id_bytes == self._tree_id_bytes:
+            return
+        self._tree_id_bytes = tree_id_bytes
+        self.tree_id = str(UUID(bytes=tree_id_bytes))
+        for callback in self._tree_change_callbacks:
+            try:
+                callback(self.tree_id)
+            except Exception as e:
+                logger.error(f"Tree change callback failed: {e}")
+
+    def add_tree_change_callback(self, callback):
+        self._tree_change_callbacks.append(callback)
+
+    def remove_tree_change_callback(self, callback):
+        if callback in self._tree_change_callbacks:
+            self._tree_change_callbacks.remove(callback)
+
+    def tree_id_age(self):
+        return time.monotonic() - self.tree_id_seen_at
+
+    def add_listener(self):
+        """Registers a session for PUB messages and returns its queue."""
+        queue = asyncio.Queue(maxsize=LISTENER_QUEUE_SIZE)
+        if not self._listeners:
+            self.link.notify(None, self.endpoint, "events", True)
+        self._listeners.add(queue)
+        return queue
+
+    def remove_listener(self, queue):
+        if queue in self._listeners:
+            self._listeners.discard(queue)
+            if not self._listeners:
+                self.link.notify(None, self.endpoint, "events", False)
+
+    def deliver(self, frames):
+        self._stats["pub_messages"] += 1
+        for queue in self._listeners:
+            try:
+                queue.put_nowait(frames)
+            except asyncio.QueueFull:
+                self._stats["pub_dropped"] += 1
+
+    def stats(self):
+        return {"endpoint": self.req_endpoint, "pub_endpoint": self.pub_endpoint, "listeners": len(self._listeners),
+                "tree_id": self.tree_id, **self._stats}
+
+    def close(self):
+        if self._listeners:
+            self._listeners.clear()
+            self.link.notify(None, self.endpoint, "events", False)
+        self.link.pools.pop(self.key, None)
+
+
+class RemotePoolManager:
+    """ConnectionPoolManager stand-in of a worker: one RemotePool per backend endpoint."""
+
+    def __init__(self, link):
+        self.link = link
+        self._pools = {}
+
+    def get_pool(self, bt_ip, req_port, pub_port):
+        key = (bt_ip, req_port, pub_port)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = RemotePool(self.link, *key)
+        return pool
+
+    def release_pool(self, bt_ip, req_port, pub_port):
+        pool = self._pools.pop((bt_ip, req_port, pub_port), None)
+        if pool is not None:
+            pool.close()
+
+    def stats(self):
+        return [pool.stats() for pool in self._pools.values()]
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
+
+
+def run_worker(index, host, port, directory, make_handler, log_level=logging.INFO, queue_options=None,
+               deflate_options=None):
+    """Entry point of a worker process. `make_handler(link, send_queues)` returns the WebSocket
+    handler (see proxy.make_worker_handler); `queue_options` are SendQueues keyword arguments
+    and `deflate_options` ws_compression.server_extensions() ones."""
+    # Unpickling `make_handler` may already have configured logging
+    logging.basicConfig(level=log_level, force=True,
+                        format=f'%(asctime)s [%(levelname)s] worker-{index} %(funcName)s:%(lineno)d - %(message)s')
+    log_listener = queue_logging()
+    try:
+        asyncio.run(_worker_main(worker_topic(index), host, port, directory, make_handler,
+                                 SendQueues(**(queue_options or {})), server_extensions(**(deflate_options or {}))))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log_listener.stop()
+
+
+async def _worker_main(worker_id, host, port, directory, make_handler, send_queues, extensions):
+    link = HubLink(worker_id, directory)
+
+    async def report_stats():
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            link.report({"sendQueues": send_queues.stats(), "metrics": REGISTRY.export()})
+
+    async def watch_hub():
+        # Stop serving when the hub dies without terminating its workers
+        parent = multiprocessing.parent_process()
+        while parent is None or parent.is_alive():
+            await asyncio.sleep(PARENT_CHECK_INTERVAL)
+        logger.warning(f"Hub exited, stopping worker {worker_id.decode()}")
+
+    try:
+        await link.connect()
+        handler = make_handler(link, send_queues)
+        async with websockets.serve(handler, host, port, select_subprotocol=select_subprotocol, reuse_port=True,
+                                    compression=None, extensions=extensions):
+            logger.info(f"Worker {worker_id.decode()} serving ws://{host}:{port}")
+            tasks = [asyncio.create_task(link.run()), asyncio.create_task(report_stats())]
+            await watch_hub()
+            for task in tasks:
+                task.cancel()
+    finally:
+        link.close()
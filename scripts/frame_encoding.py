@@ -0,0 +1,94 @@
+"""
+JSON encoding of outbound WebSocket frames.
+
+encode_json() uses orjson when it is installed (several times faster than
+the stdlib on large payloads such as tree XML or big blackboards) and the
+json module otherwise. Both return the UTF-8 bytes that go on the wire, so
+callers don't care which encoder ran.
+
+JSON frames stay bytes all the way to the socket and are sent as text
+frames with send(frame, text=True): websockets would otherwise encode a
+str again for every client. is_text_frame() tells them apart from binary
+frames (binary_frames.py), whose first byte is a kind below b"{".
+
+Broadcast frames are encoded once and the same bytes are handed to every
+recipient (see StatusPoller/BlackboardPoller). FrameCache additionally
+keeps encoded frames of immutable payloads, e.g. the treeData reply for
+one tree, so repeated requests skip encoding altogether.
+"""
+
+import json
+import logging
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder is used instead
+    orjson = None
+
+logger = logging.getLogger("proxy.frame_encoding")
+
+DEFAULT_FRAME_CACHE_SIZE = 8
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY if orjson is not None else 0
+
+
+def encode_json(obj, use_orjson=True):
+    """Encodes a frame payload as UTF-8 JSON bytes."""
+    if orjson is not None and use_orjson:
+        try:
+            return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which the stdlib encoder accepts
+            pass
+    return json.dumps(obj).encode('utf-8')
+
+
+def is_text_frame(frame):
+    """True for JSON frames (str or encode_json() bytes), which are sent as text frames."""
+    return isinstance(frame, str) or frame[:1] == b"{"
+
+
+def frame_size(frame):
+    """Bytes `frame` takes on the wire (before framing); a str counts as its UTF-8 encoding."""
+    return len(frame.encode('utf-8')) if isinstance(frame, str) else len(frame)
+
+
+async def send_frame(websocket, frame):
+    """Sends a frame from encode_json() or binary_frames as a text or binary frame."""
+    await websocket.send(frame, text=is_text_frame(frame))
+
+
+def encoder_name():
+    return "orjson" if orjson is not None else "json"
+
+
+class FrameCache:
+    """Small LRU of encoded frames whose payload never changes for a given key."""
+
+    def __init__(self, max_entries=DEFAULT_FRAME_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._frames = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def get(self, key, build):
+        """Returns the encoded frame for `key`, encoding `build()` on a miss."""
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+            self._stats["hits"] += 1
+            return frame
+
+        self._stats["misses"] += 1
+        frame = self._frames[key] = encode_json(build())
+        while len(self._frames) > self.max_entries:
+            self._frames.popitem(last=False)
+        return frame
+
+    def stats(self):
+        return {
+            "encoder": encoder_name(),
+            "entries": len(self._frames),
+            "bytes": sum(len(frame) for frame in self._frames.values()),
+            **self._stats,
+        }
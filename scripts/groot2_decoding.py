@@ -0,0 +1,133 @@
+"""
+Bulk decoding of Groot2 STATUS and GET_TRANSITIONS payloads.
+
+STATUS replies are packed 3-byte records (uint16 uid, uint8 status) and
+GET_TRANSITIONS replies packed 9-byte records (48-bit timestamp in
+microseconds since recording start, uint16 uid, uint8 status). Instead of
+unpacking record by record, these helpers decode a whole buffer into
+columnar arrays:
+
+- with NumPy (optional), through a structured dtype and np.frombuffer;
+- without it, by transposing the buffer with extended slices, which copies
+  each column in C and leaves no per-record Python loop.
+
+Multi-byte fields default to network byte order, matching
+parse_raw_status_data and docs/groot2_protocol.md. Pass byteorder="little"
+for publishers that write host order on little-endian machines.
+"""
+
+import sys
+from array import array
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the stdlib path is used instead
+    np = None
+
+STATUS_RECORD_SIZE = 3
+TRANSITION_RECORD_SIZE = 9
+TIMESTAMP_SIZE = 6
+
+StatusColumns = namedtuple("StatusColumns", ["uid", "status"])
+TransitionColumns = namedtuple("TransitionColumns", ["timestamp", "uid", "status"])
+
+_BYTE_ORDER_PREFIX = {"big": ">", "little": "<"}
+
+
+def _status_dtype(byteorder):
+    prefix = _BYTE_ORDER_PREFIX[byteorder]
+    return np.dtype([("uid", prefix + "u2"), ("status", "u1")])
+
+
+def _transition_dtype(byteorder):
+    prefix = _BYTE_ORDER_PREFIX[byteorder]
+    return np.dtype([("timestamp", "u1", (TIMESTAMP_SIZE,)), ("uid", prefix + "u2"), ("status", "u1")])
+
+
+def _whole_records(payload, record_size):
+    view = memoryview(payload)
+    return view[:len(view) - len(view) % record_size]
+
+
+def _uint_column(view, record_size, offset, width, byteorder, typecode):
+    """Gathers a `width`-byte unsigned field of every record into an array of `typecode`.
+
+    Each byte of the field is copied with one extended-slice assignment into
+    a native-order buffer, zero-extended to the array item size.
+    """
+    count = len(view) // record_size
+    item_size = array(typecode).itemsize
+    buffer = bytearray(count * item_size)
+    for byte in range(width):
+        source = offset + (width - 1 - byte if byteorder == "big" else byte)
+        # Position of the byte with significance `byte` in a native-order item
+        target = byte if sys.byteorder == "little" else item_size - 1 - byte
+        buffer[target::item_size] = view[source::record_size]
+    return array(typecode, buffer)
+
+
+def decode_status(payload, byteorder="big", use_numpy=True):
+    """Decodes a STATUS body into StatusColumns(uid, status).
+
+    Columns are NumPy arrays when NumPy is available, otherwise an
+    array('H') of uids and a bytes object of status codes. A trailing
+    partial record is ignored.
+    """
+    view = _whole_records(payload, STATUS_RECORD_SIZE)
+    if np is not None and use_numpy:
+        records = np.frombuffer(view, dtype=_status_dtype(byteorder))
+        return StatusColumns(records["uid"], records["status"])
+    return StatusColumns(
+        _uint_column(view, STATUS_RECORD_SIZE, 0, 2, byteorder, "H"),
+        view[2::STATUS_RECORD_SIZE].tobytes(),
+    )
+
+
+def decode_transitions(payload, byteorder="big", use_numpy=True):
+    """Decodes a GET_TRANSITIONS body into TransitionColumns(timestamp, uid, status).
+
+    Timestamps are microseconds since recording started. Columns are NumPy
+    arrays when NumPy is available, otherwise array('Q'), array('H') and bytes.
+    """
+    view = _whole_records(payload, TRANSITION_RECORD_SIZE)
+    if np is not None and use_numpy:
+        records = np.frombuffer(view, dtype=_transition_dtype(byteorder))
+        stamp_bytes = records["timestamp"]
+        if byteorder == "big":
+            stamp_bytes = stamp_bytes[:, ::-1]
+        # Widen the 48-bit field into zeroed little-endian uint64 slots
+        widened = np.zeros((len(records), 8), dtype=np.uint8)
+        widened[:, :TIMESTAMP_SIZE] = stamp_bytes
+        timestamps = widened.view("<u8").ravel()
+        return TransitionColumns(timestamps, records["uid"], records["status"])
+    return TransitionColumns(
+        _uint_column(view, TRANSITION_RECORD_SIZE, 0, TIMESTAMP_SIZE, byteorder, "Q"),
+        _uint_column(view, TRANSITION_RECORD_SIZE, TIMESTAMP_SIZE, 2, byteorder, "H"),
+        view[8::TRANSITION_RECORD_SIZE].tobytes(),
+    )
+
+
+def _tolist(column):
+    return column.tolist() if hasattr(column, "tolist") else list(column)
+
+
+def status_to_records(columns):
+    """Converts StatusColumns to the [{"uid", "status"}] list sent to clients."""
+    return [{"uid": uid, "status": status}
+            for uid, status in zip(_tolist(columns.uid), _tolist(columns.status))]
+
+
+def transitions_to_records(columns):
+    """Converts TransitionColumns to the [{"timestamp", "uid", "status"}] list sent to clients."""
+    return [{"timestamp": timestamp, "uid": uid, "status": status}
+            for timestamp, uid, status in zip(_tolist(columns.timestamp), _tolist(columns.uid),
+                                              _tolist(columns.status))]
+
+
+def changed_indices(previous, current):
+    """Positions at which two equally long byte columns differ."""
+    if np is not None:
+        mask = np.frombuffer(previous, dtype=np.uint8) != np.frombuffer(current, dtype=np.uint8)
+        return np.flatnonzero(mask).tolist()
+    return [index for index, (old, new) in enumerate(zip(previous, current)) if old != new]
@@ -0,0 +1,123 @@
+"""
+Groot2 protocol helpers shared by the proxy modules.
+
+Request headers are 6 bytes (protocol, type, unique_id); reply headers are
+the echoed request header followed by the 16-byte tree UUID. See
+docs/groot2_protocol.md for the full message reference.
+"""
+
+import logging
+import struct
+import traceback
+from uuid import UUID
+
+import msgpack
+
+from groot2_decoding import decode_status, status_to_records
+
+logger = logging.getLogger("proxy.groot2_protocol")
+
+PROTOCOL_ID = 2
+REQUEST_HEADER_SIZE = 6
+REPLY_HEADER_SIZE = 22
+
+# Global request ID counter
+request_id_counter = 1
+
+def get_next_request_id():
+    """Generates a unique, sequential request ID."""
+    global request_id_counter
+    request_id = request_id_counter
+    request_id_counter += 1
+    return request_id
+
+def serialize_request_header(protocol, type_char, unique_id):
+    """Serializes the Groot2 request header into a buffer."""
+    try:
+        result = struct.pack('!BBi', protocol, ord(type_char), unique_id)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Serialized header: protocol={protocol}, type='{type_char}', id={unique_id}, hex: {result.hex()}")
+        return result
+    except Exception as e:
+        logger.error(f"Failed to serialize header: {e}")
+        logger.error(traceback.format_exc())
+        raise
+
+def deserialize_reply_header(buffer):
+    """Deserializes the Groot2 reply header from a buffer."""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Deserializing reply header, buffer length: {len(buffer)}, hex: {bytes(buffer[:22]).hex()}")
+
+    if len(buffer) < 22:
+        error_msg = f"Reply header too short: {len(buffer)} bytes, expected 22"
+        logger.error(error_msg)
+        raise ValueError(error_msg)
+    
+    try:
+        protocol, type_code, unique_id = struct.unpack('!BBi', buffer[:6])
+        tree_id_bytes = buffer[6:22]
+        tree_id = UUID(bytes=tree_id_bytes)
+        
+        result = {
+            "protocol": protocol,
+            "type": chr(type_code),
+            "unique_id": unique_id,
+            "tree_id": str(tree_id)
+        }
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Header deserialized: {result}")
+        return result
+    except Exception as e:
+        logger.error(f"Failed to deserialize header: {e}")
+        logger.error(traceback.format_exc())
+        raise
+
+def is_error_reply(reply_parts):
+    """True for the two-part ("error", message) reply the backend sends on failure."""
+    return len(reply_parts) >= 2 and reply_parts[0] == b'error'
+
+def split_reply(reply_parts):
+    """Splits a reply into its decoded header and body.
+
+    The backend sends the body as a separate part, but a body appended to
+    the 22-byte header in the first part is accepted as well.
+    """
+    if is_error_reply(reply_parts):
+        raise ValueError(f"Backend error: {reply_parts[1].decode('utf-8', errors='replace')}")
+
+    reply_raw = reply_parts[0]
+    if len(reply_raw) < REPLY_HEADER_SIZE:
+        raise ValueError(f"Backend error: {reply_raw.decode('utf-8', errors='replace')}")
+
+    header_data = deserialize_reply_header(reply_raw[:REPLY_HEADER_SIZE])
+    body = reply_raw[REPLY_HEADER_SIZE:] + b''.join(reply_parts[1:])
+    return header_data, body
+
+def pub_event_topic(frame):
+    """Returns the topic of a PUB message from its first frame.
+
+    BT.CPP publishes events with a request header as the first frame, whose
+    type char ('N' for BREAKPOINT_REACHED) is the topic; any other first
+    frame is taken as a plain topic string.
+    """
+    if len(frame) == REQUEST_HEADER_SIZE and frame[0] == PROTOCOL_ID:
+        return chr(frame[1])
+    return frame.decode('utf-8', errors='replace')
+
+def decode_status_payload(status_payload):
+    """Decodes a STATUS reply body into the structure sent to clients."""
+    if not status_payload:
+        return {}
+    try:
+        return msgpack.unpackb(status_payload, raw=False)
+    except Exception as msgpack_error:
+        logger.debug(f"Status payload is not msgpack ({msgpack_error}), using raw parse.")
+        return parse_raw_status_data(status_payload)
+
+def parse_raw_status_data(payload):
+    """Parse raw status data as node UID + status pairs."""
+    try:
+        return status_to_records(decode_status(payload))
+    except Exception as e:
+        logger.error(f"Failed to parse raw status data: {e}")
+        return []
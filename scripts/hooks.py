@@ -0,0 +1,385 @@
+"""
+Hook (breakpoint) table handling: batched changes and a proxy-side mirror.
+
+HOOK_INSERT ('I') accepts a JSON array, so a list of hooks goes to the
+backend as one request per MAX_HOOKS_PER_REQUEST hooks instead of one per
+hook. HOOK_REMOVE ('R') only takes a single object; removals are sent
+together and share the pipelined connection (and the control class slots
+of the request scheduler), so they cost one round trip per backend slot
+rather than one per hook.
+
+Each item gets its own result. Items are checked before anything is sent;
+when the backend rejects a whole insert batch its hooks are retried one
+by one, so a single bad hook does not fail the others. BT.CPP skips array
+items whose node does not exist without an error, so with verify=True the
+hook table is dumped ('D') afterwards and such items are reported as not
+found. The dump only lists PRE hooks, so POST hooks cannot be verified;
+their results carry "verified": false.
+
+HookTable mirrors one backend's hook table so getHooks and per-node
+lookups are answered without a HOOKS_DUMP ('D') round trip. It applies
+the proxy's own successful I/R/U/A/X requests and is reconciled against a
+dump every `reconcile_interval` seconds and after the backend switches
+trees, which also catches changes made by other Groot2 clients.
+
+BT.CPP's HOOKS_DUMP only lists PRE hooks (POST hooks live in a separate
+table it does not serialize), so only PRE hooks are reconciled. POST hooks
+are mirrored from the proxy's own requests and kept across dumps of the
+same tree; POST hooks set or removed by other clients are not seen, and
+the mirrored ones are dropped when the backend switches trees. Every
+change is pushed to the backend's clients as a hooksChanged frame:
+
+    {"type": "hooksChanged", "payload": {"version": 7, "reason": "insert",
+     "set": [hook, ...], "removed": [{"uid": 3, "position": 0}, ...], "count": 12}}
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+from frame_encoding import encode_json
+from groot2_protocol import get_next_request_id, serialize_request_header, split_reply, PROTOCOL_ID
+
+logger = logging.getLogger("proxy.hooks")
+
+MAX_HOOKS_PER_REQUEST = 256
+# Fields BT.CPP requires in a HOOK_INSERT item; items may leave them out
+HOOK_DEFAULTS = {"enabled": True, "mode": 0, "once": False, "desired_status": "SUCCESS", "position": 0}
+HOOK_POSITIONS = (0, 1)  # PRE, POST
+POST = 1  # HOOKS_DUMP does not list hooks at this position
+HOOK_MODES = (0, 1)  # BREAKPOINT, REPLACE
+DESIRED_STATUSES = ("SUCCESS", "FAILURE", "SKIPPED")
+MAX_UID = 0xFFFF
+DEFAULT_RECONCILE_INTERVAL = 30.0  # seconds between HOOKS_DUMP reconciliations
+NODE_NOT_FOUND = "Node ID not found"
+# Mirror updates by request type
+CHANGE_REASONS = {'I': "insert", 'R': "remove", 'U': "unlock", 'A': "removeAll", 'X': "disableAll"}
+
+
+def hook_key(hook):
+    """(uid, position) identifying a hook in the backend's table."""
+    return hook["uid"], hook.get("position", 0)
+
+
+def normalize_hook(item, defaults=None):
+    """A complete HOOK_INSERT object from a client item (a uid or an object).
+
+    Raises ValueError for items the backend would reject.
+    """
+    if isinstance(item, bool) or not isinstance(item, (int, dict)):
+        raise ValueError("Hook must be a node uid or an object")
+    hook = {**HOOK_DEFAULTS, **(defaults or {}), **(item if isinstance(item, dict) else {"uid": item})}
+    uid = hook.get("uid")
+    if isinstance(uid, bool) or not isinstance(uid, int) or not 0 <= uid <= MAX_UID:
+        raise ValueError(f"Invalid uid: {uid!r}")
+    if hook["position"] not in HOOK_POSITIONS:
+        raise ValueError(f"Invalid position: {hook['position']!r}")
+    if hook["mode"] not in HOOK_MODES:
+        raise ValueError(f"Invalid mode: {hook['mode']!r}")
+    if hook["desired_status"] not in DESIRED_STATUSES:
+        raise ValueError(f"Invalid desired_status: {hook['desired_status']!r}")
+    return hook
+
+
+def _result(hook, error=None):
+    result = {"uid": hook.get("uid"), "position": hook.get("position", 0), "success": error is None}
+    if error is not None:
+        result["error"] = error
+    return result
+
+
+def _check_items(items, defaults, normalize):
+    """Splits client items into (index, hook) to send and results of rejected items."""
+    if not isinstance(items, list):
+        raise ValueError("hooks must be a list")
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, normalize(item, defaults)))
+        except (ValueError, TypeError) as e:
+            results[index] = _result(item if isinstance(item, dict) else {"uid": item}, str(e))
+    return valid, results
+
+
+async def _request(pool, type_char, body=None):
+    header = serialize_request_header(PROTOCOL_ID, type_char, get_next_request_id())
+    return split_reply(await pool.request([header] if body is None else [header, body]))
+
+
+async def dump_hooks(pool):
+    """The backend's hooks (HOOKS_DUMP) and the reply header."""
+    header, body = await _request(pool, 'D')
+    return (json.loads(body) if body else []), header
+
+
+def _summary(results, requests):
+    failed = sum(not result["success"] for result in results)
+    return {"results": results, "succeeded": len(results) - failed, "failed": failed, "requests": requests}
+
+
+async def insert_hooks(pool, items, defaults=None, verify=False, max_per_request=MAX_HOOKS_PER_REQUEST, table=None):
+    """Inserts hooks with as few HOOK_INSERT requests as possible.
+
+    Returns {"results": [per item], "succeeded", "failed", "requests": backend round trips}.
+    Inserted hooks are applied to the HookTable `table`, if given.
+    """
+    valid, results = _check_items(items, defaults, normalize_hook)
+    requests = 0
+    unknown = set()  # items whose request failed without a clean rejection (e.g. a timeout)
+
+    def fail(index, hook, error):
+        results[index] = _result(hook, str(error))
+        if not isinstance(error, ValueError):
+            unknown.add(index)
+
+    async def insert_one(index, hook):
+        try:
+            await _request(pool, 'I', json.dumps(hook).encode("utf-8"))
+            results[index] = _result(hook)
+        except Exception as e:
+            fail(index, hook, e)
+
+    for start in range(0, len(valid), max_per_request):
+        chunk = valid[start:start + max_per_request]
+        requests += 1
+        try:
+            await _request(pool, 'I', json.dumps([hook for _, hook in chunk]).encode("utf-8"))
+        except Exception as e:
+            if len(chunk) == 1:
+                fail(*chunk[0], e)
+                continue
+            logger.warning(f"Batch of {len(chunk)} hooks rejected ({e}); inserting them one by one")
+            requests += len(chunk)
+            await asyncio.gather(*(insert_one(index, hook) for index, hook in chunk))
+            continue
+        for index, hook in chunk:
+            results[index] = _result(hook)
+
+    if table is not None:
+        table.apply('I', [hook for index, hook in valid if results[index]["success"]])
+        if unknown:
+            # Those hooks may or may not have been inserted
+            table.invalidate()
+    if verify and valid:
+        requests += 1
+        dumped, header = await dump_hooks(pool)
+        present = {hook_key(hook) for hook in dumped}
+        for index, hook in valid:
+            if not results[index]["success"]:
+                continue
+            if hook["position"] == POST:
+                results[index]["verified"] = False
+            elif hook_key(hook) not in present:
+                results[index] = _result(hook, NODE_NOT_FOUND)
+        if table is not None:
+            table.replace(dumped, header)
+    return _summary(results, requests)
+
+
+def _normalize_removal(item, defaults=None):
+    hook = {"position": 0, **(defaults or {}), **(item if isinstance(item, dict) else {"uid": item})}
+    uid = hook.get("uid")
+    if isinstance(uid, bool) or not isinstance(uid, int) or not 0 <= uid <= MAX_UID:
+        raise ValueError(f"Invalid uid: {uid!r}")
+    if hook["position"] not in HOOK_POSITIONS:
+        raise ValueError(f"Invalid position: {hook['position']!r}")
+    return {"uid": uid, "position": hook["position"]}
+
+
+async def remove_hooks(pool, items, defaults=None, table=None):
+    """Removes hooks with one pipelined HOOK_REMOVE request each; same result shape as insert_hooks."""
+    valid, results = _check_items(items, defaults, _normalize_removal)
+
+    async def remove_one(index, hook):
+        try:
+            await _request(pool, 'R', json.dumps(hook).encode("utf-8"))
+            results[index] = _result(hook)
+        except Exception as e:
+            results[index] = _result(hook, str(e))
+
+    await asyncio.gather(*(remove_one(index, hook) for index, hook in valid))
+    if table is not None:
+        # A hook the backend did not have is not in its table either
+        gone = [hook for index, hook in valid
+                if results[index]["success"] or NODE_NOT_FOUND in results[index]["error"]]
+        table.apply('R', gone)
+        if len(gone) < len(valid):
+            # Other failures (e.g. a timeout) leave those hooks' state unknown
+            table.invalidate()
+    return _summary(results, len(valid))
+
+
+class HookTable:
+    """Mirror of one backend's hook table, kept in step with the proxy's own changes."""
+
+    def __init__(self, pool, reconcile_interval=DEFAULT_RECONCILE_INTERVAL, broadcast=None):
+        """`broadcast(targets, frame)` delivers hooksChanged frames to the listeners
+        (see send_queue.broadcast and fanout.Hub.broadcast)."""
+        self.pool = pool
+        self.reconcile_interval = reconcile_interval
+        self._broadcast = broadcast
+        self._hooks = {}  # (uid, position) -> hook
+        self.header = None  # reply header of the last dump
+        self.synced = False  # mirrors the backend since the last dump of the current tree
+        self.version = 0
+        self._changes = 0  # local changes applied; dumps sent before one are stale
+        self._listeners = set()
+        self._task = None
+        self._wake = None
+        self._dump = None  # shared in-flight reconciliation
+        self._stats = {"reconciles": 0, "drift": 0, "stale_dumps": 0, "served": 0, "events": 0,
+                       "errors": 0, "last_reconcile_ms": 0.0}
+        pool.add_tree_change_callback(self._on_tree_change)
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    async def hooks(self, refresh=False):
+        """All hooks, from the mirror once it has been synced with a dump."""
+        if refresh or not self.synced:
+            await self.reconcile()
+        self._stats["served"] += 1
+        return list(self._hooks.values())
+
+    async def node_hooks(self, uid):
+        """Hooks of one node (PRE and POST)."""
+        if not self.synced:
+            await self.reconcile()
+        self._stats["served"] += 1
+        return [hook for position in HOOK_POSITIONS
+                if (hook := self._hooks.get((uid, position))) is not None]
+
+    # ------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------
+
+    def apply(self, type_char, hooks=None):
+        """Applies a successful I/R/U/A/X request with body `hooks` (one object or a list)."""
+        if isinstance(hooks, dict):
+            hooks = [hooks]
+        hooks = [hook for hook in hooks or [] if isinstance(hook, dict) and "uid" in hook]
+        self._changes += 1
+        before = dict(self._hooks)
+        if type_char == 'I':
+            for hook in hooks:
+                self._hooks[hook_key(hook)] = {**self._hooks.get(hook_key(hook), {}), **hook}
+        elif type_char == 'R':
+            for hook in hooks:
+                self._hooks.pop(hook_key(hook), None)
+        elif type_char == 'U':
+            # Hooks set to fire once, or unlocked with remove_when_done, are gone afterwards
+            for unlock in hooks:
+                hook = self._hooks.get(hook_key(unlock))
+                if hook is not None and (hook.get("once") or unlock.get("remove_when_done")):
+                    del self._hooks[hook_key(unlock)]
+        elif type_char == 'A':
+            self._hooks.clear()
+        elif type_char == 'X':
+            self._hooks = {key: {**hook, "enabled": False} for key, hook in self._hooks.items()}
+        self._publish(before, CHANGE_REASONS.get(type_char, type_char))
+
+    def replace(self, hooks, header=None):
+        """Replaces the mirror's PRE hooks with a dump of the backend's table.
+
+        POST hooks are not dumped; they are kept unless the dump is of another tree.
+        """
+        before = self._hooks
+        same_tree = header is None or self.header is None or header.get("tree_id") == self.header.get("tree_id")
+        self._hooks = {key: hook for key, hook in before.items() if key[1] == POST and same_tree}
+        self._hooks.update((hook_key(hook), hook) for hook in hooks if hook_key(hook)[1] != POST)
+        self.header = header
+        self.synced = header is None or header.get("tree_id") == self.pool.tree_id
+        if self._publish(before, "reconcile"):
+            self._stats["drift"] += 1
+
+    async def reconcile(self):
+        """Reloads the mirror from HOOKS_DUMP; concurrent callers share one dump."""
+        if self._dump is None or self._dump.done():
+            self._dump = asyncio.ensure_future(self._reconcile())
+        await asyncio.shield(self._dump)
+
+    async def _reconcile(self):
+        changes = self._changes
+        started = time.perf_counter()
+        hooks, header = await dump_hooks(self.pool)
+        self._stats["reconciles"] += 1
+        self._stats["last_reconcile_ms"] = (time.perf_counter() - started) * 1000
+        if changes != self._changes:
+            # A change was applied while the dump was on its way; it may predate the change
+            self._stats["stale_dumps"] += 1
+            self._wake_up()
+            return
+        self.replace(hooks, header)
+
+    def invalidate(self):
+        """Makes the next read reload the mirror, e.g. after requests with an unknown outcome."""
+        self.synced = False
+        self._wake_up()
+
+    def _on_tree_change(self, tree_id):
+        self.invalidate()
+
+    def _publish(self, before, reason):
+        """Sends the difference to `before` to the listeners; returns whether anything changed."""
+        changed = [hook for key, hook in self._hooks.items() if before.get(key) != hook]
+        removed = [{"uid": uid, "position": position} for uid, position in before if (uid, position) not in self._hooks]
+        if not changed and not removed:
+            return False
+        self.version += 1
+        if self._listeners and self._broadcast is not None:
+            self._stats["events"] += 1
+            self._broadcast(list(self._listeners), encode_json({
+                "type": "hooksChanged",
+                "payload": {"version": self.version, "reason": reason, "set": changed,
+                            "removed": removed, "count": len(self._hooks)},
+            }))
+        return True
+
+    # ------------------------------------------------------------------
+    # Listeners and periodic reconciliation
+    # ------------------------------------------------------------------
+
+    def add_listener(self, websocket):
+        self._listeners.add(websocket)
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def remove_listener(self, websocket):
+        self._listeners.discard(websocket)
+
+    def _wake_up(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _run(self):
+        """Reconciles while clients are connected: on start, periodically and when woken."""
+        while self._listeners:
+            # Cleared first, so a wake-up during the dump triggers the next one
+            self._wake.clear()
+            try:
+                await self.reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.warning(f"Hook table reconciliation with {self.pool.req_endpoint} failed: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.reconcile_interval or None)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self):
+        return {"hooks": len(self._hooks), "version": self.version, "synced": self.synced,
+                "listeners": len(self._listeners), "reconcile_interval": self.reconcile_interval, **self._stats}
+
+    def close(self):
+        self.pool.remove_tree_change_callback(self._on_tree_change)
+        if self._task is not None:
+            self._task.cancel()
+        if self._dump is not None:
+            self._dump.cancel()
+        self._listeners.clear()
@@ -0,0 +1,238 @@
+"""
+Prometheus metrics for the proxy, served as plain text on a separate local port.
+
+Hot paths only touch instruments defined here (Counter, Gauge, Histogram):
+an observation is a dict lookup and a few additions, so metrics can stay
+on in production. Numbers the proxy already keeps in some stats() method
+(pools, caches, pollers, send queues) are not duplicated; collectors
+registered with add_collector() read them only when /metrics is scraped.
+Other processes (the --workers processes) send their instruments' export()
+to the process serving /metrics, which renders them with set_remote()
+under a label naming the source.
+
+    metrics = MetricsServer(REGISTRY)
+    await metrics.start("127.0.0.1", 9108)
+
+The output follows the Prometheus text exposition format 0.0.4, so no
+client library is needed.
+"""
+
+import asyncio
+import logging
+import math
+from bisect import bisect_left
+
+logger = logging.getLogger("proxy.metrics")
+
+DEFAULT_METRICS_HOST = "127.0.0.1"
+# Seconds; backend round trips are sub-millisecond locally, FULLTREE fetches can take seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+MAX_REQUEST_HEADER_LINES = 100
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values tuple -> value
+
+    def _labels(self, values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        return dict(zip(self.labelnames, values))
+
+    def samples(self):
+        """Yields (name, labels, value) for the exposition."""
+        for values, value in self._values.items():
+            yield self.name, self._labels(values), value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            # Per-bucket counts (not cumulative), then sum
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        for values, (counts, total) in self._values.items():
+            labels = self._labels(values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class MetricsRegistry:
+    """Instruments and scrape-time collectors rendered together on /metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._remote = {}  # (label name, source) -> families from export()
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collect):
+        """`collect()` returns [(name, kind, documentation, [(labels, value), ...]), ...]."""
+        self._collectors.append(collect)
+
+    def remove_collector(self, collect):
+        if collect in self._collectors:
+            self._collectors.remove(collect)
+
+    def export(self):
+        """Current samples of the instruments: [(name, kind, documentation, [(sample name, labels, value)])]."""
+        return [(metric.name, metric.kind, metric.documentation, list(metric.samples()))
+                for metric in self._metrics.values()]
+
+    def set_remote(self, source, families, label="worker"):
+        """Renders `families` (another process's export()) with every sample labelled `label`=`source`;
+        None forgets the source."""
+        if families is None:
+            self._remote.pop((label, source), None)
+        else:
+            self._remote[(label, source)] = families
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, documentation, samples):
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+
+        # A family may appear only once, so remote samples join the local family of the same name
+        merged = {metric.name: (metric.kind, metric.documentation, list(metric.samples()))
+                  for metric in self._metrics.values()}
+        for (label, source), remote in self._remote.items():
+            for name, kind, documentation, samples in remote:
+                entry = merged.setdefault(name, (kind, documentation, []))
+                entry[2].extend((sample_name, {**labels, label: source}, value)
+                                for sample_name, labels, value in samples)
+        for name, (kind, documentation, samples) in merged.items():
+            family(name, kind, documentation, samples)
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                logger.warning(f"Metrics collector {collect!r} failed: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                family(name, kind, documentation, ((name, labels, value) for labels, value in samples))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class MetricsServer:
+    """Minimal HTTP server answering GET /metrics with the registry's text exposition."""
+
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+        self._server = None
+        self.scrapes = 0
+
+    async def start(self, host=DEFAULT_METRICS_HOST, port=0):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                request_line = (await reader.readline()).decode("latin-1").split()
+                for _ in range(MAX_REQUEST_HEADER_LINES):
+                    if (await reader.readline()) in (b"\r\n", b"\n", b""):
+                        break
+            except (asyncio.LimitOverrunError, ValueError) as e:
+                # A request or header line longer than the stream limit
+                logger.debug(f"Rejecting metrics request: {e}")
+                await self._respond(writer, "400 Bad Request", "text/plain", b"Bad request\n")
+                return
+            path = request_line[1].split("?", 1)[0] if len(request_line) >= 2 else ""
+            if request_line[:1] != ["GET"] or path not in ("/metrics", "/"):
+                status, content_type, body = "404 Not Found", "text/plain", b"Not found\n"
+            else:
+                self.scrapes += 1
+                status, content_type, body = "200 OK", CONTENT_TYPE, self.registry.render().encode("utf-8")
+            await self._respond(writer, status, content_type, body)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, content_type, body):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
@@ -1,16 +1,76 @@
 import asyncio
 import json
-import zmq
-import zmq.asyncio
 import websockets
-import struct
 import logging
 import traceback
 import time
 import msgpack
 import argparse
-from datetime import datetime
-from uuid import UUID
+import os
+import tempfile
+import signal
+import multiprocessing
+from collections import defaultdict
+from functools import partial
+from urllib.parse import urlsplit, parse_qs
+
+from groot2_protocol import (
+    get_next_request_id,
+    serialize_request_header,
+    deserialize_reply_header,
+    split_reply,
+    decode_status_payload,
+    pub_event_topic,
+)
+from backend_pool import ConnectionPoolManager, DEFAULT_POOL_SIZE, DEFAULT_IDLE_TIMEOUT
+from backend_transport import DEFAULT_MAX_IN_FLIGHT, DEFAULT_REQUEST_TIMEOUT
+from single_flight import DEFAULT_FRESHNESS
+from request_scheduler import parse_class_limits, DEFAULT_MAX_ACTIVE, PRIORITY_CLASSES
+from backend_registry import BackendRegistry, UnknownBackendError, DEFAULT_BACKEND_NAME
+from fanout import Hub, RemoteClient, RemotePoolManager, endpoint_key, make_ipc_directory, run_worker
+from binary_frames import (
+    select_subprotocol,
+    is_binary,
+    encode_breakpoint,
+    encode_transitions,
+    encode_compressed_tree,
+    PRECOMPRESSED_KINDS,
+)
+from frame_encoding import FrameCache, encode_json, frame_size, is_text_frame
+from groot2_decoding import decode_transitions, transitions_to_records
+from tree_cache import TreeCache, DEFAULT_REVALIDATE_AFTER
+from status_poller import StatusPoller, DEFAULT_STATUS_RATE, DEFAULT_KEYFRAME_INTERVAL
+from blackboard_poller import (
+    BlackboardPoller,
+    make_subscription,
+    render_blackboards,
+    DEFAULT_BLACKBOARD_INTERVAL,
+    DEFAULT_MAX_VALUE_BYTES,
+)
+from recorder import Recorder, DEFAULT_RING_CAPACITY, DEFAULT_DRAIN_INTERVAL, MAX_TRANSITIONS_PAGE
+from send_queue import (
+    SendQueues,
+    broadcast as queue_broadcast,
+    POLICIES,
+    DEFAULT_POLICIES,
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_MAX_LAG,
+    STREAM_STATUS,
+    STREAM_BLACKBOARD,
+)
+from ws_compression import server_extensions, DEFAULT_WINDOW_BITS, DEFAULT_MEMORY_LEVEL, DEFAULT_THRESHOLD
+from metrics import REGISTRY, MetricsServer, DEFAULT_METRICS_HOST
+from hooks import HookTable, insert_hooks, remove_hooks, CHANGE_REASONS, DEFAULT_RECONCILE_INTERVAL
+from traffic_capture import TrafficCapture, DEFAULT_CAPTURE_MAX_BYTES
+from tracing import (
+    TRACER,
+    DEFAULT_TRACE_CAPACITY,
+    current_span,
+    set_current_span,
+    reset_current_span,
+    trace_event,
+    queue_logging,
+)
 
 # Setup detailed logging
 logging.basicConfig(
@@ -19,181 +79,597 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Global request ID counter
-request_id_counter = 1
+_recording_directory = None
 
-def get_next_request_id():
-    """Generates a unique, sequential request ID."""
-    global request_id_counter
-    request_id = request_id_counter
-    request_id_counter += 1
-    return request_id
+def recording_path(path, backend_name):
+    """Recording file of one backend: the configured path, suffixed with the backend name
+    for every backend but the default one. Without a configured path the file goes to a
+    private directory of this process, so concurrent proxies never share a ring."""
+    global _recording_directory
+    if path is None:
+        if _recording_directory is None:
+            _recording_directory = tempfile.mkdtemp(prefix=f"groot2-recording-{os.getpid()}-")
+        return os.path.join(_recording_directory, f"transitions.{backend_name}.ring")
+    if backend_name == DEFAULT_BACKEND_NAME:
+        return path
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.{backend_name}{extension}"
 
-def serialize_request_header(protocol, type_char, unique_id):
-    """Serializes the Groot2 request header into a buffer."""
-    logger.debug(f"Serializing header: protocol={protocol}, type='{type_char}', id={unique_id}")
-    try:
-        result = struct.pack('!BBi', protocol, ord(type_char), unique_id)
-        logger.debug(f"Header serialized successfully, length: {len(result)}, hex: {result.hex()}")
-        return result
-    except Exception as e:
-        logger.error(f"Failed to serialize header: {e}")
-        logger.error(traceback.format_exc())
-        raise
+class BackendServices:
+    """Per-backend shared state: the connection pool and the services built on it."""
 
-def deserialize_reply_header(buffer):
-    """Deserializes the Groot2 reply header from a buffer."""
-    logger.debug(f"Deserializing reply header, buffer length: {len(buffer)}, hex: {buffer[:22].hex() if len(buffer) >= 22 else buffer.hex()}")
-    
-    if len(buffer) < 22:
-        error_msg = f"Reply header too short: {len(buffer)} bytes, expected 22"
-        logger.error(error_msg)
-        raise ValueError(error_msg)
-    
-    try:
-        protocol, type_code, unique_id = struct.unpack('!BBi', buffer[:6])
-        tree_id_bytes = buffer[6:22]
-        tree_id = UUID(bytes=tree_id_bytes)
-        
-        result = {
-            "protocol": protocol,
-            "type": chr(type_code),
-            "unique_id": unique_id,
-            "tree_id": str(tree_id)
+    def __init__(self, name, pool, args, broadcast=queue_broadcast):
+        """`broadcast(targets, frame, stream)` delivers poller frames to the clients'
+        send queues (see send_queue.broadcast and fanout.Hub.broadcast)."""
+        self.name = name
+        self.pool = pool
+        self.status_poller = StatusPoller(pool, rate=args.status_rate,
+                                          keyframe_interval=args.status_keyframe_interval,
+                                          broadcast=broadcast)
+        self.tree_cache = TreeCache(pool, revalidate_after=args.tree_revalidate_after)
+        self.frames = FrameCache()
+        self.blackboard_max_value_bytes = args.blackboard_max_value_bytes
+        self.blackboard_poller = BlackboardPoller(pool, interval=args.blackboard_interval,
+                                                  max_value_bytes=args.blackboard_max_value_bytes,
+                                                  broadcast=partial(broadcast, stream=STREAM_BLACKBOARD))
+        # Only a ring file the user named is resumed; the private default always starts empty
+        self.recorder = Recorder(pool, recording_path(args.recording_file, name), capacity=args.recording_capacity,
+                                 drain_interval=args.transition_drain_interval,
+                                 resume=args.recording_file is not None)
+        self.hooks = HookTable(pool, reconcile_interval=args.hook_reconcile_interval, broadcast=broadcast)
+
+    def listen(self, websocket):
+        """Starts hook events for a client; returns its queue of the backend's PUB messages."""
+        self.hooks.add_listener(websocket)
+        return self.pool.add_listener()
+
+    def unlisten(self, websocket, queue):
+        self.pool.remove_listener(queue)
+        self.hooks.remove_listener(websocket)
+
+    def release(self, websocket):
+        """Ends a client's status and blackboard subscriptions."""
+        self.status_poller.unsubscribe(websocket)
+        self.blackboard_poller.unsubscribe(websocket)
+
+    def stats(self):
+        return {
+            "pool": self.pool.stats(),
+            "statusPoller": self.status_poller.stats(),
+            "treeCache": self.tree_cache.stats(),
+            "frameCache": self.frames.stats(),
+            "blackboardPoller": self.blackboard_poller.stats(),
+            "recorder": self.recorder.stats(),
+            "hooks": self.hooks.stats(),
         }
-        logger.debug(f"Header deserialized: {result}")
-        return result
-    except Exception as e:
-        logger.error(f"Failed to deserialize header: {e}")
-        logger.error(traceback.format_exc())
-        raise
 
-async def handle_client_session(websocket, args):
+    def close(self):
+        self.status_poller.close()
+        self.tree_cache.close()
+        self.blackboard_poller.close()
+        self.recorder.close()
+        self.hooks.close()
+
+class WorkerServices:
+    """Per-backend state of a --workers process: a RemotePool and the caches built on it.
+
+    Everything else lives in the hub (see fanout); commands that need it
+    are run there with run_in_hub(), and hook events are asked for with
+    the hub's listen call.
+    """
+
+    def __init__(self, name, pool, args, link):
+        self.name = name
+        self.pool = pool
+        self.link = link
+        self.tree_cache = TreeCache(pool, revalidate_after=args.tree_revalidate_after)
+        self.frames = FrameCache()
+        self.blackboard_max_value_bytes = args.blackboard_max_value_bytes
+        self.hooks = None  # the hook table is the hub's; only execution commands run here
+
+    def listen(self, websocket):
+        self.link.notify(websocket, self.pool.endpoint, "listen")
+        return self.pool.add_listener()
+
+    def unlisten(self, websocket, queue):
+        self.pool.remove_listener(queue)
+        self.link.notify(websocket, self.pool.endpoint, "unlisten")
+
+    def release(self, websocket):
+        pass  # the hub releases the client's subscriptions when the link closes it
+
+    async def run_in_hub(self, websocket, data, backend):
+        """Runs a command in the hub for the session's client and returns the reply frames."""
+        return await self.link.call(websocket, self.pool.endpoint, "command", data, backend)
+
+    def stats(self):
+        return {"pool": self.pool.stats(), "treeCache": self.tree_cache.stats(), "frameCache": self.frames.stats()}
+
+    def close(self):
+        self.tree_cache.close()
+
+# Commands that change session state; they run inline so later commands see the change
+SESSION_COMMANDS = {
+    "subscribeStatus", "resyncStatus", "unsubscribeStatus",
+    "subscribeBlackboard", "resyncBlackboard", "unsubscribeBlackboard",
+    "listBackends", "selectBackend", "addBackend", "removeBackend", "subscribe",
+}
+# Commands that must reach the backend in the order the client sent them
+COMMAND_LANES = {
+    **dict.fromkeys(["setBreakpoint", "removeBreakpoint", "unlockBreakpoint", "getHooks", "getNodeHooks",
+                     "setBreakpoints", "removeBreakpoints", "removeAllBreakpoints", "disableAllBreakpoints",
+                     "start", "pause", "stop", "step"], "execution"),
+    **dict.fromkeys(["startRecording", "stopRecording"], "recording"),
+}
+# Commands a --workers process forwards to the hub, which holds the state they use
+HUB_COMMANDS = {
+    "getHooks", "getNodeHooks", "setBreakpoint", "removeBreakpoint", "unlockBreakpoint",
+    "setBreakpoints", "removeBreakpoints", "removeAllBreakpoints", "disableAllBreakpoints",
+    "startRecording", "stopRecording", "getRecordingStatus", "getTransitions", "seekTransitions",
+    "subscribeStatus", "resyncStatus", "unsubscribeStatus",
+    "subscribeBlackboard", "resyncBlackboard", "unsubscribeBlackboard",
+    "listBackends", "addBackend", "removeBackend", "getProxyStats",
+}
+# Commands one session may have running at once before reading further messages
+MAX_CONCURRENT_COMMANDS = 16
+# Command types used as metric labels; anything else is counted as "unknown"
+METRIC_COMMANDS = SESSION_COMMANDS | set(COMMAND_LANES) | {
+    "getTree", "getStatus", "getBlackboard", "getRecordingStatus",
+    "getTransitions", "seekTransitions", "getProxyStats", "getTraces",
+}
+
+COMMAND_SECONDS = REGISTRY.histogram(
+    "groot2_proxy_command_seconds", "Time from receiving a client command to its last reply", ("command",))
+RECEIVED_BYTES = REGISTRY.counter(
+    "groot2_proxy_ws_received_bytes_total", "Bytes of client messages, by command type", ("type",))
+SENT_BYTES = REGISTRY.counter(
+    "groot2_proxy_ws_sent_bytes_total", "Bytes of command replies, by command type", ("type",))
+CONNECTED_CLIENTS = REGISTRY.gauge("groot2_proxy_connected_clients", "Connected WebSocket clients")
+
+def command_label(command_type):
+    return command_type if isinstance(command_type, str) and command_type in METRIC_COMMANDS else "unknown"
+
+def tag_reply(message, request_id):
+    """Adds "requestId" to a JSON object reply (str or encode_json() bytes) without re-encoding it."""
+    if isinstance(message, str):
+        return tag_reply(message.encode('utf-8'), request_id).decode('utf-8')
+    if not is_text_frame(message):
+        return message
+    rest = message[1:].lstrip()
+    separator = b"" if rest.startswith(b"}") else b", "
+    return b'{"requestId": ' + encode_json(request_id) + separator + rest
+
+class CommandReplies:
+    """Sends the replies of one command, tagged with the client's requestId if it gave one.
+
+    Binary frames are sent unchanged; they carry their own identification
+    (e.g. the first index of a transitions page).
+    """
+
+    def __init__(self, websocket, request_id=None, command_type=None):
+        self.websocket = websocket
+        self.request_id = request_id
+        self.label = command_label(command_type)
+
+    @property
+    def subprotocol(self):
+        return self.websocket.subprotocol
+
+    async def send(self, message):
+        if self.request_id is not None:
+            message = tag_reply(message, self.request_id)
+        size = frame_size(message)
+        SENT_BYTES.inc(self.label, amount=size)
+        trace_event("ws_send", size)
+        await self.websocket.send(message)
+
+class ClientSession:
+    """One WebSocket client: its selected backend, PUB topics and the backends it used.
+
+    Commands go to the backend named in payload["backend"] if present,
+    otherwise to the session's selected backend, which also feeds the
+    client's breakpoint events.
+
+    Commands run concurrently, so a slow getBlackboard does not hold up a
+    pause queued behind it, and replies may arrive out of order; clients
+    correlate them with the requestId they put in the command. Ordering is
+    kept only where the protocol needs it: session commands run inline,
+    and commands sharing a lane (breakpoints and execution control;
+    recording start/stop) run one at a time in arrival order.
+
+    The trace ring holds every client's commands, so getTraces is only
+    answered with `expose_traces` (--expose-traces).
+    """
+
+    def __init__(self, websocket, registry, backend=None, send_queues=None, expose_traces=False):
+        self.websocket = websocket
+        self.registry = registry
+        self.send_queues = send_queues
+        self.expose_traces = expose_traces
+        self.backend = registry.resolve(backend)
+        self.topics = set()
+        self._pub_services = None
+        self._pub_queue = None
+        self._pub_task = None
+        self._used = []  # services this session may have subscribed to
+        self._lanes = defaultdict(asyncio.Lock)
+        self._slots = asyncio.Semaphore(MAX_CONCURRENT_COMMANDS)
+        self._tasks = set()
+        registry.add_change_callback(self._on_registry_change)
+
+    def services_for(self, payload=None):
+        services = self.registry.get((payload or {}).get("backend") or self.backend)
+        if services not in self._used:
+            self._used.append(services)
+        return services
+
+    def select(self, name):
+        self.backend = self.registry.resolve(name)
+        self.listen_to_pub()
+
+    def listen_to_pub(self):
+        """(Re)attaches the PUB event listener to the selected backend."""
+        services = self.services_for()
+        if services is self._pub_services:
+            return
+        self._stop_pub()
+        self._pub_services = services
+        self._pub_queue = services.listen(self.websocket)
+        self._pub_task = asyncio.create_task(listen_to_pub_socket(self.websocket, self._pub_queue, self.topics))
+
+    def _on_registry_change(self, dropped):
+        """Lets go of torn down services; PUB events follow the selected backend to its new endpoint.
+
+        Status and blackboard subscriptions end with their services; the client subscribes again.
+        """
+        self._used = [services for services in self._used if services not in dropped]
+        if self._pub_services is None:
+            return
+        try:
+            self.listen_to_pub()
+        except UnknownBackendError:
+            logger.warning(f"Backend '{self.backend}' of client {self.websocket.remote_address} was removed")
+            self._stop_pub()
+
+    def _stop_pub(self):
+        if self._pub_task is not None:
+            self._pub_task.cancel()
+        if self._pub_services is not None:
+            self._pub_services.unlisten(self.websocket, self._pub_queue)
+        self._pub_services = self._pub_queue = self._pub_task = None
+
+    async def dispatch(self, data):
+        """Starts a command; waits only for session commands or when too many are running."""
+        command_type = data.get("type")
+        payload = data.get("payload")
+        if payload is not None and not isinstance(payload, dict):
+            await self._reply_error(data, "Command payload must be a JSON object")
+            return
+        span = TRACER.start(command_type, (payload or {}).get("backend") or self.backend, data.get("requestId"))
+        # The command's task copies the context, and with it the span
+        token = set_current_span(span)
+        try:
+            try:
+                # Resolved now, so a later selectBackend does not redirect this command
+                services = self.services_for(payload)
+            except UnknownBackendError as e:
+                await self._reply_error(data, str(e))
+                TRACER.finish(span, str(e))
+                return
+            if command_type in SESSION_COMMANDS:
+                await handle_command(self, services, data)
+                return
+            await self._slots.acquire()
+            task = asyncio.create_task(self._run(services, data, COMMAND_LANES.get(command_type)))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        finally:
+            reset_current_span(token)
+
+    async def _reply_error(self, data, message):
+        command_type = data.get("type")
+        await CommandReplies(self.websocket, data.get("requestId"), command_type).send(encode_json({
+            "type": "error",
+            "replyTo": command_type,
+            "payload": {"message": message}
+        }))
+
+    async def _run(self, services, data, lane):
+        try:
+            if lane is None:
+                await handle_command(self, services, data)
+            else:
+                # asyncio.Lock wakes waiters first-in first-out, i.e. in arrival order
+                async with self._lanes[lane]:
+                    await handle_command(self, services, data)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self.registry.remove_change_callback(self._on_registry_change)
+        for task in self._tasks:
+            task.cancel()
+        self._stop_pub()
+        for services in self._used:
+            services.release(self.websocket)
+
+def requested_backend(websocket):
+    """Backend named by the ?backend= query of the WebSocket URL, if any."""
+    request = getattr(websocket, "request", None)
+    query = parse_qs(urlsplit(request.path).query) if request is not None else {}
+    return query.get("backend", [None])[0]
+
+async def handle_client_session(websocket, registry, send_queues=None, expose_traces=False, hub_link=None):
     """
     Manages the entire lifecycle of a single WebSocket client connection.
+
+    With `send_queues` every frame to the client goes through its SendQueue.
+    In a --workers process `hub_link` (a fanout.HubLink) lets the hub send
+    to the client as well.
     """
     logger.info(f"New WebSocket client connected from {websocket.remote_address}")
-    
-    context = zmq.asyncio.Context()
-    req_socket = context.socket(zmq.REQ)
-    sub_socket = context.socket(zmq.SUB)
-
-    req_socket.connect(f"tcp://{args.bt_ip}:{args.req_port}")
-    sub_socket.connect(f"tcp://{args.bt_ip}:{args.pub_port}")
-    
-    logger.info(f"ZMQ sockets connected for client {websocket.remote_address}")
+    if send_queues is not None:
+        websocket = send_queues.wrap(websocket)
 
     try:
-        client_listener_task = asyncio.create_task(listen_to_client(websocket, req_socket, sub_socket))
-        pub_listener_task = asyncio.create_task(listen_to_pub_socket(websocket, sub_socket))
-        
-        done, pending = await asyncio.wait(
-            [client_listener_task, pub_listener_task],
-            return_when=asyncio.FIRST_COMPLETED,
-        )
+        session = ClientSession(websocket, registry, requested_backend(websocket), send_queues, expose_traces)
+    except UnknownBackendError as e:
+        logger.warning(f"Rejecting client {websocket.remote_address}: {e}")
+        await websocket.close(1008, str(e))
+        return
 
-        for task in pending:
-            task.cancel()
+    CONNECTED_CLIENTS.inc()
+    if hub_link is not None:
+        hub_link.open_client(websocket)
+    try:
+        session.listen_to_pub()
+        await listen_to_client(session)
 
     except websockets.exceptions.ConnectionClosed as e:
         logger.info(f"Client {websocket.remote_address} disconnected: {e}")
     except Exception as e:
         logger.error(f"An unexpected error occurred in session for {websocket.remote_address}: {e}")
     finally:
-        logger.info(f"Closing ZMQ sockets for client {websocket.remote_address}")
-        req_socket.close()
-        sub_socket.close()
-        context.term()
+        CONNECTED_CLIENTS.dec()
+        session.close()
+        if hub_link is not None:
+            hub_link.close_client(websocket)
+        if send_queues is not None:
+            websocket.release()
         logger.info(f"Session ended for {websocket.remote_address}")
 
 
-async def listen_to_client(websocket, req_socket, sub_socket):
-    """Listens for messages from the WebSocket client and forwards them to the REQ socket."""
+async def listen_to_client(session):
+    """Reads commands from the WebSocket client and dispatches them (see ClientSession.dispatch)."""
+    websocket = session.websocket
     async for message in websocket:
-        start_time = time.time()
         try:
             data = json.loads(message)
-            command_type = data.get("type")
-            payload = data.get("payload", {})
-            
-            logger.info(f"📥 Received command: {command_type} with payload keys: {list(payload.keys()) if payload else 'none'}")
-
-            if command_type == "getTree":
-                await handle_get_tree(websocket, req_socket, logger)
-            elif command_type == "getStatus":
-                await handle_get_status(websocket, req_socket, logger)
-            elif command_type == "getBlackboard":
-                await handle_get_blackboard(websocket, req_socket, logger, payload)
-            elif command_type == "getHooks":
-                await handle_get_hooks(websocket, req_socket, logger)
-            elif command_type in ["setBreakpoint", "removeBreakpoint", "unlockBreakpoint", "start", "pause", "stop", "step"]:
-                 # Simplified handling for commands that are similar
-                await handle_generic_command(websocket, req_socket, logger, command_type, data)
-            elif command_type == "subscribe":
-                topic = payload.get("topic", "")
-                sub_socket.subscribe(topic)
-                logger.info(f"Subscribed to PUB socket with topic: '{topic}'")
-                await websocket.send(json.dumps({"type": "subscribed", "payload": {"topic": topic}}))
-            else:
-                logger.warning(f"Unknown command type: {command_type}")
-                await websocket.send(json.dumps({
-                    "type": "error",
-                    "replyTo": command_type,
-                    "payload": {"message": f"Unknown command: {command_type}"}
-                }))
-
-        except json.JSONDecodeError:
+            if not isinstance(data, dict):
+                raise ValueError("Command must be a JSON object")
+        except ValueError:
+            RECEIVED_BYTES.inc("invalid", amount=frame_size(message))
             logger.error("Error: Received invalid JSON from client")
-            await websocket.send(json.dumps({"type": "error", "payload": {"message": "Invalid JSON format"}}))
-        except Exception as e:
-            processing_time = time.time() - start_time
-            logger.error(f"❌ Error processing {command_type if 'command_type' in locals() else 'unknown'} command in {processing_time:.3f}s: {e}")
-            logger.error(traceback.format_exc())
-            await websocket.send(json.dumps({
-                "type": "error",
-                "payload": {"message": str(e)}
-            }))
+            await websocket.send(encode_json({"type": "error", "payload": {"message": "Invalid JSON format"}}))
+            continue
+        RECEIVED_BYTES.inc(command_label(data.get("type")), amount=frame_size(message))
+        await session.dispatch(data)
+
+async def handle_command(session, services, data):
+    """Runs one client command against the session's backend services.
+
+    Replies go through CommandReplies, so they carry the client's requestId.
+    In a --workers process, HUB_COMMANDS run in the hub and only their
+    replies come back.
+    """
+    command_type = data.get("type")
+    reply = CommandReplies(session.websocket, data.get("requestId"), command_type)
+    start_time = time.time()
+    error = None
+    trace_event("start")
+    try:
+        payload = data.get("payload", {})
+        logger.info(f"📥 Received command: {command_type} with payload keys: {list(payload.keys()) if payload else 'none'}")
+
+        if isinstance(services, WorkerServices) and command_type in HUB_COMMANDS:
+            for frame in await services.run_in_hub(session.websocket, data, session.backend):
+                await reply.send(frame)
         else:
-            processing_time = time.time() - start_time
-            logger.info(f"✅ Successfully processed {command_type} in {processing_time:.3f}s")
+            await run_command(session, services, data, reply)
 
-async def listen_to_pub_socket(websocket, sub_socket):
-    """Listens for messages from the ZMQ PUB socket and forwards them to the client."""
+    except Exception as e:
+        processing_time = time.time() - start_time
+        error = str(e)
+        logger.error(f"❌ Error processing {command_type} command in {processing_time:.3f}s: {e}")
+        logger.error(traceback.format_exc())
+        await reply.send(encode_json({
+            "type": "error",
+            "replyTo": command_type,
+            "payload": {"message": str(e)}
+        }))
+    else:
+        processing_time = time.time() - start_time
+        logger.info(f"✅ Successfully processed {command_type} in {processing_time:.3f}s")
+    COMMAND_SECONDS.observe(processing_time, reply.label)
+    TRACER.finish(current_span(), error)
+
+async def run_command(session, services, data, reply):
+    """The body of handle_command: dispatches on the command type and sends the replies to `reply`."""
+    websocket = session.websocket
+    command_type = data.get("type")
+    payload = data.get("payload", {})
+    backend = services.pool
+
+    if command_type == "getTree":
+        await handle_get_tree(reply, services.tree_cache, logger, payload, services.frames)
+    elif command_type == "getStatus":
+        await handle_get_status(reply, backend, logger)
+    elif command_type == "getBlackboard":
+        await handle_get_blackboard(reply, backend, logger, payload,
+                                    default_max_value_bytes=services.blackboard_max_value_bytes)
+    elif command_type in ["getHooks", "getNodeHooks"]:
+        await handle_get_hooks(reply, services.hooks, logger, command_type, payload)
+    elif command_type in ["setBreakpoints", "removeBreakpoints"]:
+        await handle_breakpoint_batch(reply, backend, logger, command_type, payload, services.hooks)
+    elif command_type in ["setBreakpoint", "removeBreakpoint", "unlockBreakpoint",
+                          "removeAllBreakpoints", "disableAllBreakpoints", "start", "pause", "stop", "step"]:
+         # Simplified handling for commands that are similar
+        await handle_generic_command(reply, backend, logger, command_type, data, services.hooks)
+    elif command_type == "subscribeStatus":
+        mode = payload.get("mode", "full")
+        services.status_poller.subscribe(websocket, mode, binary=is_binary(websocket))
+        await reply.send(encode_json({
+            "type": "statusSubscribed",
+            "payload": {
+                "rate": services.status_poller.stats()["rate"],
+                "mode": mode,
+                "binary": is_binary(websocket),
+            }
+        }))
+    elif command_type == "resyncStatus":
+        services.status_poller.request_keyframe(websocket)
+    elif command_type == "unsubscribeStatus":
+        services.status_poller.unsubscribe(websocket)
+        await reply.send(encode_json({"type": "statusUnsubscribed", "payload": {}}))
+    elif command_type == "subscribeBlackboard":
+        subscription = services.blackboard_poller.subscribe(
+            websocket, payload.get("names"), payload.get("keys"), payload.get("maxValueBytes"))
+        await reply.send(encode_json({
+            "type": "blackboardSubscribed",
+            "payload": {
+                "names": list(subscription.names),
+                "keys": list(subscription.keys) if subscription.keys else None,
+                "maxValueBytes": subscription.max_value_bytes,
+                "interval": services.blackboard_poller.interval,
+            }
+        }))
+    elif command_type == "resyncBlackboard":
+        services.blackboard_poller.request_keyframe(websocket)
+    elif command_type == "unsubscribeBlackboard":
+        services.blackboard_poller.unsubscribe(websocket)
+        await reply.send(encode_json({"type": "blackboardUnsubscribed", "payload": {}}))
+    elif command_type in ["startRecording", "stopRecording", "getRecordingStatus"]:
+        await handle_recording_command(reply, services.recorder, logger, command_type)
+    elif command_type == "getTransitions":
+        await handle_get_transitions(reply, services.recorder, logger, payload)
+    elif command_type == "seekTransitions":
+        await handle_seek_transitions(reply, services.recorder, logger, payload)
+    elif command_type == "getTraces":
+        if not session.expose_traces:
+            raise PermissionError("Traces are not exposed to clients; start the proxy with --expose-traces")
+        spans = TRACER.dump(limit=payload.get("limit"), command=payload.get("command"))
+        if payload.get("clear"):
+            TRACER.clear()
+        await reply.send(encode_json({"type": "traces", "payload": {**TRACER.stats(), "traces": spans}}))
+    elif command_type == "getProxyStats":
+        stats = {"backend": services.name, "registry": session.registry.stats(), **services.stats()}
+        if session.send_queues is not None:
+            stats["sendQueues"] = session.send_queues.stats()
+        if isinstance(websocket, RemoteClient):
+            stats["fanout"] = websocket.hub.stats()
+        await reply.send(encode_json({"type": "proxyStats", "payload": stats}))
+    elif command_type in ["listBackends", "selectBackend", "addBackend", "removeBackend"]:
+        await handle_backend_command(session, reply, logger, command_type, payload)
+    elif command_type == "subscribe":
+        topic = payload.get("topic", "")
+        session.topics.add(topic)
+        logger.info(f"Subscribed to PUB socket with topic: '{topic}'")
+        await reply.send(encode_json({"type": "subscribed", "payload": {"topic": topic}}))
+    else:
+        logger.warning(f"Unknown command type: {command_type}")
+        await reply.send(encode_json({
+            "type": "error",
+            "replyTo": command_type,
+            "payload": {"message": f"Unknown command: {command_type}"}
+        }))
+
+async def handle_backend_command(session, websocket, logger, command_type, payload):
+    """Handles backend registry commands: listing, selecting and (if allowed) editing backends."""
+    registry = session.registry
+    try:
+        if command_type == "selectBackend":
+            session.select(payload.get("name"))
+            logger.info(f"🔀 Session switched to backend '{session.backend}'")
+            await websocket.send(encode_json({"type": "backendSelected", "payload": {"name": session.backend}}))
+            return
+
+        if command_type in ["addBackend", "removeBackend"]:
+            if not registry.editable:
+                raise PermissionError("Backend edits are disabled; start the proxy with --allow-backend-edits")
+            if command_type == "addBackend":
+                registry.add(payload.get("name"), payload.get("host"),
+                             payload.get("reqPort", 1667), payload.get("pubPort", 1668))
+            else:
+                registry.remove(payload.get("name"))
+            registry.save()
+            logger.info(f"🗂️  {command_type} '{payload.get('name')}' applied")
+
+        await websocket.send(encode_json({
+            "type": "backends",
+            "payload": {"backends": registry.describe(), "selected": session.backend}
+        }))
+
+    except Exception as e:
+        logger.error(f"❌ {command_type} failed: {e}")
+        await websocket.send(encode_json({
+            "type": "error",
+            "replyTo": command_type,
+            "payload": {"message": f"Failed to execute {command_type}: {e}"}
+        }))
+
+async def listen_to_pub_socket(websocket, pub_queue, topics):
+    """Forwards messages from the shared ZMQ SUB socket to the client, filtered by its subscribed topics."""
     while True:
         try:
-            topic, *rest = await sub_socket.recv_multipart()
-            topic_str = topic.decode('utf-8')
+            frames = await pub_queue.get()
+            topic, *rest = frames
+            topic_str = pub_event_topic(topic)
+            # Same prefix matching a per-session SUB socket would apply
+            if not any(topic_str.startswith(t) for t in topics):
+                continue
             
-            logger.debug(f"Received PUB message on topic: {topic_str}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Received PUB message on topic: {topic_str}")
 
             if topic_str == 'N' and rest: # 'N' for BREAKPOINT_REACHED
                 node_uid_str = rest[0].decode('utf-8')
                 logger.info(f"Breakpoint reached at node: {node_uid_str}")
-                await websocket.send(json.dumps({
-                    "type": "breakpointReached",
-                    "payload": {"nodeId": node_uid_str}
-                }))
+                event = {"nodeId": node_uid_str}
+                if is_binary(websocket):
+                    await websocket.send(encode_breakpoint(event))
+                else:
+                    await websocket.send(encode_json({
+                        "type": "breakpointReached",
+                        "payload": event
+                    }))
             else:
-                logger.debug(f"Received other PUB message: Topic={topic_str}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Received other PUB message: Topic={topic_str}")
 
         except asyncio.CancelledError:
             break # Task was cancelled, exit loop
         except Exception as e:
             logger.error(f"Error in PUB socket listener: {e}")
 
-async def handle_generic_command(websocket, req_socket, logger, command_type, data):
-    """Handles various commands that have a similar request/reply structure."""
+async def handle_generic_command(websocket, backend, logger, command_type, data, hooks=None):
+    """Handles various commands that have a similar request/reply structure.
+
+    Successful hook changes are applied to the backend's HookTable `hooks`.
+    """
     COMMAND_MAP = {
         "setBreakpoint": ('I', "breakpointSet"),
         "removeBreakpoint": ('R', "breakpointRemoved"),
         "unlockBreakpoint": ('U', "breakpointUnlocked"),
+        "removeAllBreakpoints": ('A', "allBreakpointsRemoved"),
+        "disableAllBreakpoints": ('X', "allBreakpointsDisabled"),
         "start": ('>', "executionStarted"),
         "pause": ('p', "executionPaused"),
         "stop": ('O', "executionStopped"),
         "step": ('s', "executionStepped"),
     }
     type_char, reply_type = COMMAND_MAP[command_type]
-    
+    rejected = False  # the backend answered with an error reply
+
     try:
         unique_id = get_next_request_id()
         header = serialize_request_header(2, type_char, unique_id)
@@ -204,16 +680,16 @@ async def handle_generic_command(websocket, req_socket, logger, command_type, da
         if command_type in ["setBreakpoint", "removeBreakpoint", "unlockBreakpoint"]:
             # These commands send a JSON payload
             json_payload = json.dumps(params).encode('utf-8')
-            await req_socket.send_multipart([header, json_payload])
+            reply_parts = await backend.request([header, json_payload])
         else:
             # These commands send only the header
-            await req_socket.send(header)
+            reply_parts = await backend.request([header])
 
-        reply_parts = await req_socket.recv_multipart()
         logger.debug(f"Received {len(reply_parts)} parts in {command_type} reply")
 
         if len(reply_parts) >= 2 and reply_parts[0].decode('utf-8', errors='ignore') == 'error':
             error_message = reply_parts[1].decode('utf-8', errors='replace')
+            rejected = True
             raise Exception(error_message)
 
         reply_raw = reply_parts[0]
@@ -221,193 +697,289 @@ async def handle_generic_command(websocket, req_socket, logger, command_type, da
              raise Exception(f"Short reply: {reply_raw.decode('utf-8', errors='replace')}")
 
         reply_header = deserialize_reply_header(reply_raw[:22])
+        if hooks is not None and type_char in CHANGE_REASONS:
+            hooks.apply(type_char, params)
         logger.info(f"✅ {command_type} executed successfully")
-        await websocket.send(json.dumps({
+        await websocket.send(encode_json({
             "type": reply_type,
             "payload": {"success": True, "header": reply_header}
         }))
 
     except Exception as e:
         logger.error(f"❌ {command_type} failed: {e}")
-        await websocket.send(json.dumps({
+        if hooks is not None and type_char in CHANGE_REASONS and not rejected:
+            # e.g. a timeout: the change may or may not have reached the backend
+            hooks.invalidate()
+        await websocket.send(encode_json({
             "type": "error",
             "replyTo": command_type,
             "payload": {"message": f"Failed to execute {command_type}: {e}"}
         }))
 
 
-async def handle_get_tree(websocket, req_socket, logger):
-    """Handle getTree request with enhanced error checking."""
+async def handle_breakpoint_batch(websocket, backend, logger, command_type, payload, hooks=None):
+    """Handles setBreakpoints / removeBreakpoints: a list of hooks changed in as few
+    backend round trips as possible, with one result per item in a single reply."""
+    COMMAND_MAP = {
+        "setBreakpoints": "breakpointsSet",
+        "removeBreakpoints": "breakpointsRemoved",
+    }
     try:
-        unique_id = get_next_request_id()
-        header = serialize_request_header(2, 'T', unique_id)
-        logger.info(f"🌳 Sending getTree request with ID: {unique_id}")
-        
-        await req_socket.send(header)
-        reply_parts = await req_socket.recv_multipart()
-        
-        logger.info(f"Received {len(reply_parts)} reply parts for getTree")
-        
-        # Check for error response
-        if len(reply_parts) >= 2 and reply_parts[0].decode('utf-8', errors='replace') == 'error':
-            error_message = reply_parts[1].decode('utf-8', errors='replace')
-            logger.error(f"Backend returned error for getTree: {error_message}")
-            raise ValueError(f"Backend error: {error_message}")
-        
-        # Handle different response formats
-        if len(reply_parts) == 1:
-            # Only header part
-            reply_raw = reply_parts[0]
-            logger.info(f"Reply raw data length: {len(reply_raw)} bytes")
-            
-            if len(reply_raw) < 22:
-                error_msg = f"Invalid reply length: {len(reply_raw)}, expected at least 22 bytes"
-                logger.error(error_msg)
-                raise ValueError(error_msg)
-                
-            header_data = deserialize_reply_header(reply_raw[:22])
-            xml_data = reply_raw[22:].decode('utf-8', errors='replace')
-        elif len(reply_parts) >= 2:
-            # Header part and XML data part
-            reply_raw = reply_parts[0]
-            xml_raw = reply_parts[1]
-            
-            logger.info(f"Reply raw data length: {len(reply_raw)} bytes, XML data length: {len(xml_raw)} bytes")
-            
-            if len(reply_raw) < 22:
-                error_msg = f"Invalid reply header length: {len(reply_raw)}, expected at least 22 bytes"
-                logger.error(error_msg)
-                raise ValueError(error_msg)
-                
-            header_data = deserialize_reply_header(reply_raw[:22])
-            xml_data = xml_raw.decode('utf-8', errors='replace')
+        items = payload.get("hooks")
+        defaults = payload.get("defaults")
+        logger.info(f"🚀 Handling {command_type} for {len(items) if isinstance(items, list) else 0} hooks")
+        if command_type == "setBreakpoints":
+            outcome = await insert_hooks(backend, items, defaults, verify=bool(payload.get("verify")), table=hooks)
+        else:
+            outcome = await remove_hooks(backend, items, defaults, table=hooks)
+        logger.info(f"✅ {command_type}: {outcome['succeeded']} succeeded, {outcome['failed']} failed "
+                    f"in {outcome['requests']} backend requests")
+        await websocket.send(encode_json({"type": COMMAND_MAP[command_type], "payload": outcome}))
+
+    except Exception as e:
+        logger.error(f"❌ {command_type} failed: {e}")
+        await websocket.send(encode_json({
+            "type": "error",
+            "replyTo": command_type,
+            "payload": {"message": f"Failed to execute {command_type}: {e}"}
+        }))
+
+async def handle_recording_command(websocket, recorder, logger, command_type):
+    """Handles startRecording, stopRecording and getRecordingStatus for the shared recorder."""
+    COMMAND_MAP = {
+        "startRecording": (recorder.start, "recordingStarted"),
+        "stopRecording": (recorder.stop, "recordingStopped"),
+        "getRecordingStatus": (None, "recordingStatus"),
+    }
+    action, reply_type = COMMAND_MAP[command_type]
+
+    try:
+        logger.info(f"⏺️  Handling {command_type} request")
+        status = await action() if action else recorder.status()
+        await websocket.send(encode_json({
+            "type": reply_type,
+            "payload": status
+        }))
+
+    except Exception as e:
+        logger.error(f"❌ {command_type} failed: {e}")
+        await websocket.send(encode_json({
+            "type": "error",
+            "replyTo": command_type,
+            "payload": {"message": f"Failed to execute {command_type}: {e}"}
+        }))
+
+async def handle_get_transitions(websocket, recorder, logger, payload=None):
+    """Handle getTransitions request: one page of the recorded history.
+
+    payload["start"] is the recording index of the first transition wanted
+    (the newest page when omitted) and payload["count"] the page size.
+    """
+    try:
+        payload = payload or {}
+        first, records = recorder.read(payload.get("start"), int(payload.get("count", MAX_TRANSITIONS_PAGE)))
+        status = recorder.status()
+        logger.info(f"🎞️  Sending {len(records) // 9} transitions from index {first}")
+
+        if is_binary(websocket):
+            await websocket.send(encode_transitions(status["treeId"], first, records))
+        else:
+            await websocket.send(encode_json({
+                "type": "transitions",
+                "payload": {
+                    "first": first,
+                    "data": transitions_to_records(decode_transitions(records)),
+                    **status,
+                }
+            }))
+
+    except Exception as e:
+        logger.error(f"❌ getTransitions failed: {e}")
+        await websocket.send(encode_json({
+            "type": "error",
+            "replyTo": "getTransitions",
+            "payload": {"message": f"Failed to get transitions: {e}"}
+        }))
+
+async def handle_seek_transitions(websocket, recorder, logger, payload=None):
+    """Handle seekTransitions request: jump to a time in the recording.
+
+    payload["timestamp"] is in microseconds since the recording started.
+    The reply carries the node statuses at that instant and the page of
+    transitions that follows it; binary clients get the page as a separate
+    transitions frame right after the JSON reply.
+    """
+    try:
+        payload = payload or {}
+        if "timestamp" not in payload:
+            raise ValueError("missing 'timestamp' (microseconds since recording start)")
+        timestamp = int(payload["timestamp"])
+        first, records, snapshot, complete = recorder.seek(timestamp, int(payload.get("count", MAX_TRANSITIONS_PAGE)))
+        status = recorder.status()
+        logger.info(f"⏩ Seek to {timestamp}us landed on transition {first} ({len(snapshot)} node statuses)")
+
+        reply = {
+            "timestamp": timestamp,
+            "first": first,
+            "snapshot": [{"uid": uid, "status": node_status} for uid, node_status in sorted(snapshot.items())],
+            "snapshotComplete": complete,
+            **status,
+        }
+        if is_binary(websocket):
+            await websocket.send(encode_json({"type": "transitionsSeek", "payload": reply}))
+            await websocket.send(encode_transitions(status["treeId"], first, records))
         else:
-            raise ValueError(f"Unexpected number of reply parts: {len(reply_parts)}")
+            reply["data"] = transitions_to_records(decode_transitions(records))
+            await websocket.send(encode_json({"type": "transitionsSeek", "payload": reply}))
+
+    except Exception as e:
+        logger.error(f"❌ seekTransitions failed: {e}")
+        await websocket.send(encode_json({
+            "type": "error",
+            "replyTo": "seekTransitions",
+            "payload": {"message": f"Failed to seek transitions: {e}"}
+        }))
+
+async def handle_get_tree(websocket, tree_cache, logger, payload=None, frame_cache=None):
+    """Handle getTree request, served from the tree cache when the tree_id is unchanged.
+
+    A client that already holds the tree can pass the ETag from a previous
+    treeData reply in payload["etag"] to receive treeUnchanged instead.
+    With a `frame_cache` the treeData frame of each tree is encoded only once.
+
+    A client that sets payload["acceptEncoding"] to "gzip" (or a list
+    containing it) gets a treeData reply without the XML, followed by a
+    binary compressed tree frame holding the cached gzip copy.
+    """
+    try:
+        client_etag = (payload or {}).get("etag")
+        accept_encoding = (payload or {}).get("acceptEncoding") or []
+        if isinstance(accept_encoding, str):
+            accept_encoding = [accept_encoding]
+        logger.info(f"🌳 Handling getTree request{' (conditional)' if client_etag else ''}")
+
+        entry, cached = await tree_cache.get()
+        xml_data = entry.xml
         
-        logger.info(f"✅ Tree data received successfully ({len(xml_data)} chars)")
-        logger.debug(f"Tree data content preview: {xml_data[:200]}...")
+        logger.info(f"✅ Tree data {'served from cache' if cached else 'received successfully'} ({len(xml_data)} chars)")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Tree data content preview: {xml_data[:200]}...")
         
         # Check if XML data is empty
         if not xml_data.strip():
             logger.warning("⚠️  Received empty XML data from backend")
             # Send a more detailed error message
-            await websocket.send(json.dumps({
+            await websocket.send(encode_json({
                 "type": "error",
                 "replyTo": "getTree",
                 "payload": {"message": "Backend returned empty tree data - no behavior tree is currently loaded"}
             }))
-        else:
-            await websocket.send(json.dumps({
+        elif client_etag == entry.etag:
+            await websocket.send(encode_json({
+                "type": "treeUnchanged",
+                "payload": {"etag": entry.etag, "treeId": entry.tree_id}
+            }))
+        elif "gzip" in accept_encoding:
+            compressed = await tree_cache.compressed(entry)
+            await websocket.send(encode_json({
                 "type": "treeData",
-                "payload": {"xml": xml_data, "header": header_data}
+                "payload": {"header": entry.header, "etag": entry.etag, "cached": cached,
+                            "encoding": "gzip", "size": entry.size, "compressedSize": len(compressed)}
             }))
+            await websocket.send(encode_compressed_tree(entry.tree_id, entry.etag, compressed))
+        else:
+            build = lambda: {
+                "type": "treeData",
+                "payload": {"xml": xml_data, "header": entry.header, "etag": entry.etag, "cached": cached}
+            }
+            if frame_cache is None:
+                await websocket.send(encode_json(build()))
+            else:
+                await websocket.send(frame_cache.get(("treeData", entry.tree_id, entry.etag, cached), build))
         
     except Exception as e:
         logger.error(f"❌ getTree failed: {e}")
         logger.error(traceback.format_exc())
-        await websocket.send(json.dumps({
+        await websocket.send(encode_json({
             "type": "error",
             "replyTo": "getTree",
             "payload": {"message": f"Failed to get tree: {e}"}
         }))
 
-async def handle_get_status(websocket, req_socket, logger):
+async def handle_get_status(websocket, backend, logger):
     """Handle getStatus request with enhanced error checking."""
     try:
         unique_id = get_next_request_id()
         header = serialize_request_header(2, 'S', unique_id)
         logger.info(f"📊 Sending getStatus request with ID: {unique_id}")
         
-        await req_socket.send(header)
-        reply_parts = await req_socket.recv_multipart()
-
-        if len(reply_parts) >= 2 and reply_parts[0].decode('utf-8', errors='replace') == 'error':
-            raise ValueError(f"Backend error: {reply_parts[1].decode('utf-8', errors='replace')}")
-
-        reply_raw = reply_parts[0]
-        if len(reply_raw) < 22:
-            raise ValueError(f"Backend error: {reply_raw.decode('utf-8', errors='replace')}")
-            
-        header_data = deserialize_reply_header(reply_raw[:22])
-        status_payload = reply_raw[22:]
+        reply_parts = await backend.request_shared([header])
+        header_data, status_payload = split_reply(reply_parts)
         
         if not status_payload:
             logger.warning("⚠️  Empty status payload - tree may not be running")
-            status_data = {}
-        else:
-            try:
-                status_data = msgpack.unpackb(status_payload, raw=False)
-            except Exception as msgpack_error:
-                logger.warning(f"⚠️  Failed to parse as msgpack: {msgpack_error}, trying raw parse.")
-                status_data = parse_raw_status_data(status_payload)
+        status_data = decode_status_payload(status_payload)
         
-        logger.info(f"✅ Status data parsed successfully")
-        await websocket.send(json.dumps({
+        logger.info("✅ Status data parsed successfully")
+        await websocket.send(encode_json({
             "type": "statusUpdate",
             "payload": {"data": status_data, "header": header_data}
         }))
         
     except Exception as e:
         logger.error(f"❌ getStatus failed: {e}")
-        await websocket.send(json.dumps({
+        await websocket.send(encode_json({
             "type": "error",
             "replyTo": "getStatus",
             "payload": {"message": f"Operation cannot be accomplished in current state: {e}"}
         }))
 
-async def handle_get_hooks(websocket, req_socket, logger):
-    """Handle getHooks request to retrieve current breakpoint hooks."""
-    try:
-        unique_id = get_next_request_id()
-        header = serialize_request_header(2, 'D', unique_id)
-        logger.info(f"🔗 Sending getHooks request with ID: {unique_id}")
-        
-        await req_socket.send(header)
-        reply_parts = await req_socket.recv_multipart()
-
-        if len(reply_parts) >= 2 and reply_parts[0].decode('utf-8', errors='replace') == 'error':
-            raise ValueError(f"Backend error: {reply_parts[1].decode('utf-8', errors='replace')}")
+async def handle_get_hooks(websocket, hooks, logger, command_type="getHooks", payload=None):
+    """Handle getHooks / getNodeHooks from the backend's hook table mirror.
 
-        reply_raw = reply_parts[0]
-        if len(reply_raw) < 22:
-            raise ValueError(f"Invalid reply length: {len(reply_raw)}")
-            
-        header_data = deserialize_reply_header(reply_raw[:22])
-        hooks_payload = reply_raw[22:]
-        
-        hooks_data = []
-        if not hooks_payload:
-            logger.info("✅ No hooks currently set")
-        else:
-            try:
-                hooks_data = json.loads(hooks_payload.decode('utf-8'))
-                logger.info(f"✅ Hooks data parsed successfully: {len(hooks_data)} hooks")
-            except Exception as json_error:
-                logger.error(f"❌ Failed to parse hooks data as JSON: {json_error}")
+    The mirror is loaded with HOOKS_DUMP on first use; payload["refresh"]
+    forces a new dump.
+    """
+    payload = payload or {}
+    try:
+        if command_type == "getNodeHooks":
+            uid = payload.get("uid")
+            if isinstance(uid, bool) or not isinstance(uid, int):
+                raise ValueError(f"Invalid uid: {uid!r}")
+            await websocket.send(encode_json({
+                "type": "nodeHooks",
+                "payload": {"uid": uid, "hooks": await hooks.node_hooks(uid), "version": hooks.version}
+            }))
+            return
 
-        await websocket.send(json.dumps({
+        hooks_data = await hooks.hooks(refresh=bool(payload.get("refresh")))
+        logger.info(f"✅ Serving {len(hooks_data)} hooks (version {hooks.version})")
+        await websocket.send(encode_json({
             "type": "hooksDump",
-            "payload": {"data": hooks_data, "header": header_data}
+            "payload": {"data": hooks_data, "header": hooks.header, "version": hooks.version}
         }))
-        
+
     except Exception as e:
-        logger.error(f"❌ getHooks failed: {e}")
-        await websocket.send(json.dumps({
+        logger.error(f"❌ {command_type} failed: {e}")
+        await websocket.send(encode_json({
             "type": "error",
-            "replyTo": "getHooks",
+            "replyTo": command_type,
             "payload": {"message": f"Failed to get hooks: {e}"}
         }))
 
-async def handle_get_blackboard(websocket, req_socket, logger, payload=None):
-    """Handle getBlackboard request with enhanced error checking."""
+async def handle_get_blackboard(websocket, backend, logger, payload=None, default_max_value_bytes=DEFAULT_MAX_VALUE_BYTES):
+    """Handle getBlackboard request with enhanced error checking.
+
+    payload["keys"] (glob patterns) and payload["maxValueBytes"] narrow the
+    reply the same way they do for subscribeBlackboard.
+    """
     try:
         unique_id = get_next_request_id()
         header = serialize_request_header(2, 'B', unique_id)
         logger.info(f"📋 Sending getBlackboard request with ID: {unique_id}")
         
         bb_names = (payload.get("names") or "MainTree").strip() or "MainTree"
-        await req_socket.send_multipart([header, bb_names.encode('utf-8')])
-        reply_parts = await req_socket.recv_multipart()
+        reply_parts = await backend.request_shared([header, bb_names.encode('utf-8')])
 
         if len(reply_parts) >= 2 and reply_parts[0].decode('utf-8', errors='ignore') == 'error':
             raise ValueError(f"Backend error: {reply_parts[1].decode('utf-8', errors='replace')}")
@@ -419,74 +991,334 @@ async def handle_get_blackboard(websocket, req_socket, logger, payload=None):
         header_data = deserialize_reply_header(reply_raw[:22])
         blackboard_payload = b''.join(reply_parts[1:])
         
+        keys = payload.get("keys")
+        max_value_bytes = payload.get("maxValueBytes", default_max_value_bytes)
         blackboard_data = {}
         if not blackboard_payload:
             logger.info("✅ Empty blackboard data - no entries")
+        elif keys or max_value_bytes:
+            blackboard_data = render_blackboards(blackboard_payload, make_subscription(bb_names, keys, max_value_bytes))
+            logger.info(f"✅ Blackboard data filtered for keys={keys}, maxValueBytes={max_value_bytes}")
         else:
             try:
                 blackboard_data = msgpack.unpackb(blackboard_payload, raw=False)
-                logger.info(f"✅ Blackboard data parsed successfully")
+                logger.info("✅ Blackboard data parsed successfully")
             except Exception as msgpack_error:
                 logger.error(f"❌ Failed to parse blackboard data as msgpack: {msgpack_error}")
 
-        await websocket.send(json.dumps({
+        await websocket.send(encode_json({
             "type": "blackboardUpdate",
             "payload": {"data": blackboard_data, "header": header_data}
         }))
         
     except Exception as e:
         logger.error(f"❌ getBlackboard failed: {e}")
-        await websocket.send(json.dumps({
+        await websocket.send(encode_json({
             "type": "error",
             "replyTo": "getBlackboard",
             "payload": {"message": f"Operation cannot be accomplished in current state: {e}"}
         }))
 
-def parse_raw_status_data(payload):
-    """Parse raw status data as node UID + status pairs."""
-    try:
-        nodes = []
-        offset = 0
-        while offset + 3 <= len(payload):
-            uid = struct.unpack('!H', payload[offset:offset+2])[0]  # 2 bytes UID
-            status = payload[offset+2]  # 1 byte status
-            nodes.append({"uid": uid, "status": status})
-            offset += 3
-        return nodes
-    except Exception as e:
-        logger.error(f"Failed to parse raw status data: {e}")
-        return []
+class HubSession:
+    """What run_command needs of a ClientSession, for a command a worker runs in the hub."""
+
+    send_queues = None  # the workers own them and report their stats
+
+    def __init__(self, websocket, registry, backend, expose_traces=False):
+        self.websocket = websocket
+        self.registry = registry
+        self.backend = backend
+        self.expose_traces = expose_traces
+
+class CollectedReplies:
+    """Keeps a command's replies for the worker that forwarded it, which tags and sends them."""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.frames = []
+
+    @property
+    def subprotocol(self):
+        return self.websocket.subprotocol
+
+    async def send(self, message):
+        self.frames.append(message.encode('utf-8') if isinstance(message, str) else message)
+
+class HubCalls:
+    """Serves the calls of the --workers processes (see fanout.Hub) from this process's backend services."""
+
+    def __init__(self, hub, registry, expose_traces=False):
+        self.hub = hub
+        self.registry = registry
+        self.expose_traces = expose_traces
+        registry.add_change_callback(self._on_registry_change)
+
+    def _on_registry_change(self, dropped):
+        for services in dropped:
+            self.hub.stop_events(pool=services.pool)
+        self.hub.push_registry(self.registry.document())
+
+    async def call(self, worker_id, client, endpoint, method, args):
+        services = self.registry.for_endpoint(*endpoint)
+        if method in ("request", "request_shared"):
+            frames, timeout = args
+            send = services.pool.request if method == "request" else services.pool.request_shared
+            # Every worker counts request ids from 1, but replies are matched to requests by id
+            header = frames[0]
+            reply_parts = await send([serialize_request_header(header[0], chr(header[1]), get_next_request_id()),
+                                      *frames[1:]], timeout=timeout)
+            if len(reply_parts[0]) < 22:  # error replies carry no header
+                return reply_parts
+            return [header[:6] + bytes(reply_parts[0][6:]), *reply_parts[1:]]
+        if method == "events":
+            if args[0]:
+                self.hub.forward_events(worker_id, endpoint_key(endpoint), services.pool)
+            else:
+                self.hub.stop_events(worker_id, endpoint_key(endpoint))
+            return None
+        if client is None:
+            raise ValueError(f"'{method}' needs a client of worker {worker_id.decode()}")
+        if method == "listen":
+            services.hooks.add_listener(client)
+        elif method == "unlisten":
+            services.hooks.remove_listener(client)
+        elif method == "command":
+            data, backend = args
+            replies = CollectedReplies(client)
+            await run_command(HubSession(client, self.registry, backend, self.expose_traces), services, data, replies)
+            return replies.frames
+        else:
+            raise ValueError(f"Unknown hub call: {method}")
+        return None
+
+    def release(self, client):
+        """Ends everything a disconnected client held in the backend services."""
+        for _, services in self.registry.active():
+            services.release(client)
+            services.hooks.remove_listener(client)
+
+def make_worker_handler(args, link, send_queues):
+    """Session handler of a --workers process (see fanout.run_worker): the sessions run
+    there, against the backends of the hub's registry."""
+    TRACER.configure(args.trace_capacity)
+    registry = BackendRegistry(RemotePoolManager(link), lambda name, pool: WorkerServices(name, pool, args, link))
+    registry.update(link.registry_document, source="hub")
+    link.on_registry = partial(registry.update, source="hub")
+    return lambda ws: handle_client_session(ws, registry, send_queues, args.expose_traces, hub_link=link)
+
+def collect_metrics(registry, send_queues=None, hub=None):
+    """Scrape-time metrics read from the stats() of the backends in use and of the send queues."""
+    in_flight, queued, hits, misses, hit_ratios, stream_bytes, subscribers = [], [], [], [], [], [], []
+    for name, services in registry.active():
+        stats = services.stats()
+        pool = stats["pool"]
+        in_flight.append(({"backend": name}, pool["transport"]["in_flight"]))
+        for cls in PRIORITY_CLASSES:
+            queued.append(({"backend": name, "class": cls}, pool["scheduler"][cls]["queued"]))
+
+        coalescing = pool["coalescing"]
+        caches = {
+            "tree": (stats["treeCache"]["hits"], stats["treeCache"]["misses"]),
+            "frame": (stats["frameCache"]["hits"], stats["frameCache"]["misses"]),
+            "coalescing": (coalescing["joined"] + coalescing["fresh_hits"], coalescing["leaders"]),
+        }
+        for cache, (hit, miss) in caches.items():
+            labels = {"backend": name, "cache": cache}
+            hits.append((labels, hit))
+            misses.append((labels, miss))
+            hit_ratios.append((labels, hit / (hit + miss) if hit + miss else 0.0))
+
+        for stream, poller in ((STREAM_STATUS, stats["statusPoller"]), (STREAM_BLACKBOARD, stats["blackboardPoller"])):
+            labels = {"backend": name, "stream": stream}
+            stream_bytes.append((labels, poller["bytes_sent"]))
+            subscribers.append((labels, poller["subscribers"]))
+
+    # In --workers mode the queues live in the workers, which report them every few seconds
+    if send_queues is not None:
+        queue_stats = {"main": send_queues.stats()}
+    else:
+        queue_stats = hub.stats()["sendQueues"] if hub is not None else {}
+    depth, max_depth, dropped, disconnects = [], [], [], []
+    for worker, queues in queue_stats.items():
+        labels = {"worker": worker}
+        depth.append((labels, queues["depth"]))
+        max_depth.append((labels, queues["max_depth"]))
+        dropped.append(({**labels, "reason": "dropped"}, queues["dropped"]))
+        dropped.append(({**labels, "reason": "coalesced"}, queues["coalesced"]))
+        disconnects.append((labels, queues["disconnects"]))
+
+    return [
+        ("groot2_proxy_backend_in_flight", "gauge", "Requests sent to the backend and not answered yet", in_flight),
+        ("groot2_proxy_backend_queued_requests", "gauge", "Requests waiting for a scheduler slot", queued),
+        ("groot2_proxy_cache_hits_total", "counter", "Lookups answered without a backend round trip", hits),
+        ("groot2_proxy_cache_misses_total", "counter", "Lookups that needed a backend round trip", misses),
+        ("groot2_proxy_cache_hit_ratio", "gauge", "Hits over all lookups since start", hit_ratios),
+        ("groot2_proxy_stream_sent_bytes_total", "counter", "Bytes of poller frames sent to subscribers", stream_bytes),
+        ("groot2_proxy_stream_subscribers", "gauge", "Clients subscribed to a poller stream", subscribers),
+        ("groot2_proxy_send_queue_depth", "gauge", "Frames queued for all clients", depth),
+        ("groot2_proxy_send_queue_max_depth", "gauge", "Frames queued for the most backed-up client", max_depth),
+        ("groot2_proxy_send_queue_discarded_frames_total", "counter", "Frames discarded by the slow-consumer policies", dropped),
+        ("groot2_proxy_slow_client_disconnects_total", "counter", "Clients disconnected for falling too far behind", disconnects),
+    ]
 
 async def main_async(args):
     """Main async function to start the WebSocket proxy server."""
     logger.info("🚀 Starting Groot2 WebSocket Proxy (Enhanced)")
     logger.info(f"📡 WebSocket server will listen on ws://{args.host}:{args.ws_port}")
-    logger.info(f"🔗 Backend ZMQ server: {args.bt_ip}:{args.req_port}/{args.pub_port}")
     
-    # Curry the handler to pass args
-    session_handler = lambda ws: handle_client_session(ws, args)
+    pool_manager = ConnectionPoolManager(
+        max_size=args.pool_size,
+        idle_timeout=args.pool_idle_timeout,
+        max_in_flight=args.max_in_flight,
+        request_timeout=args.request_timeout,
+        coalesce_window=args.coalesce_window,
+        class_limits=args.request_class_limits,
+        max_active=args.max_backend_requests,
+        capture=TrafficCapture(args.capture_file, args.capture_max_bytes) if args.capture_file else None,
+    )
+    queue_options = {
+        "max_size": args.send_queue_size,
+        "max_lag": args.max_client_lag,
+        "policies": {STREAM_STATUS: args.status_queue_policy, STREAM_BLACKBOARD: args.blackboard_queue_policy},
+    }
+    deflate_options = {
+        "enabled": not args.no_deflate,
+        "window_bits": args.deflate_window_bits,
+        "memory_level": args.deflate_memory_level,
+        "threshold": args.deflate_threshold,
+        "skip_kinds": PRECOMPRESSED_KINDS,
+    }
+    hub = None
+    if args.workers > 0:
+        # Workers run the client sessions and own their send queues
+        hub = Hub(make_ipc_directory())
+    broadcast = hub.broadcast if hub else queue_broadcast
+    registry = BackendRegistry(pool_manager, lambda name, pool: BackendServices(name, pool, args, broadcast),
+                               config_path=args.backends_config, editable=args.allow_backend_edits)
+    if hub:
+        # Registered before the backends are loaded, so the workers get them
+        hub.handler = HubCalls(hub, registry, args.expose_traces)
+    if args.backends_config:
+        registry.load()
+        if hasattr(signal, "SIGHUP"):
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, registry.reload)
+    else:
+        registry.add(DEFAULT_BACKEND_NAME, args.bt_ip, args.req_port, args.pub_port)
+    for backend in registry.describe():
+        logger.info(f"🔗 Backend ZMQ server '{backend['name']}': {backend['host']}:{backend['reqPort']}/{backend['pubPort']}")
+
+    send_queues = None if hub else SendQueues(**queue_options)
+    metrics_server = None
+    if args.metrics_port:
+        REGISTRY.add_collector(partial(collect_metrics, registry, send_queues, hub))
+        metrics_server = MetricsServer(REGISTRY)
+        await metrics_server.start(args.metrics_host, args.metrics_port)
+        logger.info(f"📈 Metrics served on http://{args.metrics_host}:{args.metrics_port}/metrics")
+
+    try:
+        if hub:
+            await serve_with_workers(hub, args, registry, pool_manager, queue_options, deflate_options)
+        else:
+            await serve_in_process(args, registry, pool_manager, send_queues, deflate_options)
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+
+async def serve_in_process(args, registry, pool_manager, send_queues, deflate_options):
+    """Single-process mode: client sessions run in this process."""
+    # Curry the handler to pass the backend registry and send queues
+    session_handler = lambda ws: handle_client_session(ws, registry, send_queues, args.expose_traces)
     
-    async with websockets.serve(session_handler, args.host, args.ws_port):
-        await asyncio.Future()  # Run forever
+    try:
+        async with websockets.serve(session_handler, args.host, args.ws_port, select_subprotocol=select_subprotocol,
+                                    compression=None, extensions=server_extensions(**deflate_options)):
+            await asyncio.Future()  # Run forever
+    finally:
+        registry.close()
+        pool_manager.close()
+
+async def serve_with_workers(hub, args, registry, pool_manager, queue_options, deflate_options):
+    """Multi-process mode: this process is the hub, N worker processes serve the WebSocket port."""
+    spawn = multiprocessing.get_context("spawn")
+    workers = [spawn.Process(target=run_worker, name=f"groot2-proxy-worker-{i}", daemon=True,
+                             args=(i, args.host, args.ws_port, hub.directory, partial(make_worker_handler, args),
+                                   logging.getLogger("proxy").getEffectiveLevel(), queue_options, deflate_options))
+               for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    logger.info(f"🧵 Serving through {args.workers} worker processes (hub ipc: {hub.directory})")
+    try:
+        await hub.run()
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join(timeout=5)
+        registry.close()
+        pool_manager.close()
+        hub.close()
 
 def main():
     """Main entry point."""
-    parser = argparse.ArgumentParser(description="WebSocket proxy for Groot2 BehaviorTree.CPP")
+    parser = argparse.ArgumentParser(
+        description="WebSocket proxy for Groot2 BehaviorTree.CPP",
+        epilog="Optional packages: numpy speeds up STATUS and transition decoding, orjson speeds up "
+               "JSON frame encoding (pip install numpy orjson). Both are used when installed.")
     parser.add_argument("--bt-ip", default='localhost', help="IP address of the BehaviorTree.CPP ZMQ server")
     parser.add_argument("--req-port", type=int, default=1667, help="Request port of the ZMQ server")
     parser.add_argument("--pub-port", type=int, default=1668, help="Publisher port of the ZMQ server")
+    parser.add_argument("--backends-config", help="JSON file listing the backends to serve (replaces --bt-ip/--req-port/--pub-port; reloaded on SIGHUP)")
+    parser.add_argument("--allow-backend-edits", action="store_true", help="Let clients add and remove backends at runtime (written back to --backends-config)")
     parser.add_argument("--host", default="localhost", help="Host for the WebSocket proxy to listen on")
     parser.add_argument("--ws-port", type=int, default=8080, help="Port for the WebSocket proxy to listen on")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE, help="Maximum number of backend connections shared by all clients")
+    parser.add_argument("--pool-idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT, help="Seconds before an idle backend connection is closed (0 disables eviction)")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="Maximum pipelined requests outstanding per backend connection; lowered, with a warning, to --max-backend-requests divided over --pool-size connections when that is smaller")
+    parser.add_argument("--request-timeout", type=float, default=DEFAULT_REQUEST_TIMEOUT, help="Seconds to wait for a backend reply before failing the request")
+    parser.add_argument("--request-class-limits", type=parse_class_limits, default=None, help="Backend requests outstanding per priority class, e.g. control=4,status=2,blackboard=2,bulk=1")
+    parser.add_argument("--max-backend-requests", type=int, default=DEFAULT_MAX_ACTIVE, help="Backend requests outstanding at once across all priority classes; waiting requests are sent highest priority first. The default matches --pool-size x --max-in-flight; a smaller value also lowers the per-connection pipelining limit")
+    parser.add_argument("--coalesce-window", type=float, default=DEFAULT_FRESHNESS, help="Seconds a getTree/getStatus/getBlackboard reply is reused for identical requests (0 only shares requests in flight)")
+    parser.add_argument("--status-rate", type=float, default=DEFAULT_STATUS_RATE, help="STATUS polls per second for clients using subscribeStatus")
+    parser.add_argument("--status-keyframe-interval", type=float, default=DEFAULT_KEYFRAME_INTERVAL, help="Seconds between full status keyframes for delta subscribers")
+    parser.add_argument("--tree-revalidate-after", type=float, default=DEFAULT_REVALIDATE_AFTER, help="Seconds without backend traffic before a cached tree is revalidated")
+    parser.add_argument("--blackboard-interval", type=float, default=DEFAULT_BLACKBOARD_INTERVAL, help="Seconds between blackboard polls for clients using subscribeBlackboard")
+    parser.add_argument("--blackboard-max-value-bytes", type=int, default=DEFAULT_MAX_VALUE_BYTES, help="Default size cap for one blackboard value; larger values are sent as summaries (0 disables)")
+    parser.add_argument("--recording-file", default=None, help="Memory-mapped ring file that recorded transitions are written to, resumed across restarts (default: a fresh file in a private temporary directory)")
+    parser.add_argument("--recording-capacity", type=int, default=DEFAULT_RING_CAPACITY, help="Transitions kept in the recording ring file before the oldest are overwritten")
+    parser.add_argument("--transition-drain-interval", type=float, default=DEFAULT_DRAIN_INTERVAL, help="Seconds between GET_TRANSITIONS drains while recording")
+    parser.add_argument("--hook-reconcile-interval", type=float, default=DEFAULT_RECONCILE_INTERVAL, help="Seconds between HOOKS_DUMP requests that reconcile the proxy's hook table with the backend (0 only reconciles on tree changes)")
+    parser.add_argument("--send-queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="Frames of one stream queued per client before the drop-oldest policy drops the oldest")
+    parser.add_argument("--status-queue-policy", choices=POLICIES, default=DEFAULT_POLICIES[STREAM_STATUS], help="What to drop when a client falls behind on status frames (keyframes of delta subscribers are always kept)")
+    parser.add_argument("--blackboard-queue-policy", choices=POLICIES, default=DEFAULT_POLICIES[STREAM_BLACKBOARD], help="What to drop when a client falls behind on blackboard frames")
+    parser.add_argument("--max-client-lag", type=float, default=DEFAULT_MAX_LAG, help="Seconds a client's send queue may make no progress before the client is disconnected (0 disables)")
+    parser.add_argument("--deflate-window-bits", type=int, default=DEFAULT_WINDOW_BITS, choices=range(9, 16), metavar="{9..15}", help="permessage-deflate window bits (larger compresses better, costs more memory per client)")
+    parser.add_argument("--deflate-memory-level", type=int, default=DEFAULT_MEMORY_LEVEL, choices=range(1, 10), metavar="{1..9}", help="permessage-deflate zlib memory level")
+    parser.add_argument("--deflate-threshold", type=int, default=DEFAULT_THRESHOLD, help="Messages smaller than this many bytes are sent without permessage-deflate")
+    parser.add_argument("--no-deflate", action="store_true", help="Don't negotiate permessage-deflate with clients")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve Prometheus metrics on this port at /metrics (0 disables)")
+    parser.add_argument("--metrics-host", default=DEFAULT_METRICS_HOST, help="Host for the metrics endpoint to listen on")
+    parser.add_argument("--trace-capacity", type=int, default=DEFAULT_TRACE_CAPACITY, help="Finished request traces kept in memory for the getTraces command (0 disables tracing)")
+    parser.add_argument("--expose-traces", action="store_true", help="Answer getTraces from any client; the traces include other clients' commands, and clear=true empties the ring for everyone")
+    parser.add_argument("--sync-logging", action="store_true", help="Write log records from the event loop instead of a background thread")
+    parser.add_argument("--capture-file", help="Append every backend request, reply and PUB message to this file for replay with tests/replay_capture.py")
+    parser.add_argument("--capture-max-bytes", type=int, default=DEFAULT_CAPTURE_MAX_BYTES, help="Stop capturing once the capture file reaches this size")
+    parser.add_argument("--workers", type=int, default=0, help="WebSocket worker processes sharing --ws-port. They run the client sessions: socket I/O, compression, send queues, command handling and reply encoding; this process keeps the backend connections, pollers, hook tables and recorders (0 serves everything in-process)")
     parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose DEBUG logging")
     args = parser.parse_args()
 
     if args.verbose:
         logger.setLevel(logging.DEBUG)
+        logging.getLogger("proxy").setLevel(logging.DEBUG)
+    TRACER.configure(args.trace_capacity)
+    log_listener = None if args.sync_logging else queue_logging()
 
     try:
         asyncio.run(main_async(args))
     except KeyboardInterrupt:
         logger.info("Server stopped manually.")
+    finally:
+        if log_listener is not None:
+            log_listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
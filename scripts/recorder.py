@@ -0,0 +1,472 @@
+"""
+Proxy-side recording of node transitions.
+
+TOGGLE_RECORDING ('r') makes the backend buffer every node transition, but
+it keeps at most 1000 of them and GET_TRANSITIONS ('t') hands them over
+and clears the buffer. While a recording runs, the Recorder drains that
+buffer on a short interval and appends the 9-byte records, unchanged, to a
+TransitionRing: a preallocated, memory-mapped file used as a ring buffer.
+
+Memory use stays constant however long the recording runs; once the ring
+is full the oldest transitions are overwritten. Clients read the history
+page by page (getTransitions) instead of holding all of it.
+
+A TransitionIndex kept alongside the ring makes the history seekable by
+time (seekTransitions): it samples the timestamp of every INDEX_STRIDE-th
+record and, every CHECKPOINT_EVERY samples, the status of every node, so
+the node statuses at any instant are rebuilt from the nearest checkpoint
+instead of replaying the recording from its start.
+
+Ring file layout (integers big-endian):
+
+    header   magic | u16 version | u16 record size | u64 capacity
+             | u64 total records written | u64 start time (us since epoch)
+             | 16B tree_id, padded to 64 bytes
+    records  capacity * 9 bytes; record i is stored in slot i % capacity
+"""
+
+import asyncio
+import bisect
+import logging
+import mmap
+import os
+import struct
+from uuid import UUID
+
+from groot2_protocol import (
+    get_next_request_id,
+    serialize_request_header,
+    split_reply,
+    PROTOCOL_ID,
+)
+from groot2_decoding import TRANSITION_RECORD_SIZE, decode_status, decode_transitions
+
+logger = logging.getLogger("proxy.recorder")
+
+DEFAULT_RING_CAPACITY = 1_000_000  # records, about 9 MB on disk
+DEFAULT_DRAIN_INTERVAL = 0.1  # seconds between GET_TRANSITIONS requests
+# Transitions the backend keeps between drains; a full buffer may have lost older ones
+BACKEND_TRANSITION_BUFFER = 1000
+MAX_TRANSITIONS_PAGE = 10000
+INDEX_STRIDE = 1024  # records between two timestamp samples
+CHECKPOINT_EVERY = 16  # timestamp samples between two status checkpoints
+# STATUS reports IDLE as 10 + previous status; transitions use plain IDLE (0)
+IDLE_STATUS_OFFSET = 10
+
+RING_MAGIC = b"G2TRRING"
+RING_VERSION = 1
+_RING_HEADER = struct.Struct('!8sHHQQQ16s')
+RING_HEADER_SIZE = 64
+_TOTAL_OFFSET = 20  # offset of the total records counter in the header
+
+
+class TransitionRing:
+    """Fixed-size ring of 9-byte transition records in a memory-mapped file.
+
+    Records are addressed by their absolute index since the ring was reset;
+    only the last `capacity` of them are retained. With `resume` an existing
+    file of the same layout is picked up, otherwise the ring starts empty.
+    """
+
+    def __init__(self, path, capacity=DEFAULT_RING_CAPACITY, resume=True):
+        self.path = path
+        self.capacity = capacity
+        self.total = 0
+        self.start_time = 0
+        self.tree_id = None
+
+        size = RING_HEADER_SIZE + capacity * TRANSITION_RECORD_SIZE
+        self._file = open(path, 'a+b')
+        self._file.seek(0)
+        existing = self._file.read(_RING_HEADER.size)
+        if os.fstat(self._file.fileno()).st_size != size:
+            self._file.truncate(size)
+        if hasattr(os, "posix_fallocate"):
+            # Reserve the blocks now so a full disk fails here, not as SIGBUS mid-run
+            os.posix_fallocate(self._file.fileno(), 0, size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+        if not (resume and self._load_header(existing)):
+            self.reset()
+
+    def _load_header(self, raw):
+        """Resumes from an existing file written with the same layout; returns False otherwise."""
+        if len(raw) < _RING_HEADER.size:
+            return False
+        magic, version, record_size, capacity, total, start_time, tree_id = _RING_HEADER.unpack(raw)
+        if (magic, version, record_size, capacity) != (RING_MAGIC, RING_VERSION, TRANSITION_RECORD_SIZE, self.capacity):
+            return False
+        self.total = total
+        self.start_time = start_time
+        self.tree_id = str(UUID(bytes=tree_id)) if any(tree_id) else None
+        logger.info(f"Reopened transition ring {self.path} with {self.stored} of {total} records")
+        return True
+
+    def reset(self, start_time=0, tree_id=None):
+        """Empties the ring for a new recording."""
+        self.total = 0
+        self.start_time = start_time
+        self.tree_id = tree_id
+        tree_id_bytes = UUID(tree_id).bytes if tree_id else bytes(16)
+        _RING_HEADER.pack_into(self._map, 0, RING_MAGIC, RING_VERSION, TRANSITION_RECORD_SIZE,
+                               self.capacity, 0, start_time, tree_id_bytes)
+
+    @property
+    def stored(self):
+        return min(self.total, self.capacity)
+
+    @property
+    def oldest(self):
+        """Index of the oldest record still held in the ring."""
+        return self.total - self.stored
+
+    def append(self, records):
+        """Appends packed 9-byte records, overwriting the oldest ones when full."""
+        count = len(records) // TRANSITION_RECORD_SIZE
+        if not count:
+            return 0
+        view = memoryview(records)[:count * TRANSITION_RECORD_SIZE]
+        if count > self.capacity:
+            # Only the newest `capacity` records can be kept
+            view = view[-self.capacity * TRANSITION_RECORD_SIZE:]
+            self.total += count - self.capacity
+            count = self.capacity
+
+        slot = self.total % self.capacity
+        first = min(count, self.capacity - slot)
+        self._write_slots(slot, view[:first * TRANSITION_RECORD_SIZE])
+        if first < count:
+            self._write_slots(0, view[first * TRANSITION_RECORD_SIZE:])
+
+        # Publish the counter only after the records are in place
+        self.total += count
+        struct.pack_into('!Q', self._map, _TOTAL_OFFSET, self.total)
+        return count
+
+    def _write_slots(self, slot, data):
+        offset = RING_HEADER_SIZE + slot * TRANSITION_RECORD_SIZE
+        self._map[offset:offset + len(data)] = data
+
+    def read(self, start, count):
+        """Returns (first index, packed records) for up to `count` records from index `start`.
+
+        A start older than the ring's oldest record is clamped forward.
+        """
+        first = max(start, self.oldest)
+        last = min(first + count, self.total)
+        if last <= first:
+            return first, b''
+
+        slot = first % self.capacity
+        count = last - first
+        head = min(count, self.capacity - slot)
+        offset = RING_HEADER_SIZE + slot * TRANSITION_RECORD_SIZE
+        data = self._map[offset:offset + head * TRANSITION_RECORD_SIZE]
+        if head < count:
+            data += self._map[RING_HEADER_SIZE:RING_HEADER_SIZE + (count - head) * TRANSITION_RECORD_SIZE]
+        return first, data
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+
+def _column_list(column):
+    return column.tolist() if hasattr(column, "tolist") else list(column)
+
+
+class TransitionIndex:
+    """Sparse timestamp index and node status checkpoints over a recording.
+
+    Record indices are those of the TransitionRing. The timestamp of every
+    `stride`-th record is sampled, and at every `checkpoint_every`-th sample
+    the status of every node before that record is saved. A checkpoint is
+    complete when the statuses of all nodes were known, which is the case
+    when the recording was seeded with a STATUS snapshot at its start.
+    """
+
+    def __init__(self, stride=INDEX_STRIDE, checkpoint_every=CHECKPOINT_EVERY, byteorder="big"):
+        self.stride = stride
+        self.checkpoint_every = checkpoint_every
+        self.byteorder = byteorder
+        self.reset()
+
+    def reset(self, state=None, start=0):
+        """Starts over at record `start`; `state` maps uid -> status when known."""
+        self._timestamps = []
+        self._positions = []
+        self._checkpoint_positions = []
+        self._checkpoints = []  # (uid -> status, complete), parallel to _checkpoint_positions
+        self._state = dict(state or {})
+        self._complete = state is not None
+        self._next = start
+
+    def observe(self, first, records):
+        """Indexes packed records appended to the ring at index `first`."""
+        columns = decode_transitions(records, byteorder=self.byteorder)
+        uids = _column_list(columns.uid)
+        statuses = _column_list(columns.status)
+        timestamps = columns.timestamp
+        count = len(uids)
+        if first != self._next:
+            # Records were skipped (ring overflow); earlier state no longer applies
+            self._complete = False
+        self._next = first + count
+
+        position = 0
+        sample = -(-first // self.stride) * self.stride
+        while sample < first + count:
+            offset = sample - first
+            self._state.update(zip(uids[position:offset], statuses[position:offset]))
+            position = offset
+            self._timestamps.append(int(timestamps[offset]))
+            self._positions.append(sample)
+            if (sample // self.stride) % self.checkpoint_every == 0:
+                self._checkpoint_positions.append(sample)
+                self._checkpoints.append((dict(self._state), self._complete))
+            sample += self.stride
+        self._state.update(zip(uids[position:], statuses[position:]))
+
+    def trim(self, oldest):
+        """Drops samples and checkpoints for records overwritten in the ring."""
+        cut = bisect.bisect_left(self._positions, oldest)
+        if cut:
+            del self._timestamps[:cut]
+            del self._positions[:cut]
+        cut = bisect.bisect_left(self._checkpoint_positions, oldest)
+        if cut:
+            del self._checkpoint_positions[:cut]
+            del self._checkpoints[:cut]
+
+    def lower_bound(self, timestamp, oldest):
+        """Index of a record at or before the first one with a timestamp >= `timestamp`."""
+        sample = bisect.bisect_left(self._timestamps, timestamp) - 1
+        return max(self._positions[sample], oldest) if sample >= 0 else oldest
+
+    def checkpoint(self, index, oldest):
+        """Returns (position, uid -> status, complete) of the last checkpoint at or before `index`.
+
+        Without one, an empty incomplete state at `oldest` is returned.
+        """
+        found = bisect.bisect_right(self._checkpoint_positions, index) - 1
+        if found < 0:
+            return oldest, {}, False
+        state, complete = self._checkpoints[found]
+        return self._checkpoint_positions[found], dict(state), complete
+
+    def stats(self):
+        return {
+            "index_samples": len(self._positions),
+            "checkpoints": len(self._checkpoints),
+            "tracked_nodes": len(self._state),
+        }
+
+
+class Recorder:
+    """Runs a recording on one backend and drains its transitions into a TransitionRing."""
+
+    def __init__(self, backend, path, capacity=DEFAULT_RING_CAPACITY, drain_interval=DEFAULT_DRAIN_INTERVAL,
+                 byteorder="big", resume=True):
+        self.backend = backend
+        self.path = path
+        self.resume = resume
+        self.capacity = capacity
+        self.drain_interval = drain_interval
+        self.byteorder = byteorder
+        self.recording = False
+        self.index = TransitionIndex(byteorder=byteorder)
+        self._ring = None
+        self._task = None
+        self._stop_event = asyncio.Event()
+
+        self._stats = {
+            "drains": 0,
+            "drain_errors": 0,
+            "records_drained": 0,
+            "overflow_suspected": 0,
+            "last_drain_duration": 0.0,
+        }
+
+    @property
+    def ring(self):
+        # Opened on first use so an unused recorder doesn't create its file
+        if self._ring is None:
+            self._ring = TransitionRing(self.path, self.capacity, resume=self.resume)
+            self._rebuild_index()
+        return self._ring
+
+    def _rebuild_index(self):
+        """Indexes a recording reopened from disk; its checkpoints are incomplete."""
+        ring = self._ring
+        self.index.reset(start=ring.oldest)
+        for start in range(ring.oldest, ring.total, MAX_TRANSITIONS_PAGE):
+            first, records = ring.read(start, MAX_TRANSITIONS_PAGE)
+            self.index.observe(first, records)
+
+    async def start(self):
+        """Starts recording on the backend; a running recording is left as is."""
+        if self.recording:
+            return self.status()
+
+        header = serialize_request_header(PROTOCOL_ID, 'r', get_next_request_id())
+        header_data, body = split_reply(await self.backend.request([header, b"start"]))
+        start_time = int(body.decode('utf-8').strip() or 0)
+
+        self.ring.reset(start_time, header_data["tree_id"])
+        self.index.reset(await self._status_snapshot())
+        self.recording = True
+        self._stop_event.clear()
+        self._task = asyncio.create_task(self._drain_loop())
+        logger.info(f"Recording started on {self.backend.req_endpoint} into {self.path}")
+        return self.status()
+
+    async def _status_snapshot(self):
+        """Node statuses right after recording started, used as the first checkpoint."""
+        header = serialize_request_header(PROTOCOL_ID, 'S', get_next_request_id())
+        try:
+            _, body = split_reply(await self.backend.request([header]))
+            columns = decode_status(body, byteorder=self.byteorder)
+        except Exception as e:
+            logger.warning(f"No status snapshot for recording start, checkpoints will be incomplete: {e}")
+            return None
+        return {uid: (status if status < IDLE_STATUS_OFFSET else 0)
+                for uid, status in zip(_column_list(columns.uid), _column_list(columns.status))}
+
+    async def stop(self):
+        """Stops recording on the backend and drains what it buffered up to that point."""
+        if not self.recording:
+            return self.status()
+
+        self.recording = False
+        self._stop_event.set()
+        if self._task is not None:
+            # Let an in-flight drain land; its records are already gone from the backend
+            await self._task
+            self._task = None
+
+        header = serialize_request_header(PROTOCOL_ID, 'r', get_next_request_id())
+        split_reply(await self.backend.request([header, b"stop"]))
+        await self.drain_once()
+        self.ring.flush()
+        logger.info(f"Recording stopped on {self.backend.req_endpoint}: {self.ring.total} transitions")
+        return self.status()
+
+    async def drain_once(self):
+        """Moves the transitions buffered by the backend into the ring; returns the record count."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        header = serialize_request_header(PROTOCOL_ID, 't', get_next_request_id())
+        try:
+            _, body = split_reply(await self.backend.request([header]))
+        finally:
+            self._stats["drains"] += 1
+            self._stats["last_drain_duration"] = loop.time() - started
+
+        first = self.ring.total
+        count = self.ring.append(body)
+        if count:
+            self.index.observe(first, body)
+            self.index.trim(self.ring.oldest)
+        self._stats["records_drained"] += count
+        if count >= BACKEND_TRANSITION_BUFFER:
+            self._stats["overflow_suspected"] += 1
+        return count
+
+    async def _drain_loop(self):
+        loop = asyncio.get_running_loop()
+        last_error = None
+        while self.recording:
+            started = loop.time()
+            count = 0
+            try:
+                count = await self.drain_once()
+                last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["drain_errors"] += 1
+                if str(e) != last_error:
+                    last_error = str(e)
+                    logger.warning(f"Draining transitions from {self.backend.req_endpoint} failed: {e}")
+
+            if count >= BACKEND_TRANSITION_BUFFER:
+                # The backend buffer was full; drain again right away
+                logger.debug(f"Backend transition buffer full ({count} records), draining again")
+                continue
+            try:
+                await asyncio.wait_for(self._stop_event.wait(),
+                                       max(0.0, self.drain_interval - (loop.time() - started)))
+            except asyncio.TimeoutError:
+                pass
+
+    def read(self, start=None, count=MAX_TRANSITIONS_PAGE):
+        """Returns (first index, packed records); without `start` the newest page is returned."""
+        count = max(0, min(count, MAX_TRANSITIONS_PAGE))
+        if start is None:
+            start = max(self.ring.total - count, 0)
+        return self.ring.read(start, count)
+
+    def seek(self, timestamp, count=MAX_TRANSITIONS_PAGE):
+        """Finds the first transition at or after `timestamp` (microseconds since recording start).
+
+        Returns (first index, packed records from there, uid -> status at
+        that instant, complete).
+        """
+        ring = self.ring
+        count = max(0, min(count, MAX_TRANSITIONS_PAGE))
+
+        # The sample before the target bounds the scan to one stride
+        start = self.index.lower_bound(timestamp, ring.oldest)
+        scan_first, scan = ring.read(start, self.index.stride + 1)
+        stamps = _column_list(decode_transitions(scan, byteorder=self.byteorder).timestamp)
+        target = scan_first + bisect.bisect_left(stamps, timestamp)
+
+        position, state, complete = self.index.checkpoint(target, ring.oldest)
+        while position < target:
+            first, records = ring.read(position, min(target - position, MAX_TRANSITIONS_PAGE))
+            if not records:
+                break
+            columns = decode_transitions(records, byteorder=self.byteorder)
+            state.update(zip(_column_list(columns.uid), _column_list(columns.status)))
+            position = first + len(records) // TRANSITION_RECORD_SIZE
+
+        first, records = ring.read(target, count)
+        return first, records, state, complete
+
+    def status(self):
+        """Recording state reported to clients."""
+        ring = self._ring
+        return {
+            "recording": self.recording,
+            "startTime": ring.start_time if ring else 0,
+            "treeId": ring.tree_id if ring else None,
+            "total": ring.total if ring else 0,
+            "oldest": ring.oldest if ring else 0,
+            "capacity": self.capacity,
+            "path": self.path,
+        }
+
+    def stats(self):
+        ring = self._ring
+        return {
+            "recording": self.recording,
+            "drain_interval": self.drain_interval,
+            "capacity": self.capacity,
+            "total": ring.total if ring else 0,
+            "stored": ring.stored if ring else 0,
+            **self.index.stats(),
+            **self._stats,
+        }
+
+    def close(self):
+        self.recording = False
+        self._stop_event.set()
+        if self._task is not None:
+            self._task.cancel()
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
@@ -0,0 +1,140 @@
+"""
+Priority scheduling of requests to one Groot2 backend.
+
+The backend's REP socket answers strictly in arrival order, so once a
+5 MB FULLTREE or blackboard request has been sent, anything sent after it
+waits for it. The scheduler therefore holds requests back *before* they
+are sent: every request belongs to a priority class, each class has a
+limit on requests outstanding at the backend, all classes together share
+a total limit, and when a slot frees up the highest-priority waiting
+request goes first.
+
+    control     breakpoints, hooks, execution control, recording
+    status      STATUS (also the proxy's liveness probe)
+    blackboard  BLACKBOARD
+    bulk        FULLTREE, GET_TRANSITIONS
+
+With the default limits at most one bulk and two blackboard requests can
+be ahead of a control request at the backend.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger("proxy.request_scheduler")
+
+CLASS_CONTROL = "control"
+CLASS_STATUS = "status"
+CLASS_BLACKBOARD = "blackboard"
+CLASS_BULK = "bulk"
+# Highest priority first
+PRIORITY_CLASSES = (CLASS_CONTROL, CLASS_STATUS, CLASS_BLACKBOARD, CLASS_BULK)
+
+DEFAULT_CLASS_LIMITS = {CLASS_CONTROL: 4, CLASS_STATUS: 2, CLASS_BLACKBOARD: 2, CLASS_BULK: 1}
+# The default pool's pipelining capacity (2 connections x 32 in flight), so by
+# default only the per-class limits hold requests back
+DEFAULT_MAX_ACTIVE = 64
+
+_REQUEST_CLASSES = {
+    **dict.fromkeys("IRUDAX>pOsr", CLASS_CONTROL),
+    'S': CLASS_STATUS,
+    'B': CLASS_BLACKBOARD,
+    'T': CLASS_BULK,
+    't': CLASS_BULK,
+}
+
+
+def request_class(frames):
+    """Priority class of a request, from the type char of its header."""
+    return _REQUEST_CLASSES.get(chr(frames[0][1]), CLASS_STATUS)
+
+
+def parse_class_limits(text):
+    """Parses "control=4,bulk=1" as given on the command line."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, value = item.partition("=")
+        if name not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown request class: {name}")
+        limits[name] = int(value)
+        if limits[name] < 1:
+            raise ValueError(f"Limit for {name} must be at least 1")
+    return limits
+
+
+class RequestScheduler:
+    """Admits backend requests by priority class within per-class concurrency limits."""
+
+    def __init__(self, limits=None, max_active=DEFAULT_MAX_ACTIVE):
+        self.limits = {**DEFAULT_CLASS_LIMITS, **(limits or {})}
+        self.max_active = max_active
+        self._active = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self._waiters = {cls: deque() for cls in PRIORITY_CLASSES}
+        self._stats = {cls: {"requests": 0, "waits": 0, "wait_time_total": 0.0, "wait_time_max": 0.0}
+                       for cls in PRIORITY_CLASSES}
+
+    @asynccontextmanager
+    async def slot(self, cls):
+        await self.acquire(cls)
+        try:
+            yield
+        finally:
+            self.release(cls)
+
+    async def acquire(self, cls):
+        stats = self._stats[cls]
+        stats["requests"] += 1
+        granted = asyncio.get_running_loop().create_future()
+        self._waiters[cls].append(granted)
+        self._admit()
+        if granted.done():
+            return
+
+        stats["waits"] += 1
+        started = time.monotonic()
+        try:
+            await granted
+        except asyncio.CancelledError:
+            if granted.done() and not granted.cancelled():
+                # Granted just as the caller gave up: pass the slot on
+                self.release(cls)
+            elif granted in self._waiters[cls]:
+                # _admit() may already have popped and skipped the cancelled future
+                self._waiters[cls].remove(granted)
+            raise
+        waited = time.monotonic() - started
+        stats["wait_time_total"] += waited
+        stats["wait_time_max"] = max(stats["wait_time_max"], waited)
+
+    def release(self, cls):
+        self._active[cls] -= 1
+        self._admit()
+
+    def _admit(self):
+        for cls in PRIORITY_CLASSES:
+            waiters = self._waiters[cls]
+            while waiters and self._active[cls] < self.limits[cls]:
+                if sum(self._active.values()) >= self.max_active:
+                    # Lower classes must not take the slot a higher one is waiting for
+                    return
+                granted = waiters.popleft()
+                if granted.done():
+                    continue
+                self._active[cls] += 1
+                granted.set_result(None)
+
+    def stats(self):
+        result = {"max_active": self.max_active, "active": sum(self._active.values())}
+        for cls in PRIORITY_CLASSES:
+            stats = self._stats[cls]
+            result[cls] = {
+                "limit": self.limits[cls],
+                "active": self._active[cls],
+                "queued": len(self._waiters[cls]),
+                **stats,
+                "wait_time_avg": stats["wait_time_total"] / stats["waits"] if stats["waits"] else 0.0,
+            }
+        return result
@@ -0,0 +1,253 @@
+"""
+Bounded per-client outbound queues with slow-consumer policies.
+
+Every client connection is wrapped in a SendQueue and a writer task
+drains it, so neither a session handler nor a broadcast ever waits on a
+slow client's socket. Frames are of two kinds:
+
+- control frames (command replies, breakpoint events, errors) are never
+  dropped;
+- stream frames (status and blackboard updates, tagged with the name of
+  their stream) follow the stream's policy once the client falls behind:
+    "coalesce"     only the newest queued frame of the stream is kept;
+    "drop-oldest"  at most `max_size` frames of the stream are queued and
+                   the oldest is dropped to make room.
+
+Delta streams carry sequence numbers, so a client that misses a frame
+sees the gap and asks for a resync. Status keyframes for delta subscribers
+go on a stream of their own, so a queued keyframe is never coalesced away
+by the delta that follows it. A client whose queue has not made
+progress for `max_lag` seconds is disconnected, and so is one whose send
+fails with anything but a closed connection. Lag is checked on every push
+and by a timer while frames are queued, so a client stuck on a quiet
+stream is dropped as well.
+
+With --workers, stream frames from the hub's pollers reach the workers
+over a ZMQ PUB socket, which drops them for a worker more than
+fanout.PUB_HIGH_WATER_MARK frames behind; control frames never take
+that path (see fanout).
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+import websockets
+from websockets.exceptions import ConnectionClosed
+
+from frame_encoding import frame_size, is_text_frame, send_frame
+
+logger = logging.getLogger("proxy.send_queue")
+
+POLICY_COALESCE = "coalesce"
+POLICY_DROP_OLDEST = "drop-oldest"
+POLICIES = (POLICY_COALESCE, POLICY_DROP_OLDEST)
+
+STREAM_STATUS = "status"
+STREAM_STATUS_KEYFRAME = "status-keyframe"
+STREAM_BLACKBOARD = "blackboard"
+
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_MAX_LAG = 10.0  # seconds without progress before a client is dropped
+DEFAULT_POLICIES = {
+    STREAM_STATUS: POLICY_COALESCE,
+    # Deltas only apply on top of their keyframe
+    STREAM_STATUS_KEYFRAME: POLICY_DROP_OLDEST,
+    STREAM_BLACKBOARD: POLICY_DROP_OLDEST,
+}
+
+SLOW_CLIENT_CLOSE_CODE = 1013  # Try Again Later
+SEND_FAILED_CLOSE_CODE = 1011  # Internal Error
+
+
+class SendQueue:
+    """Outbound queue of one client connection; also stands in for the connection itself."""
+
+    def __init__(self, websocket, queues):
+        self.websocket = websocket
+        self._queues = queues
+        self._frames = deque()  # (stream, frame); stream is None for control frames
+        self._wakeup = asyncio.Event()
+        self._writer = None
+        self._progress_at = 0.0
+        self._lag_timer = None
+        self.closed = False
+        self._stats = {
+            "sent": 0,
+            "bytes_sent": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "max_depth": 0,
+        }
+
+    # The session handler treats the queue as its websocket
+
+    @property
+    def subprotocol(self):
+        return self.websocket.subprotocol
+
+    @property
+    def request(self):
+        return getattr(self.websocket, "request", None)
+
+    @property
+    def remote_address(self):
+        return self.websocket.remote_address
+
+    def __aiter__(self):
+        return self.websocket.__aiter__()
+
+    async def send(self, message):
+        """Queues a control frame; it is never dropped."""
+        self.push(message)
+
+    async def close(self, code=1000, reason=""):
+        self.release()
+        await self.websocket.close(code, reason)
+
+    # ------------------------------------------------------------------
+
+    def push(self, frame, stream=None):
+        if self.closed:
+            return
+        if not self._frames:
+            self._progress_at = time.monotonic()
+        elif self._queues.max_lag and time.monotonic() - self._progress_at > self._queues.max_lag:
+            self._disconnect()
+            return
+
+        policy = self._queues.policies.get(stream) if stream else None
+        if policy == POLICY_COALESCE:
+            for queued in self._frames:
+                if queued[0] == stream:
+                    self._frames.remove(queued)
+                    self._stats["coalesced"] += 1
+                    break
+        elif policy == POLICY_DROP_OLDEST:
+            queued = [item for item in self._frames if item[0] == stream]
+            if len(queued) >= self._queues.max_size:
+                self._frames.remove(queued[0])
+                self._stats["dropped"] += 1
+
+        self._frames.append((stream, frame))
+        self._stats["max_depth"] = max(self._stats["max_depth"], len(self._frames))
+        self._wakeup.set()
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write())
+        if self._queues.max_lag and self._lag_timer is None:
+            self._arm_lag_timer()
+
+    def _arm_lag_timer(self):
+        delay = self._progress_at + self._queues.max_lag - time.monotonic()
+        self._lag_timer = asyncio.get_running_loop().call_later(max(delay, 0.0), self._check_lag)
+
+    def _check_lag(self):
+        self._lag_timer = None
+        if self.closed or not self._frames:
+            return
+        if time.monotonic() - self._progress_at >= self._queues.max_lag:
+            self._disconnect()
+        else:
+            self._arm_lag_timer()
+
+    async def _write(self):
+        try:
+            while True:
+                while not self._frames:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                _, frame = self._frames.popleft()
+                await send_frame(self.websocket, frame)
+                self._progress_at = time.monotonic()
+                self._stats["sent"] += 1
+                self._stats["bytes_sent"] += frame_size(frame)
+        except ConnectionClosed:
+            self._frames.clear()
+            self.closed = True
+        except Exception as e:
+            # Ending the writer silently would leave the client connected but deaf
+            logger.error(f"Sending to client {self.remote_address} failed, disconnecting it: {e!r}")
+            self._frames.clear()
+            self.closed = True
+            await self.websocket.close(SEND_FAILED_CLOSE_CODE, "Send failed")
+
+    def _disconnect(self):
+        logger.warning(f"Disconnecting slow client {self.remote_address}: "
+                       f"{len(self._frames)} frames queued, no progress for {self._queues.max_lag:g}s")
+        self._queues.disconnects += 1
+        self.release()
+        asyncio.ensure_future(self.websocket.close(SLOW_CLIENT_CLOSE_CODE, "Client too slow"))
+
+    def release(self):
+        """Stops the writer and discards whatever is still queued."""
+        self.closed = True
+        self._frames.clear()
+        if self._writer is not None:
+            self._writer.cancel()
+        if self._lag_timer is not None:
+            self._lag_timer.cancel()
+            self._lag_timer = None
+        self._queues.discard(self)
+
+    @property
+    def depth(self):
+        return len(self._frames)
+
+    def stats(self):
+        return {"depth": self.depth, **self._stats}
+
+
+class SendQueues:
+    """Creates the SendQueue of every client and aggregates their counters."""
+
+    def __init__(self, max_size=DEFAULT_QUEUE_SIZE, max_lag=DEFAULT_MAX_LAG, policies=None):
+        for stream, policy in (policies or {}).items():
+            if policy not in POLICIES:
+                raise ValueError(f"Unknown send queue policy for {stream}: {policy}")
+        self.max_size = max_size
+        self.max_lag = max_lag
+        self.policies = {**DEFAULT_POLICIES, **(policies or {})}
+        self.disconnects = 0
+        self._queues = set()
+        self._retired = {"sent": 0, "bytes_sent": 0, "dropped": 0, "coalesced": 0}
+
+    def wrap(self, websocket):
+        queue = SendQueue(websocket, self)
+        self._queues.add(queue)
+        return queue
+
+    def discard(self, queue):
+        if queue in self._queues:
+            self._queues.discard(queue)
+            for key in self._retired:
+                self._retired[key] += queue._stats[key]
+
+    def stats(self):
+        totals = dict(self._retired)
+        for queue in self._queues:
+            for key in totals:
+                totals[key] += queue._stats[key]
+        depths = [queue.depth for queue in self._queues]
+        return {
+            "max_size": self.max_size,
+            "max_lag": self.max_lag,
+            "policies": self.policies,
+            "clients": len(depths),
+            "depth": sum(depths),
+            "max_depth": max(depths, default=0),
+            "disconnects": self.disconnects,
+            **totals,
+        }
+
+
+def broadcast(targets, frame, stream=None):
+    """websockets.broadcast that queues `frame` on SendQueue targets as part of `stream`."""
+    direct = []
+    for target in targets:
+        if isinstance(target, SendQueue):
+            target.push(frame, stream)
+        else:
+            direct.append(target)
+    if direct:
+        websockets.broadcast(direct, frame, text=is_text_frame(frame))
@@ -0,0 +1,89 @@
+"""
+Single-flight coalescing of identical backend requests.
+
+Read-only requests (FULLTREE, STATUS, BLACKBOARD) carry a fresh request id
+in their header but are otherwise identical when many clients refresh at
+once. A SingleFlight keys them on (request type, body): the first caller
+sends the request and every concurrent caller with the same key awaits the
+same reply. An optional freshness window lets callers arriving shortly
+after the reply reuse it as well.
+
+The request runs in its own task, so a leader whose client disconnects
+does not fail the requests of the other waiters.
+"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("proxy.single_flight")
+
+DEFAULT_FRESHNESS = 0.0  # seconds a reply may be reused after it arrived (0 = in-flight only)
+
+
+def request_key(frames):
+    """(type char, body frames) of a request, ignoring the per-request id in its header."""
+    return (frames[0][1], *(bytes(frame) for frame in frames[1:]))
+
+
+class SingleFlight:
+    """Shares one in-flight request, and optionally its recent reply, between identical callers."""
+
+    def __init__(self, freshness=DEFAULT_FRESHNESS):
+        self.freshness = freshness
+        self._in_flight = {}  # key -> future
+        self._recent = {}  # key -> (received_at, reply)
+        self._stats = {
+            "leaders": 0,
+            "joined": 0,
+            "fresh_hits": 0,
+        }
+
+    async def do(self, key, fn):
+        """Returns the result of `fn()`, shared with concurrent (and recent) calls for `key`."""
+        if self.freshness > 0:
+            recent = self._recent.get(key)
+            if recent is not None:
+                if time.monotonic() - recent[0] <= self.freshness:
+                    self._stats["fresh_hits"] += 1
+                    return recent[1]
+                del self._recent[key]
+
+        future = self._in_flight.get(key)
+        if future is None:
+            self._stats["leaders"] += 1
+            future = self._in_flight[key] = asyncio.ensure_future(fn())
+            future.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self._stats["joined"] += 1
+        # shield: a cancelled caller must not cancel the request other callers wait for
+        return await asyncio.shield(future)
+
+    def _finish(self, key, future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.debug(f"Shared request {key[0]!r} failed: {future.exception()}")
+            return
+        if self.freshness > 0:
+            self._recent[key] = (time.monotonic(), future.result())
+            self._expire()
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.freshness
+        for key in [key for key, (received_at, _) in self._recent.items() if received_at < cutoff]:
+            del self._recent[key]
+
+    def stats(self):
+        calls = self._stats["leaders"] + self._stats["joined"] + self._stats["fresh_hits"]
+        return {
+            "freshness": self.freshness,
+            "in_flight": len(self._in_flight),
+            **self._stats,
+            "shared_ratio": (calls - self._stats["leaders"]) / calls if calls else 0.0,
+        }
+
+    def clear(self):
+        self._recent.clear()
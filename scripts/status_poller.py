@@ -0,0 +1,252 @@
+"""
+Proxy-side STATUS poller with fan-out to subscribed WebSocket clients.
+
+Instead of every browser driving its own getStatus round trips, one poller
+per backend requests STATUS ('S') at a fixed rate while at least one client
+is subscribed, encodes each frame once and sends the same text to every
+subscriber.
+
+Subscribers pick one of two modes:
+
+- "full": a statusUpdate frame with every node status on each poll.
+- "delta": a statusDelta frame listing only the (uid, status) pairs that
+  changed since the previous poll, plus a full statusUpdate keyframe when
+  the client joins, when the tree changes, on request (resyncStatus) and
+  periodically. Every delta carries a sequence number; a client that sees
+  a gap should ask for a resync. Keyframes for delta subscribers are sent
+  on their own send queue stream, so a slow client's queued keyframe is
+  not replaced by the next delta.
+
+Clients on the binary subprotocol receive the same frames encoded by
+binary_frames; each frame is encoded at most once per wire format.
+"""
+
+import asyncio
+import logging
+import struct
+
+from groot2_protocol import (
+    get_next_request_id,
+    serialize_request_header,
+    split_reply,
+    decode_status_payload,
+    PROTOCOL_ID,
+)
+from groot2_decoding import changed_indices, STATUS_RECORD_SIZE
+from binary_frames import encode_status_keyframe, encode_status_delta
+from frame_encoding import encode_json
+from send_queue import broadcast as queue_broadcast, STREAM_STATUS, STREAM_STATUS_KEYFRAME
+
+logger = logging.getLogger("proxy.status_poller")
+
+DEFAULT_STATUS_RATE = 10.0  # polls per second
+DEFAULT_KEYFRAME_INTERVAL = 5.0  # seconds between full keyframes for delta subscribers
+
+# Status vectors kept for recently seen trees
+MAX_TRACKED_TREES = 4
+
+MODE_FULL = "full"
+MODE_DELTA = "delta"
+
+
+def compute_status_delta(previous, current):
+    """Returns the (uid, status) pairs that differ between two raw status vectors.
+
+    Returns None when the vectors cannot be compared record by record
+    (different node layout), meaning a keyframe is required.
+    """
+    if (len(previous) != len(current)
+            or len(current) % STATUS_RECORD_SIZE
+            or previous[0::3] != current[0::3]
+            or previous[1::3] != current[1::3]):
+        return None
+
+    previous_status = previous[2::3]
+    current_status = current[2::3]
+    if previous_status == current_status:
+        return []
+
+    return [[struct.unpack_from('!H', current, index * STATUS_RECORD_SIZE)[0], current_status[index]]
+            for index in changed_indices(previous_status, current_status)]
+
+
+class StatusPoller:
+    """Polls one backend for node statuses and broadcasts each result to all subscribers."""
+
+    def __init__(self, backend, rate=DEFAULT_STATUS_RATE, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, broadcast=None):
+        """`broadcast(websockets, frame, stream)` replaces send_queue.broadcast, e.g. to reach
+        clients connected to worker processes."""
+        self.backend = backend
+        self.broadcast = broadcast
+        self.interval = 1.0 / rate
+        self.keyframe_interval = keyframe_interval
+        self._subscribers = {}  # websocket -> (mode, binary)
+        self._needs_keyframe = set()
+        self._task = None
+
+        self._vectors = {}  # tree_id -> last raw status vector
+        self._seq = 0
+        self._last_keyframe = 0.0
+
+        self._stats = {
+            "polls": 0,
+            "errors": 0,
+            "frames_sent": 0,
+            "keyframes": 0,
+            "deltas": 0,
+            "changes": 0,
+            "bytes_sent": 0,
+            "last_poll_duration": 0.0,
+        }
+
+    def subscribe(self, websocket, mode=MODE_FULL, binary=False):
+        """Adds a subscriber; binary subscribers get binary_frames frames instead of JSON."""
+        if mode not in (MODE_FULL, MODE_DELTA):
+            raise ValueError(f"Unknown status subscription mode: {mode}")
+        self._subscribers[websocket] = (mode, binary)
+        if mode == MODE_DELTA:
+            self._needs_keyframe.add(websocket)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Status poller started for {self.backend.req_endpoint} at {1.0 / self.interval:g} Hz")
+
+    def unsubscribe(self, websocket):
+        self._subscribers.pop(websocket, None)
+        self._needs_keyframe.discard(websocket)
+
+    def request_keyframe(self, websocket):
+        """Sends a full keyframe to a delta subscriber on the next poll."""
+        if self._subscribers.get(websocket, (None, False))[0] == MODE_DELTA:
+            self._needs_keyframe.add(websocket)
+
+    async def poll_once(self):
+        """Requests STATUS once and returns (header, raw status body)."""
+        header = serialize_request_header(PROTOCOL_ID, 'S', get_next_request_id())
+        # A poll that outlives the interval is stale anyway, so don't wait longer
+        reply_parts = await self.backend.request([header], timeout=max(self.interval * 5, 1.0))
+        return split_reply(reply_parts)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_error = None
+        while self._subscribers:
+            started = loop.time()
+            try:
+                header_data, status_payload = await self.poll_once()
+                self._publish(header_data, status_payload, started)
+                last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["errors"] += 1
+                # Only report when the error changes, not on every tick
+                if str(e) != last_error:
+                    last_error = str(e)
+                    logger.warning(f"Status poll against {self.backend.req_endpoint} failed: {e}")
+                    self._broadcast(self._subscribers, STREAM_STATUS, encode_json({
+                        "type": "error",
+                        "replyTo": "subscribeStatus",
+                        "payload": {"message": f"Status poll failed: {e}"}
+                    }))
+            finally:
+                self._stats["polls"] += 1
+                self._stats["last_poll_duration"] = loop.time() - started
+
+            await asyncio.sleep(max(0.0, self.interval - (loop.time() - started)))
+        logger.info(f"Status poller stopped for {self.backend.req_endpoint}: no subscribers left")
+
+    def _publish(self, header_data, status_payload, now):
+        tree_id = header_data["tree_id"]
+        previous = self._vectors.pop(tree_id, None)
+        self._vectors[tree_id] = status_payload
+        while len(self._vectors) > MAX_TRACKED_TREES:
+            self._vectors.pop(next(iter(self._vectors)))
+
+        full = [ws for ws, (mode, _) in self._subscribers.items() if mode == MODE_FULL]
+        delta = [ws for ws, (mode, _) in self._subscribers.items() if mode == MODE_DELTA]
+
+        changes = None
+        if delta and previous is not None:
+            changes = compute_status_delta(previous, status_payload)
+
+        if changes is None or now - self._last_keyframe >= self.keyframe_interval:
+            # Tree or layout changed, or a periodic resync is due
+            keyframe_targets = delta
+            self._needs_keyframe.clear()
+            self._last_keyframe = now
+        else:
+            keyframe_targets = [ws for ws in delta if ws in self._needs_keyframe]
+            self._needs_keyframe.difference_update(keyframe_targets)
+
+        delta_targets = [ws for ws in delta if ws not in keyframe_targets]
+        if changes and (full or keyframe_targets or delta_targets):
+            self._seq += 1
+
+        if full or keyframe_targets:
+            self._send_encoded(
+                [(full, STREAM_STATUS), (keyframe_targets, STREAM_STATUS_KEYFRAME)],
+                lambda: encode_json({
+                    "type": "statusUpdate",
+                    "payload": {
+                        "data": decode_status_payload(status_payload),
+                        "header": header_data,
+                        "seq": self._seq,
+                        "keyframe": True,
+                    }
+                }),
+                lambda: encode_status_keyframe(self._seq, tree_id, status_payload),
+            )
+            self._stats["keyframes"] += bool(keyframe_targets)
+
+        if changes and delta_targets:
+            self._send_encoded(
+                [(delta_targets, STREAM_STATUS)],
+                lambda: encode_json({
+                    "type": "statusDelta",
+                    "payload": {"treeId": tree_id, "seq": self._seq, "changes": changes}
+                }),
+                lambda: encode_status_delta(self._seq, tree_id, changes),
+            )
+            self._stats["deltas"] += 1
+            self._stats["changes"] += len(changes)
+
+    def _send_encoded(self, groups, encode_json, encode_binary):
+        """Encodes a frame at most once per wire format and sends it to each target in its format.
+
+        `groups` is a list of (targets, send queue stream) pairs.
+        """
+        frames = {}
+        for targets, stream in groups:
+            for binary in (False, True):
+                recipients = [ws for ws in targets if self._subscribers[ws][1] == binary]
+                if not recipients:
+                    continue
+                if binary not in frames:
+                    frames[binary] = encode_binary() if binary else encode_json()
+                self._broadcast(recipients, stream, frames[binary])
+
+    def _broadcast(self, websockets_, stream, frame):
+        if not websockets_:
+            return
+        (self.broadcast or queue_broadcast)(websockets_, frame, stream)
+        self._stats["frames_sent"] += len(websockets_)
+        self._stats["bytes_sent"] += len(frame) * len(websockets_)
+
+    def stats(self):
+        modes = [mode for mode, _ in self._subscribers.values()]
+        return {
+            "rate": 1.0 / self.interval,
+            "keyframe_interval": self.keyframe_interval,
+            "subscribers": len(modes),
+            "delta_subscribers": modes.count(MODE_DELTA),
+            "binary_subscribers": sum(binary for _, binary in self._subscribers.values()),
+            "running": self._task is not None and not self._task.done(),
+            "seq": self._seq,
+            **self._stats,
+        }
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        self._subscribers.clear()
+        self._needs_keyframe.clear()
@@ -0,0 +1,152 @@
+"""
+Per-request tracing into a fixed-size in-memory ring, and off-loop logging.
+
+Every client command gets a Span when it is received. The span travels
+with the command's task in a context variable, so code further down
+(BackendPool.request, CommandReplies.send) adds timestamped events to it
+without being passed anything:
+
+    recv          command read from the WebSocket
+    start         handler started (after waiting for its lane)
+    backend_send  request sent to the backend (after its scheduler slot)
+    backend_reply reply received
+    ws_send       reply handed to the client's WebSocket / send queue
+
+Finished spans go into a deque of `capacity` entries; nothing is formatted
+until the ring is dumped (getTraces command, --expose-traces only). With
+capacity 0 no span is created and each event costs one context variable
+lookup.
+
+queue_logging() moves log handlers (console output) to a background
+thread, so logging calls on the event loop only enqueue the record.
+"""
+
+import contextvars
+import itertools
+import logging
+import queue
+import time
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
+
+logger = logging.getLogger("proxy.tracing")
+
+DEFAULT_TRACE_CAPACITY = 1024  # finished spans kept
+
+_current_span = contextvars.ContextVar("groot2_proxy_span", default=None)
+
+
+class Span:
+    """Events of one client command, as (name, nanoseconds since recv, detail)."""
+
+    __slots__ = ("id", "command", "backend", "request_id", "started_at", "_t0", "events", "error", "finished")
+
+    def __init__(self, span_id, command, backend=None, request_id=None):
+        self.id = span_id
+        self.command = command
+        self.backend = backend
+        self.request_id = request_id
+        self.started_at = time.time()
+        self._t0 = time.perf_counter_ns()
+        self.events = [("recv", 0, None)]
+        self.error = None
+        self.finished = False
+
+    def event(self, name, detail=None):
+        # Tasks started by a command (e.g. a poller) inherit its span; ignore them once it ended
+        if not self.finished:
+            self.events.append((name, time.perf_counter_ns() - self._t0, detail))
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "command": self.command,
+            "backend": self.backend,
+            "requestId": self.request_id,
+            "startedAt": self.started_at,
+            "durationMs": self.events[-1][1] / 1e6,
+            "error": self.error,
+            "events": [{"name": name, "atMs": offset / 1e6, **({"detail": detail} if detail is not None else {})}
+                       for name, offset, detail in self.events],
+        }
+
+
+class Tracer:
+    """Creates spans and keeps the most recent finished ones."""
+
+    def __init__(self, capacity=DEFAULT_TRACE_CAPACITY):
+        self._ids = itertools.count(1)
+        self.configure(capacity)
+
+    def configure(self, capacity):
+        self.capacity = capacity
+        self._ring = deque(maxlen=capacity or None)
+        self._finished = 0
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    def start(self, command, backend=None, request_id=None):
+        """Returns a new span, or None when tracing is off."""
+        if not self.capacity:
+            return None
+        return Span(next(self._ids), command, backend, request_id)
+
+    def finish(self, span, error=None):
+        if span is None:
+            return
+        span.event("end")
+        span.finished = True
+        span.error = error
+        self._ring.append(span)
+        self._finished += 1
+
+    def dump(self, limit=None, command=None):
+        """Finished spans as dicts, oldest first; `command` filters by command type."""
+        spans = [span for span in self._ring if command is None or span.command == command]
+        if limit:
+            spans = spans[-limit:]
+        return [span.to_dict() for span in spans]
+
+    def clear(self):
+        self._ring.clear()
+
+    def stats(self):
+        return {"capacity": self.capacity, "spans": len(self._ring), "finished": self._finished}
+
+
+TRACER = Tracer()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def set_current_span(span):
+    """Makes `span` current for this context and tasks created from it; returns a reset token."""
+    return _current_span.set(span)
+
+
+def reset_current_span(token):
+    _current_span.reset(token)
+
+
+def trace_event(name, detail=None):
+    """Adds an event to the current span, if any."""
+    span = _current_span.get()
+    if span is not None:
+        span.event(name, detail)
+
+
+def queue_logging(root=None):
+    """Moves the handlers of `root` (default: the root logger) to a background thread.
+
+    Returns the started QueueListener; stop() it to flush on shutdown.
+    """
+    root = root or logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    return listener
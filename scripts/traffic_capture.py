@@ -0,0 +1,152 @@
+"""
+Capture of backend traffic for offline replay (see tests/replay_capture.py).
+
+With --capture-file every ZMQ request, its reply and every PUB message the
+proxy exchanges with its backends is appended to one binary file, frames
+unchanged, with a microsecond timestamp. Replaying it as a fake backend
+reproduces a user's trees, status churn and blackboard payloads.
+
+File layout (integers big-endian):
+
+    header   magic | u16 version | u64 start time (us since epoch)
+    records  u8 kind | u8 endpoint | u64 us since start | u32 seq | u16 frame count
+             | frame count * (u32 length | bytes)
+
+Kinds are ENDPOINT (frames: REQ and PUB endpoint, declares the endpoint
+index used by later records), REQUEST, REPLY (same seq as its request) and
+PUB. Requests that fail or time out have no REPLY record.
+
+Writes go through a large buffer flushed about once a second, so capturing
+costs a memcpy per message; once the file reaches its size limit further
+records are dropped and counted.
+"""
+
+import logging
+import struct
+import time
+from collections import namedtuple
+
+logger = logging.getLogger("proxy.traffic_capture")
+
+CAPTURE_MAGIC = b"G2CAPTUR"
+CAPTURE_VERSION = 1
+_FILE_HEADER = struct.Struct('!8sHQ')
+_RECORD_HEADER = struct.Struct('!BBQIH')
+_FRAME_LENGTH = struct.Struct('!I')
+
+KIND_ENDPOINT = 0
+KIND_REQUEST = 1
+KIND_REPLY = 2
+KIND_PUB = 3
+
+DEFAULT_CAPTURE_MAX_BYTES = 1 << 30
+WRITE_BUFFER_SIZE = 1 << 20
+FLUSH_INTERVAL = 1.0  # seconds
+MAX_ENDPOINTS = 256  # the endpoint index is one byte
+
+CaptureRecord = namedtuple("CaptureRecord", ["kind", "endpoint", "timestamp", "seq", "frames"])
+
+
+class TrafficCapture:
+    """Appends backend traffic of all pools to one capture file."""
+
+    def __init__(self, path, max_bytes=DEFAULT_CAPTURE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.start_time = time.time()
+        self._t0 = time.monotonic()
+        self._file = open(path, "wb", buffering=WRITE_BUFFER_SIZE)
+        self._file.write(_FILE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, int(self.start_time * 1e6)))
+        self._flushed_at = self._t0
+        self._endpoints = []
+        self._seq = 0
+        self._stats = {"records": 0, "bytes": _FILE_HEADER.size, "dropped": 0}
+        logger.info(f"Capturing backend traffic to {path}")
+
+    def endpoint(self, req_endpoint, pub_endpoint):
+        """Declares a backend endpoint and returns its index for the other records,
+        or None when the file already has MAX_ENDPOINTS endpoints."""
+        index = len(self._endpoints)
+        if index >= MAX_ENDPOINTS:
+            logger.warning(f"Not capturing {req_endpoint}: {self.path} already has {MAX_ENDPOINTS} endpoints")
+            return None
+        self._endpoints.append(req_endpoint)
+        self._write(KIND_ENDPOINT, index, 0, [req_endpoint.encode(), pub_endpoint.encode()], force=True)
+        return index
+
+    def request(self, endpoint, frames):
+        """Records a request and returns the seq its reply is recorded with."""
+        self._seq = (self._seq + 1) & 0xFFFFFFFF
+        self._write(KIND_REQUEST, endpoint, self._seq, frames)
+        return self._seq
+
+    def reply(self, endpoint, seq, frames):
+        self._write(KIND_REPLY, endpoint, seq, frames)
+
+    def pub(self, endpoint, frames):
+        self._write(KIND_PUB, endpoint, 0, frames)
+
+    def _write(self, kind, endpoint, seq, frames, force=False):
+        if self._file is None:
+            return
+        size = _RECORD_HEADER.size + sum(_FRAME_LENGTH.size + len(frame) for frame in frames)
+        if not force and self._stats["bytes"] + size > self.max_bytes:
+            if not self._stats["dropped"]:
+                logger.warning(f"Capture file {self.path} reached {self.max_bytes} bytes; no longer capturing")
+            self._stats["dropped"] += 1
+            return
+
+        now = time.monotonic()
+        write = self._file.write
+        write(_RECORD_HEADER.pack(kind, endpoint, int((now - self._t0) * 1e6), seq, len(frames)))
+        for frame in frames:
+            write(_FRAME_LENGTH.pack(len(frame)))
+            write(frame)
+        self._stats["records"] += 1
+        self._stats["bytes"] += size
+        if now - self._flushed_at >= FLUSH_INTERVAL:
+            self._file.flush()
+            self._flushed_at = now
+
+    def stats(self):
+        return {"path": self.path, "max_bytes": self.max_bytes, **self._stats}
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_capture(path):
+    """Returns (start time in us since epoch, list of CaptureRecord) of a capture file.
+
+    A record cut short by a crash ends the list instead of raising.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, start_time = _FILE_HEADER.unpack_from(data)
+    if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+        raise ValueError(f"{path} is not a version {CAPTURE_VERSION} capture file")
+
+    records = []
+    offset = _FILE_HEADER.size
+    view = memoryview(data)
+    while offset + _RECORD_HEADER.size <= len(data):
+        kind, endpoint, timestamp, seq, count = _RECORD_HEADER.unpack_from(data, offset)
+        position = offset + _RECORD_HEADER.size
+        frames = []
+        for _ in range(count):
+            if position + _FRAME_LENGTH.size > len(data):
+                break
+            (length,) = _FRAME_LENGTH.unpack_from(data, position)
+            position += _FRAME_LENGTH.size
+            if position + length > len(data):
+                break
+            frames.append(bytes(view[position:position + length]))
+            position += length
+        if len(frames) != count:
+            logger.warning(f"{path} ends with a truncated record")
+            break
+        records.append(CaptureRecord(kind, endpoint, timestamp, seq, frames))
+        offset = position
+    return start_time, records
@@ -0,0 +1,146 @@
+"""
+Tree XML cache keyed by tree_id.
+
+Every Groot2 reply header carries the UUID of the loaded tree, so the proxy
+can answer getTree locally for as long as replies keep reporting the same
+tree_id. Entries are dropped as soon as any reply reports a different one.
+When no reply has confirmed the tree_id recently, a STATUS request (a few
+bytes per node) revalidates it before serving the cached FULLTREE XML.
+
+Each entry has an ETag (a hash of the XML) so clients that already hold the
+tree can ask for it conditionally and get a tiny treeUnchanged reply.
+
+Entries also keep a gzip copy of the XML, compressed once (off the event
+loop) the first time a client that accepts gzip asks for it, so several-MB
+trees are neither re-sent raw nor re-compressed per connection.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import logging
+
+from groot2_protocol import (
+    get_next_request_id,
+    serialize_request_header,
+    split_reply,
+    PROTOCOL_ID,
+)
+
+logger = logging.getLogger("proxy.tree_cache")
+
+DEFAULT_REVALIDATE_AFTER = 2.0  # seconds without a reply before re-checking tree_id
+MAX_CACHED_TREES = 4
+DEFAULT_GZIP_LEVEL = 9  # paid once per tree, so favour size over speed
+
+
+class TreeEntry:
+    """FULLTREE XML for one tree_id."""
+
+    __slots__ = ("tree_id", "xml", "header", "etag", "size", "gzip")
+
+    def __init__(self, tree_id, xml, header):
+        self.tree_id = tree_id
+        self.xml = xml
+        self.header = header
+        data = xml.encode('utf-8')
+        self.etag = hashlib.blake2b(data, digest_size=16).hexdigest()
+        self.size = len(data)
+        self.gzip = None  # filled in by TreeCache.compressed()
+
+
+class TreeCache:
+    """Serves FULLTREE XML for one backend, fetching it only when the tree changed."""
+
+    def __init__(self, backend, revalidate_after=DEFAULT_REVALIDATE_AFTER, gzip_level=DEFAULT_GZIP_LEVEL):
+        self.backend = backend
+        self.revalidate_after = revalidate_after
+        self.gzip_level = gzip_level
+        self._entries = {}  # tree_id -> TreeEntry
+        self._compressing = {}  # etag -> task compressing that entry
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "revalidations": 0,
+            "invalidations": 0,
+            "compressions": 0,
+            "compressed_served": 0,
+        }
+        backend.add_tree_change_callback(self._on_tree_change)
+
+    async def get(self):
+        """Returns (entry, cached) for the tree currently loaded in the backend."""
+        entry = self._entries.get(self.backend.tree_id)
+        if entry is not None and self.backend.tree_id_age() > self.revalidate_after:
+            await self._revalidate()
+            entry = self._entries.get(self.backend.tree_id)
+
+        if entry is not None:
+            self._stats["hits"] += 1
+            return entry, True
+
+        self._stats["misses"] += 1
+        return await self._fetch(), False
+
+    async def compressed(self, entry):
+        """Returns the gzip-compressed XML of `entry`, compressing it on first use."""
+        self._stats["compressed_served"] += 1
+        if entry.gzip is not None:
+            return entry.gzip
+
+        task = self._compressing.get(entry.etag)
+        if task is None:
+            task = self._compressing[entry.etag] = asyncio.ensure_future(self._compress(entry))
+            task.add_done_callback(lambda _: self._compressing.pop(entry.etag, None))
+        return await asyncio.shield(task)
+
+    async def _compress(self, entry):
+        # mtime=0 keeps the output identical for identical XML
+        entry.gzip = await asyncio.to_thread(gzip.compress, entry.xml.encode('utf-8'),
+                                             compresslevel=self.gzip_level, mtime=0)
+        self._stats["compressions"] += 1
+        logger.info(f"Compressed tree {entry.tree_id}: {entry.size} -> {len(entry.gzip)} bytes")
+        return entry.gzip
+
+    async def _revalidate(self):
+        # Any reply updates backend.tree_id; STATUS is the cheapest one
+        self._stats["revalidations"] += 1
+        header = serialize_request_header(PROTOCOL_ID, 'S', get_next_request_id())
+        await self.backend.request_shared([header])
+
+    async def _fetch(self):
+        header = serialize_request_header(PROTOCOL_ID, 'T', get_next_request_id())
+        reply_parts = await self.backend.request_shared([header])
+        header_data, body = split_reply(reply_parts)
+        entry = TreeEntry(header_data["tree_id"], body.decode('utf-8', errors='replace'), header_data)
+        logger.info(f"Fetched tree {entry.tree_id} from {self.backend.req_endpoint} ({len(entry.xml)} chars)")
+
+        # An empty tree means nothing is loaded yet; don't pin that in the cache
+        if entry.xml.strip():
+            self._entries[entry.tree_id] = entry
+            while len(self._entries) > MAX_CACHED_TREES:
+                self._entries.pop(next(iter(self._entries)))
+        return entry
+
+    def _on_tree_change(self, tree_id):
+        stale = [cached_id for cached_id in self._entries if cached_id != tree_id]
+        for cached_id in stale:
+            del self._entries[cached_id]
+        if stale:
+            self._stats["invalidations"] += len(stale)
+            logger.info(f"Invalidated {len(stale)} cached tree(s) after switch to {tree_id}")
+
+    def stats(self):
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            "entries": len(self._entries),
+            "bytes": sum(entry.size for entry in self._entries.values()),
+            "compressed_bytes": sum(len(entry.gzip) for entry in self._entries.values() if entry.gzip),
+            **self._stats,
+            "hit_ratio": self._stats["hits"] / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        self.backend.remove_tree_change_callback(self._on_tree_change)
+        for task in self._compressing.values():
+            task.cancel()
@@ -0,0 +1,95 @@
+"""
+permessage-deflate settings for the proxy's WebSocket server.
+
+websockets negotiates permessage-deflate by default and then compresses
+every data frame. For the proxy's traffic that is mostly wasted CPU: status
+frames and command replies are a few hundred bytes and barely shrink, while
+the few large frames (tree XML, blackboards) dominate the savings.
+
+server_extensions() builds the extension list for websockets.serve with
+configurable window bits and memory level, and wraps the negotiated
+extension so that messages smaller than a threshold, and binary frames
+whose payload is already compressed (see binary_frames.PRECOMPRESSED_KINDS),
+are sent without compression. RFC 7692 allows this per message: such
+frames simply don't set RSV1 and never touch the compression context.
+"""
+
+import logging
+
+from websockets.extensions.base import Extension
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+from websockets.frames import CTRL_OPCODES, Opcode
+
+logger = logging.getLogger("proxy.ws_compression")
+
+DEFAULT_WINDOW_BITS = 12  # same as the websockets default
+DEFAULT_MEMORY_LEVEL = 5  # same as the websockets default
+DEFAULT_THRESHOLD = 1024  # bytes; smaller messages are sent uncompressed
+
+
+class ThresholdDeflate(Extension):
+    """Wraps a negotiated PerMessageDeflate and only compresses messages worth compressing."""
+
+    def __init__(self, deflate, threshold=DEFAULT_THRESHOLD, skip_kinds=(), stats=None):
+        """`stats` is a counter dict shared by all connections of one server."""
+        self.deflate = deflate
+        self.name = deflate.name
+        self.threshold = threshold
+        self._skip_prefixes = {bytes([kind]) for kind in skip_kinds}
+        self._skip_message = False
+        self.stats = stats if stats is not None else {"compressed": 0, "skipped": 0}
+
+    def decode(self, frame, *, max_size=None):
+        return self.deflate.decode(frame, max_size=max_size)
+
+    def encode(self, frame):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        if frame.opcode is not Opcode.CONT:
+            # The first frame decides for the whole message
+            self._skip_message = len(frame.data) < self.threshold or (
+                frame.opcode is Opcode.BINARY and bytes(frame.data[:1]) in self._skip_prefixes)
+            self.stats["skipped" if self._skip_message else "compressed"] += 1
+        if self._skip_message:
+            return frame
+        return self.deflate.encode(frame)
+
+    def __repr__(self):
+        return f"ThresholdDeflate({self.deflate!r}, threshold={self.threshold})"
+
+
+class ThresholdDeflateFactory(ServerPerMessageDeflateFactory):
+    """ServerPerMessageDeflateFactory whose negotiated extensions are ThresholdDeflate."""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, skip_kinds=(), **kwargs):
+        super().__init__(**kwargs)
+        self.threshold = threshold
+        self.skip_kinds = skip_kinds
+        self._stats = {"connections": 0, "compressed": 0, "skipped": 0}
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, deflate = super().process_request_params(params, accepted_extensions)
+        self._stats["connections"] += 1
+        return response_params, ThresholdDeflate(deflate, self.threshold, self.skip_kinds, self._stats)
+
+    def stats(self):
+        return {
+            "window_bits": self.server_max_window_bits,
+            "memory_level": self.compress_settings.get("memLevel"),
+            "threshold": self.threshold,
+            **self._stats,
+        }
+
+
+def server_extensions(enabled=True, window_bits=DEFAULT_WINDOW_BITS, memory_level=DEFAULT_MEMORY_LEVEL,
+                      threshold=DEFAULT_THRESHOLD, skip_kinds=()):
+    """Extensions for websockets.serve(..., compression=None, extensions=...)."""
+    if not enabled:
+        return []
+    return [ThresholdDeflateFactory(
+        threshold=threshold,
+        skip_kinds=skip_kinds,
+        server_max_window_bits=window_bits,
+        client_max_window_bits=window_bits,
+        compress_settings={"memLevel": memory_level},
+    )]
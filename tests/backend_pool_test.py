@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the shared backend connection pool (scripts/backend_pool.py),
+run against a ROUTER/PUB stub standing in for the Groot2 backend.
+
+Usage:
+  python3 -m pytest -q tests/backend_pool_test.py
+"""
+
+import asyncio
+import struct
+import uuid
+
+import pytest
+import zmq
+import zmq.asyncio
+
+import backend_pool
+from backend_pool import BackendPool, ConnectionPoolManager
+from backend_transport import BackendRequestTimeout, DEFAULT_MAX_IN_FLIGHT
+
+TREE_ID = bytes(range(16))
+
+
+def header(type_char, request_id):
+    return struct.pack('!BBi', 2, ord(type_char), request_id)
+
+
+def request_id_of(reply_parts):
+    return struct.unpack('!BBi', reply_parts[0][:6])[2]
+
+
+class BackendStub:
+    """Answers every request after a delay by echoing its header; publishes on demand."""
+
+    def __init__(self, context, latency=0.0, answer=True):
+        self.latency = latency
+        self.answer = answer
+        self.tree_id = TREE_ID
+        self.router = context.socket(zmq.ROUTER)
+        self.router.setsockopt(zmq.LINGER, 0)
+        self.req_port = self.router.bind_to_random_port("tcp://127.0.0.1")
+        self.publisher = context.socket(zmq.PUB)
+        self.publisher.setsockopt(zmq.LINGER, 0)
+        self.pub_port = self.publisher.bind_to_random_port("tcp://127.0.0.1")
+        self._task = asyncio.create_task(self._serve())
+
+    async def _serve(self):
+        while True:
+            identity, _, request_header, *_ = await self.router.recv_multipart()
+            if self.answer:
+                asyncio.create_task(self._reply(identity, request_header))
+
+    async def _reply(self, identity, request_header):
+        await asyncio.sleep(self.latency)
+        await self.router.send_multipart([identity, b"", request_header + self.tree_id, b"ok"])
+
+    def close(self):
+        self._task.cancel()
+        self.router.close()
+        self.publisher.close()
+
+
+def run_with_pool(scenario, latency=0.0, answer=True, **pool_options):
+    async def main():
+        context = zmq.asyncio.Context()
+        stub = BackendStub(context, latency=latency, answer=answer)
+        pool = BackendPool(context, "127.0.0.1", stub.req_port, stub.pub_port, **pool_options)
+        try:
+            return await scenario(pool, stub)
+        finally:
+            pool.close()
+            stub.close()
+            context.term()
+    return asyncio.run(main())
+
+
+def test_manager_shares_one_pool_per_endpoint():
+    manager = ConnectionPoolManager(max_size=3)
+    try:
+        pool = manager.get_pool("127.0.0.1", 1667, 1668)
+        assert manager.get_pool("127.0.0.1", 1667, 1668) is pool
+        assert manager.get_pool("127.0.0.1", 1767, 1768) is not pool
+        assert pool.context is manager.context
+        assert pool.max_size == 3
+        assert [s["endpoint"] for s in manager.stats()] == ["tcp://127.0.0.1:1667", "tcp://127.0.0.1:1767"]
+
+        manager.release_pool("127.0.0.1", 1667, 1668)
+        assert manager.get_pool("127.0.0.1", 1667, 1668) is not pool
+    finally:
+        manager.close()
+
+
+def test_concurrent_requests_are_pipelined_over_one_connection():
+    async def scenario(pool, stub):
+        replies = await asyncio.gather(*(pool.request([header('I', i)]) for i in range(3)))
+        return replies, pool.stats()
+
+    replies, stats = run_with_pool(scenario, latency=0.05)
+
+    assert [request_id_of(reply) for reply in replies] == [0, 1, 2]
+    assert stats["requests"] == 3
+    assert stats["created"] == stats["size"] == 1
+    assert stats["waits"] == 0
+    assert stats["transport"]["in_flight"] == 0
+
+
+def test_pool_grows_when_every_connection_is_saturated():
+    async def scenario(pool, stub):
+        replies = await asyncio.gather(*(pool.request([header('I', i)]) for i in range(3)))
+        return replies, pool.stats()
+
+    replies, stats = run_with_pool(scenario, latency=0.05, max_size=2, max_in_flight=1)
+
+    assert [request_id_of(reply) for reply in replies] == [0, 1, 2]
+    assert stats["created"] == stats["size"] == 2
+    # The third request found both connections busy and waited for a slot ...
+    assert stats["waits"] == 1
+    assert stats["transport"]["slot_waits"] == 1
+    assert stats["wait_ratio"] == 1 / 3
+    # ... for about one backend round trip, not for its own round trip as well
+    assert 0.03 < stats["wait_time_total"] == stats["wait_time_max"] < 0.09
+    assert stats["wait_time_avg"] == stats["wait_time_total"]
+
+
+def test_default_limits_keep_full_pipelining():
+    pool = BackendPool(None, "127.0.0.1", 1667, 1668)
+    assert pool.max_in_flight == DEFAULT_MAX_IN_FLIGHT
+
+
+def test_pool_grows_when_the_scheduler_limit_is_spread_over_connections():
+    async def scenario(pool, stub):
+        await pool.request([header('S', 0)])
+        light = pool.stats()
+        await asyncio.gather(*(pool.request([header('S', i)]) for i in range(1, 5)))
+        return light, pool.stats()
+
+    light, heavy = run_with_pool(scenario, latency=0.02, class_limits={"status": 4}, max_active=4)
+
+    # The scheduler's total limit is spread over the pool's connections
+    assert heavy["max_in_flight"] == 2
+    assert light["size"] == 1
+    assert heavy["size"] == heavy["created"] == backend_pool.DEFAULT_POOL_SIZE
+    assert heavy["waits"] == 0
+
+
+def test_idle_connections_are_evicted():
+    async def scenario(pool, stub):
+        for i in range(3):
+            await pool.request([header('I', i)])
+        reused = pool.stats()
+        await asyncio.sleep(1.2)
+        return reused, pool.stats()
+
+    reused, stats = run_with_pool(scenario, idle_timeout=0.2)
+
+    assert reused["created"] == 1
+    assert stats["evicted"] == 1
+    assert stats["size"] == 0
+    # Counters of retired connections are kept
+    assert stats["transport"]["requests"] == 3
+
+
+def test_timed_out_request_keeps_its_connection():
+    async def scenario(pool, stub):
+        with pytest.raises(BackendRequestTimeout):
+            await pool.request([header('I', 1)], timeout=0.1)
+        return pool.stats()
+
+    stats = run_with_pool(scenario, answer=False)
+
+    # Unlike a REQ socket, a DEALER connection can send again
+    assert stats["size"] == 1
+    assert stats["transport"]["timeouts"] == 1
+    assert stats["transport"]["in_flight"] == 0
+
+
+def test_pub_messages_fan_out_within_the_queue_bound(monkeypatch):
+    monkeypatch.setattr(backend_pool, "LISTENER_QUEUE_SIZE", 2)
+
+    async def scenario(pool, stub):
+        first, second = pool.add_listener(), pool.add_listener()
+        # Give the SUB socket time to connect before publishing
+        await asyncio.sleep(0.3)
+        for i in range(4):
+            await stub.publisher.send_multipart([header('N', i), b"hit"])
+        while pool.stats()["pub_messages"] < 4:
+            await asyncio.sleep(0.01)
+        sizes = first.qsize(), second.qsize()
+        pool.remove_listener(second)
+        return first.get_nowait(), sizes, pool.stats()
+
+    received, sizes, stats = run_with_pool(scenario)
+
+    # Each queue kept the oldest messages and dropped the rest
+    assert received == [header('N', 0), b"hit"]
+    assert sizes == (2, 2)
+    assert stats["pub_dropped"] == 4
+    assert stats["listeners"] == 1
+
+
+def test_tree_changes_are_reported_once():
+    changes = []
+
+    async def scenario(pool, stub):
+        pool.add_tree_change_callback(changes.append)
+        pool.add_tree_change_callback(lambda tree_id: 1 / 0)  # failing callbacks are logged
+        await pool.request([header('I', 1)])
+        first = pool.tree_id
+        await pool.request([header('I', 2)])
+        stub.tree_id = uuid.uuid4().bytes
+        await pool.request([header('I', 3)])
+        return first, pool.tree_id, stub.tree_id
+
+    first, second, new_tree_id = run_with_pool(scenario)
+
+    assert first == str(uuid.UUID(bytes=TREE_ID))
+    assert changes == [first, second]
+    assert second == str(uuid.UUID(bytes=new_tree_id))
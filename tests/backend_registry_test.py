@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the multi-backend registry.
+
+Usage:
+  python3 -m pytest -q tests/backend_registry_test.py
+"""
+
+import json
+
+import pytest
+
+from backend_registry import BackendRegistry, UnknownBackendError
+
+
+class FakePoolManager:
+    def __init__(self):
+        self.pools = {}
+        self.released = []
+
+    def get_pool(self, host, req_port, pub_port):
+        return self.pools.setdefault((host, req_port, pub_port), object())
+
+    def release_pool(self, host, req_port, pub_port):
+        self.released.append((host, req_port, pub_port))
+        self.pools.pop((host, req_port, pub_port), None)
+
+
+class FakeServices:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def write_config(path, backends, default=None):
+    path.write_text(json.dumps({"default": default, "backends": backends}))
+
+
+def test_services_are_built_lazily_and_shared(tmp_path):
+    config = tmp_path / "backends.json"
+    write_config(config, {"r1": {"host": "10.0.0.1"}, "r2": {"host": "10.0.0.2", "req_port": 2667}}, default="r2")
+    pools = FakePoolManager()
+    registry = BackendRegistry(pools, FakeServices, config_path=str(config))
+    registry.load()
+
+    assert registry.default == "r2"
+    assert pools.pools == {}
+    services = registry.get()
+    assert services.name == "r2" and registry.get("r2") is services
+    assert list(pools.pools) == [("10.0.0.2", 2667, 1668)]
+    with pytest.raises(UnknownBackendError):
+        registry.get("r3")
+
+
+def test_reload_resets_only_changed_backends(tmp_path):
+    config = tmp_path / "backends.json"
+    write_config(config, {"r1": {"host": "10.0.0.1"}, "r2": {"host": "10.0.0.2"}})
+    pools = FakePoolManager()
+    registry = BackendRegistry(pools, FakeServices, config_path=str(config))
+    registry.load()
+    r1, r2 = registry.get("r1"), registry.get("r2")
+
+    write_config(config, {"r1": {"host": "10.0.0.1"}, "r2": {"host": "10.0.0.99"}, "r3": {"host": "10.0.0.3"}})
+    registry.reload()
+
+    assert registry.get("r1") is r1 and not r1.closed
+    assert r2.closed and registry.get("r2") is not r2
+    assert pools.released == [("10.0.0.2", 1667, 1668)]
+    assert "r3" in registry and len(registry) == 3
+
+
+def test_runtime_edits_are_saved(tmp_path):
+    config = tmp_path / "backends.json"
+    write_config(config, {"r1": {"host": "10.0.0.1"}})
+    registry = BackendRegistry(FakePoolManager(), FakeServices, config_path=str(config), editable=True)
+    registry.load()
+
+    registry.add("r2", "10.0.0.2", 1667, 1668)
+    registry.remove("r1")
+    registry.save()
+
+    saved = json.loads(config.read_text())
+    assert saved["default"] == "r2"
+    assert saved["backends"] == {"r2": {"host": "10.0.0.2", "req_port": 1667, "pub_port": 1668}}
+    with pytest.raises(ValueError):
+        registry.remove("r2")
+    for name in ("../../x", "a/b", "", None):
+        with pytest.raises(ValueError):
+            registry.add(name, "10.0.0.3", 1667, 1668)
+    assert [backend["name"] for backend in registry.describe()] == ["r2"]
+
+
+def test_names_sharing_an_endpoint_share_services(tmp_path):
+    config = tmp_path / "backends.json"
+    write_config(config, {"r1": {"host": "10.0.0.1"}, "alias": {"host": "10.0.0.1"}})
+    pools = FakePoolManager()
+    registry = BackendRegistry(pools, FakeServices, config_path=str(config), editable=True)
+    registry.load()
+    changes = []
+    registry.add_change_callback(changes.append)
+
+    shared = registry.get("alias")
+    assert registry.get("r1") is shared and len(registry.active()) == 1
+    registry.remove("alias")
+    assert not shared.closed and pools.released == []
+    registry.add("r1", "10.0.0.9")
+    assert shared.closed and pools.released == [("10.0.0.1", 1667, 1668)]
+    assert changes == [[], [shared]]
+
+
+def test_a_mirror_follows_the_document_of_another_registry(tmp_path):
+    config = tmp_path / "backends.json"
+    write_config(config, {"r1": {"host": "10.0.0.1"}, "r2": {"host": "10.0.0.2"}}, default="r2")
+    source = BackendRegistry(FakePoolManager(), FakeServices, config_path=str(config), editable=True)
+    source.load()
+    mirror = BackendRegistry(FakePoolManager(), FakeServices)
+    mirror.update(source.document())
+
+    assert mirror.describe() == source.describe()
+    assert mirror.for_endpoint("10.0.0.1", 1667, 1668).name == "r1"
+    with pytest.raises(UnknownBackendError):
+        mirror.for_endpoint("10.0.0.3", 1667, 1668)
+
+    r1 = mirror.get("r1")
+    source.add("r1", "10.0.0.9")
+    mirror.update(source.document())
+    assert r1.closed and mirror.for_endpoint("10.0.0.9", 1667, 1668).name == "r1"
+    # The document is the format of the config file
+    source.save()
+    assert json.loads(config.read_text()) == source.document()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the pipelined DEALER transport, against a ROUTER stub that
+answers requests in any order.
+
+Usage:
+  python3 -m pytest -q tests/backend_transport_test.py
+"""
+
+import asyncio
+import struct
+
+import pytest
+import zmq
+import zmq.asyncio
+
+from backend_transport import BackendRequestTimeout, PipelinedTransport
+
+ENDPOINT = "inproc://backend-transport-test"
+TREE_ID = bytes(range(16))
+
+
+def request(type_char, request_id):
+    return [struct.pack('!BBi', 2, ord(type_char), request_id)]
+
+
+class RouterStub:
+    """Collects requests and answers them when and in the order a test says."""
+
+    def __init__(self, context):
+        self.socket = context.socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.bind(ENDPOINT)
+        self.requests = []  # [identity, b"", header, ...]
+
+    async def receive(self, count):
+        while len(self.requests) < count:
+            self.requests.append(await self.socket.recv_multipart())
+
+    async def reply(self, index, body):
+        identity, _, header, *_ = self.requests[index]
+        await self.socket.send_multipart([identity, b"", header + TREE_ID, body])
+
+    async def error(self, index, message):
+        await self.socket.send_multipart([self.requests[index][0], b"", b"error", message])
+
+
+def run(scenario):
+    async def main():
+        context = zmq.asyncio.Context()
+        stub = RouterStub(context)
+        transport = PipelinedTransport(context, ENDPOINT, default_timeout=2.0)
+        try:
+            await scenario(stub, transport)
+        finally:
+            transport.close()
+            stub.socket.close()
+            context.term()
+
+    asyncio.run(main())
+
+
+def test_replies_are_matched_by_header():
+    async def scenario(stub, transport):
+        calls = [asyncio.ensure_future(transport.request(request('B', i))) for i in range(3)]
+        await stub.receive(3)
+        for index in range(3):
+            await stub.reply(index, f"reply {index}".encode())
+        replies = await asyncio.gather(*calls)
+        assert [reply[1] for reply in replies] == [b"reply 0", b"reply 1", b"reply 2"]
+        assert [reply[0][:6] for reply in replies] == [request('B', i)[0] for i in range(3)]
+        assert transport.in_flight == 0 and not transport._order
+
+    run(scenario)
+
+
+def test_out_of_order_reply_fails_the_skipped_requests():
+    # REP answers in order, so requests a reply overtook will not get theirs
+    async def scenario(stub, transport):
+        calls = [asyncio.ensure_future(transport.request(request('B', i))) for i in range(3)]
+        await stub.receive(3)
+        await stub.reply(2, b"reply 2")
+        assert (await calls[2])[1] == b"reply 2"
+        for call in calls[:2]:
+            with pytest.raises(ConnectionError):
+                await call
+
+        # Their replies turning up later are dropped, not handed to newer requests
+        later = asyncio.ensure_future(transport.request(request('B', 3)))
+        await stub.receive(4)
+        await stub.reply(0, b"reply 0")
+        await stub.reply(3, b"reply 3")
+        assert (await later)[1] == b"reply 3"
+        assert transport.stats()["lost_replies"] == 2 and transport.stats()["late_replies"] == 1
+
+    run(scenario)
+
+
+def test_error_replies_go_to_the_oldest_waiting_request():
+    async def scenario(stub, transport):
+        first = asyncio.ensure_future(transport.request(request('R', 1)))
+        second = asyncio.ensure_future(transport.request(request('R', 2)))
+        await stub.receive(2)
+        await stub.error(0, b"Node ID not found")
+        await stub.reply(1, b"removed")
+        assert await first == [b"error", b"Node ID not found"]
+        assert (await second)[1] == b"removed"
+        assert transport.stats()["errors"] == 1 and not transport._order
+
+    run(scenario)
+
+
+def test_error_reply_after_a_timeout_is_not_handed_to_the_next_request():
+    async def scenario(stub, transport):
+        with pytest.raises(BackendRequestTimeout):
+            await transport.request(request('R', 1), timeout=0.05)
+        waiting = asyncio.ensure_future(transport.request(request('R', 2)))
+        await stub.receive(2)
+
+        # The timed-out request's error turns up late and is dropped
+        await stub.error(0, b"Node ID not found")
+        await stub.error(1, b"Wrong position")
+        assert await waiting == [b"error", b"Wrong position"]
+        stats = transport.stats()
+        assert stats["timeouts"] == 1 and stats["late_replies"] == 1
+        assert not transport._order
+
+    run(scenario)
+
+
+def test_unanswered_requests_are_cleared_by_the_next_header_reply():
+    async def scenario(stub, transport):
+        # Neither request is ever answered, e.g. lost in a backend restart
+        with pytest.raises(BackendRequestTimeout):
+            await transport.request(request('R', 1), timeout=0.05)
+        cancelled = asyncio.ensure_future(transport.request(request('R', 2)))
+        await stub.receive(2)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert len(transport._order) == 2
+
+        waiting = asyncio.ensure_future(transport.request(request('R', 3)))
+        await stub.receive(3)
+        await stub.reply(2, b"removed")
+        assert (await waiting)[1] == b"removed"
+        stats = transport.stats()
+        assert not transport._order
+        assert stats["lost_replies"] == 0 and stats["late_replies"] == 0
+
+    run(scenario)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Unit tests for blackboard key-level diffs.
+
+Usage:
+  python3 -m pytest -q tests/blackboard_poller_test.py
+"""
+
+import json
+
+import msgpack
+
+import blackboard_poller
+from blackboard_poller import (
+    BlackboardPoller,
+    diff_blackboard,
+    index_blackboards,
+    make_subscription,
+    parse_blackboard_names,
+    render_blackboards,
+    summarize_value,
+)
+
+
+class FakeBackend:
+    req_endpoint = "tcp://test:1667"
+
+
+def test_index_keeps_raw_values_per_key():
+    costmap = list(range(500))
+    payload = msgpack.packb({"MainTree": {"goal": "dock", "costmap": costmap}, "Sub": {}})
+
+    blackboards = index_blackboards(payload)
+
+    assert set(blackboards) == {"MainTree", "Sub"}
+    assert msgpack.unpackb(blackboards["MainTree"]["costmap"]) == costmap
+    assert msgpack.unpackb(blackboards["MainTree"]["goal"]) == "dock"
+    assert blackboards["Sub"] == {}
+
+
+def test_index_of_a_reply_that_is_not_a_map_is_empty():
+    assert index_blackboards(msgpack.packb([1, 2])) == {}
+    assert index_blackboards(msgpack.packb("MainTree")) == {}
+
+
+def test_diff_reports_added_changed_and_removed_keys():
+    before = index_blackboards(msgpack.packb({"bb": {"a": 1, "b": list(range(100)), "c": "x"}}))["bb"]
+    after = index_blackboards(msgpack.packb({"bb": {"a": 1, "b": list(range(101)), "d": True}}))["bb"]
+
+    _, _, _, fingerprints = diff_blackboard({}, before)
+    added, changed, removed, _ = diff_blackboard(fingerprints, after)
+
+    assert (added, changed, removed) == (["d"], ["b"], ["c"])
+
+
+def test_names_accept_string_or_list():
+    assert parse_blackboard_names("MainTree; Sub;") == ["MainTree", "Sub"]
+    assert parse_blackboard_names(["Sub"]) == ["Sub"]
+    assert parse_blackboard_names(None) == ["MainTree"]
+
+
+def capture_broadcasts(monkeypatch):
+    sent = []
+    monkeypatch.setattr(blackboard_poller, "queue_broadcast",
+                        lambda targets, frame: sent.append((list(targets), json.loads(frame))))
+    return sent
+
+
+def test_publish_sends_keyframe_then_delta(monkeypatch):
+    sent = capture_broadcasts(monkeypatch)
+
+    poller = BlackboardPoller(FakeBackend())
+    poller._subscribers = {"main": make_subscription("MainTree"), "both": make_subscription("MainTree;Sub")}
+    poller._needs_keyframe.update(poller._subscribers)
+    header = {"tree_id": "tree-a"}
+
+    def publish(data):
+        poller._publish(["MainTree", "Sub"], header, index_blackboards(msgpack.packb(data)))
+
+    publish({"MainTree": {"pose": [0, 0], "map": list(range(200))}, "Sub": {"n": 1}})
+    assert sorted(targets[0] for targets, frame in sent) == ["both", "main"]
+    assert all(frame["type"] == "blackboardUpdate" for _, frame in sent)
+    assert sent[1][1]["payload"]["data"]["Sub"] == {"n": 1}
+
+    sent.clear()
+    publish({"MainTree": {"pose": [1, 0], "map": list(range(200))}, "Sub": {"n": 1}})
+    # One delta per subscription, each with its own sequence
+    assert sorted(targets for targets, _ in sent) == [["both"], ["main"]]
+    assert sent[0][1] == sent[1][1]
+    targets, frame = sent[0]
+    assert frame["type"] == "blackboardDelta"
+    assert frame["payload"]["changed"] == {"pose": [1, 0]}
+    assert (frame["payload"]["added"], frame["payload"]["removed"], frame["payload"]["seq"]) == ({}, [], 1)
+    # The unchanged costmap was never decoded
+    assert poller.stats()["values_decoded"] == 3 + 1
+
+    sent.clear()
+    publish({"MainTree": {"pose": [1, 0], "map": list(range(200))}, "Sub": {"n": 1}})
+    assert sent == []
+
+
+def test_oversized_values_are_summarized():
+    summary = summarize_value(msgpack.packb([[0.5] * 100] + list(range(1000))))
+    assert summary["type"] == "array" and summary["length"] == 1001
+    assert summary["preview"][0] == {"truncated": True, "bytes": 903}
+    assert summary["preview"][1:] == list(range(7))
+
+    assert summarize_value(msgpack.packb({"a": 1, "b": 2}))["keys"] == ["a", "b"]
+    assert summarize_value(msgpack.packb("x" * 1000))["preview"] == "x" * 256
+
+
+def test_render_applies_key_patterns_and_size_cap():
+    payload = msgpack.packb({"MainTree": {"pose": [1, 2], "goal_a": "dock", "goal_b": "home",
+                                          "costmap": list(range(1000))}})
+
+    data = render_blackboards(payload, make_subscription("MainTree", ["goal_*", "costmap"], 64))
+
+    assert set(data["MainTree"]) == {"goal_a", "goal_b", "costmap"}
+    assert data["MainTree"]["goal_a"] == "dock"
+    assert data["MainTree"]["costmap"]["truncated"]
+
+
+def test_filtered_subscriptions_only_get_their_keys(monkeypatch):
+    sent = capture_broadcasts(monkeypatch)
+    poller = BlackboardPoller(FakeBackend())
+    poller._subscribers = {
+        "pose-panel": make_subscription("MainTree", "pose"),
+        "pose-panel-2": make_subscription("MainTree", ["pose"]),
+        "map-panel": make_subscription("MainTree", "map", max_value_bytes=100),
+    }
+    header = {"tree_id": "tree-a"}
+
+    def publish(data):
+        poller._publish(["MainTree"], header, index_blackboards(msgpack.packb({"MainTree": data})))
+
+    publish({"pose": [0, 0], "map": list(range(200))})
+    sent.clear()
+    publish({"pose": [1, 0], "map": list(range(200))})
+    # Identical subscriptions share one frame; the map panel saw no change
+    assert len(sent) == 1
+    targets, frame = sent[0]
+    assert sorted(targets) == ["pose-panel", "pose-panel-2"]
+    assert frame["payload"]["changed"] == {"pose": [1, 0]}
+
+    sent.clear()
+    publish({"pose": [1, 0], "map": list(range(201))})
+    assert [targets for targets, _ in sent] == [["map-panel"]]
+    assert sent[0][1]["payload"]["changed"]["map"]["length"] == 201
+    assert sent[0][1]["payload"]["seq"] == 1
+    assert poller.stats()["subscriptions"] == 2
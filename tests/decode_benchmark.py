@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for Groot2 STATUS / GET_TRANSITIONS payload decoding.
+
+Compares the record-by-record parser the proxy used to run on every status
+reply against the bulk decoders in scripts/groot2_decoding.py, on a
+10k-node STATUS payload and a 1M-record GET_TRANSITIONS payload.
+
+Usage:
+  python3 tests/decode_benchmark.py [--nodes 10000] [--transitions 1000000]
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+import groot2_decoding  # noqa: E402
+from groot2_decoding import decode_status, decode_transitions  # noqa: E402
+
+
+def per_record_status(payload):
+    """The original parse_raw_status_data loop."""
+    nodes = []
+    offset = 0
+    while offset + 3 <= len(payload):
+        uid = struct.unpack('!H', payload[offset:offset + 2])[0]
+        nodes.append({"uid": uid, "status": payload[offset + 2]})
+        offset += 3
+    return nodes
+
+
+def per_record_transitions(payload):
+    transitions = []
+    for offset in range(0, len(payload) - 8, 9):
+        timestamp = int.from_bytes(payload[offset:offset + 6], "big")
+        uid = struct.unpack('!H', payload[offset + 6:offset + 8])[0]
+        transitions.append((timestamp, uid, payload[offset + 8]))
+    return transitions
+
+
+def iter_unpack_status(payload):
+    return list(struct.iter_unpack('!HB', memoryview(payload)[:len(payload) // 3 * 3]))
+
+
+def iter_unpack_transitions(payload):
+    rows = struct.iter_unpack('!6sHB', memoryview(payload)[:len(payload) // 9 * 9])
+    return [(int.from_bytes(stamp, "big"), uid, status) for stamp, uid, status in rows]
+
+
+def measure(function, payload, min_time=0.5):
+    """Returns the best time per call over enough repetitions to fill min_time."""
+    best = float("inf")
+    elapsed = 0.0
+    runs = 0
+    while elapsed < min_time or runs < 3:
+        started = time.perf_counter()
+        function(payload)
+        duration = time.perf_counter() - started
+        best = min(best, duration)
+        elapsed += duration
+        runs += 1
+    return best
+
+
+def report(title, payload, records, candidates):
+    print(f"\n{title}: {records} records, {len(payload) / 1e6:.2f} MB")
+    baseline = None
+    for name, function in candidates:
+        seconds = measure(function, payload)
+        baseline = baseline or seconds
+        print(f"  {name:<28} {seconds * 1e3:9.3f} ms  {records / seconds / 1e6:8.2f} Mrec/s  "
+              f"{len(payload) / seconds / 1e6:8.1f} MB/s  x{baseline / seconds:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Groot2 binary payload decoding")
+    parser.add_argument("--nodes", type=int, default=10_000)
+    parser.add_argument("--transitions", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    status_payload = b''.join(struct.pack('!HB', uid, random.randrange(4)) for uid in range(args.nodes))
+    transitions_payload = os.urandom(9 * args.transitions)
+
+    print(f"NumPy: {'available' if groot2_decoding.np is not None else 'not installed'}")
+
+    status_candidates = [
+        ("per-record struct.unpack", per_record_status),
+        ("struct.iter_unpack", iter_unpack_status),
+        ("bulk (stdlib slices)", lambda p: decode_status(p, use_numpy=False)),
+    ]
+    transition_candidates = [
+        ("per-record struct.unpack", per_record_transitions),
+        ("struct.iter_unpack", iter_unpack_transitions),
+        ("bulk (stdlib slices)", lambda p: decode_transitions(p, use_numpy=False)),
+    ]
+    if groot2_decoding.np is not None:
+        status_candidates.append(("bulk (numpy frombuffer)", decode_status))
+        transition_candidates.append(("bulk (numpy frombuffer)", decode_transitions))
+
+    report("STATUS", status_payload, args.nodes, status_candidates)
+    report("GET_TRANSITIONS", transitions_payload, args.transitions, transition_candidates)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for encoding outbound WebSocket frames.
+
+Measures the cost of delivering one event to 1 and to 100 clients, from
+encoding to the serialized WebSocket frame of every client (websockets'
+protocol layer, without the socket write): encoding the frame once per
+client with json.dumps (what every handler used to do), encoding it once
+and sharing the str, which websockets still encodes to UTF-8 for each
+send, and encoding it once to bytes with encode_json() and sending those
+as text frames. Payloads are a 10k-node statusUpdate and a treeData frame
+carrying a few MB of XML.
+
+Usage:
+  python3 tests/encode_benchmark.py [--nodes 10000] [--tree-mb 5] [--clients 1 100]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from websockets.protocol import State  # noqa: E402
+from websockets.server import ServerProtocol  # noqa: E402
+
+import frame_encoding  # noqa: E402
+from frame_encoding import encode_json  # noqa: E402
+
+
+def measure(function, min_time=0.5):
+    """Returns the best time per call over enough repetitions to fill min_time."""
+    best = float("inf")
+    elapsed = 0.0
+    runs = 0
+    while elapsed < min_time or runs < 3:
+        started = time.perf_counter()
+        function()
+        duration = time.perf_counter() - started
+        best = min(best, duration)
+        elapsed += duration
+        runs += 1
+    return best
+
+
+def open_connections(count):
+    connections = []
+    for _ in range(count):
+        protocol = ServerProtocol()
+        protocol.state = State.OPEN
+        connections.append(protocol)
+    return connections
+
+
+def send(connections, frames):
+    """What Connection.send(frame, text=True) does for each client."""
+    for protocol, frame in zip(connections, frames):
+        protocol.send_text(frame.encode() if isinstance(frame, str) else frame)
+        protocol.data_to_send()
+
+
+def report(title, message, clients):
+    size = len(json.dumps(message))
+    print(f"\n{title}: {size / 1e6:.2f} MB encoded")
+    candidates = [
+        ("json.dumps per client", lambda c: send(c, [json.dumps(message) for _ in c])),
+        ("json once, shared str", lambda c: send(c, [json.dumps(message)] * len(c))),
+        ("encode_json once, bytes", lambda c: send(c, [encode_json(message)] * len(c))),
+    ]
+    for count in clients:
+        connections = open_connections(count)
+        baseline = None
+        for name, function in candidates:
+            seconds = measure(lambda: function(connections))
+            baseline = baseline or seconds
+            print(f"  {count:>4} clients  {name:<24} {seconds * 1e3:9.3f} ms  x{baseline / seconds:.1f}")
+
+
+def tree_xml(megabytes):
+    node = '<Action ID="MoveBase" name="move_{}" goal="{{goal}}" timeout="5.0"/>'
+    nodes = []
+    size = 0
+    while size < megabytes * 1e6:
+        nodes.append(node.format(len(nodes)))
+        size += len(nodes[-1])
+    return f'<root><BehaviorTree ID="MainTree"><Sequence>{"".join(nodes)}</Sequence></BehaviorTree></root>'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark outbound frame encoding")
+    parser.add_argument("--nodes", type=int, default=10_000)
+    parser.add_argument("--tree-mb", type=float, default=5.0)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 100])
+    args = parser.parse_args()
+
+    print(f"orjson: {'available' if frame_encoding.orjson is not None else 'not installed'}")
+
+    header = {"protocol": 2, "type": "S", "unique_id": 1, "tree_id": "2f1e0c1a-7d4b-4b8e-9a55-1d2c3b4a5f60"}
+    status = {"type": "statusUpdate", "payload": {
+        "data": [{"uid": uid, "status": random.randrange(4)} for uid in range(args.nodes)],
+        "header": header, "seq": 1, "keyframe": True}}
+    tree = {"type": "treeData", "payload": {
+        "xml": tree_xml(args.tree_mb), "header": header, "etag": "0" * 32, "cached": True}}
+
+    report("statusUpdate", status, args.clients)
+    report("treeData", tree, args.clients)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Simulated BehaviorTree.CPP Groot2 publisher for tests and benchmarks.
+
+Speaks the REQ/REP + PUB protocol described in docs/groot2_protocol.md on
+two consecutive ports, so the proxy can be exercised without a real
+BT.CPP process:
+
+- FULLTREE 'T' returns a generated XML tree with `nodes` nodes.
+- STATUS 'S' returns the node statuses, which change `tick_rate` times a
+  second (a fraction `churn` of the nodes per tick).
+- BLACKBOARD 'B' returns `blackboards` blackboards of `entries` values
+  each, one of them a `value_size`-character string.
+- Hooks (I/R/U/D/A/X), recording ('r'/'t') and execution control
+  ('>'/'p'/'O'/'s') keep state like the real publisher.
+- Every `breakpoint_interval` seconds a BREAKPOINT_REACHED 'N' event is
+  published for a node with a hook (or any node when none is set).
+
+`latency` seconds (plus up to `jitter`) are spent before every reply and
+`tree_latency` additionally before FULLTREE replies. Like the real
+publisher, the REP socket answers one request at a time.
+
+Usage:
+  python3 tests/fake_groot2_server.py [--port 1667] [--nodes 2000] [--tick-rate 20] [--latency 0.001]
+"""
+
+import argparse
+import json
+import random
+import struct
+import threading
+import time
+import uuid
+
+import msgpack
+import zmq
+
+DEFAULT_PORT = 1667
+POLL_INTERVAL = 0.1  # seconds; how quickly stop() is noticed
+
+STATUS_CHOICES = (0, 1, 2, 3)
+CONTROL_TYPES = ">pOs"
+
+
+class FakeGroot2Server:
+    """Groot2 publisher simulator running on background threads."""
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, nodes=200, tick_rate=10.0, churn=0.05,
+                 blackboards=1, entries=20, value_size=256, breakpoint_interval=0.0,
+                 latency=0.0, jitter=0.0, tree_latency=0.0, seed=None):
+        self.req_endpoint = f"tcp://{host}:{port}"
+        self.pub_endpoint = f"tcp://{host}:{port + 1}"
+        self.nodes = nodes
+        self.tick_rate = tick_rate
+        self.churn = churn
+        self.blackboard_names = ["MainTree"] + [f"SubTree_{i}" for i in range(1, blackboards)]
+        self.entries = entries
+        self.value_size = value_size
+        self.breakpoint_interval = breakpoint_interval
+        self.latency = latency
+        self.jitter = jitter
+        self.tree_latency = tree_latency
+        self.tree_id = uuid.uuid4().bytes
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._status = bytearray(self._random.choice(STATUS_CHOICES) for _ in range(nodes))
+        self._ticks = 0
+        self._running = True
+        self._hooks = {}  # (uid, position) -> hook
+        self._recording_started = None  # time.time() when recording started
+        self._transitions = bytearray()
+        self._xml = self._tree_xml().encode("utf-8")
+        self._stop = threading.Event()
+        self._threads = []
+        self._context = None
+        self.requests = 0
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self):
+        self._context = zmq.Context()
+        rep = self._context.socket(zmq.REP)
+        rep.setsockopt(zmq.LINGER, 0)
+        rep.bind(self.req_endpoint)
+        pub = self._context.socket(zmq.PUB)
+        pub.setsockopt(zmq.LINGER, 0)
+        pub.bind(self.pub_endpoint)
+        self._threads = [threading.Thread(target=self._serve, args=(rep,), daemon=True),
+                         threading.Thread(target=self._tick, args=(pub,), daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._context.term()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # ------------------------------------------------------------------
+    # Simulation
+    # ------------------------------------------------------------------
+
+    def _tree_xml(self):
+        """A Sequence of Fallbacks of ten actions each, with Groot2 _uid attributes."""
+        lines = ['<root BTCPP_format="4">', '<BehaviorTree ID="MainTree">', '<Sequence name="root" _uid="1">']
+        uid = 2
+        while uid <= self.nodes:
+            lines.append(f'<Fallback name="group_{uid}" _uid="{uid}">')
+            uid += 1
+            for _ in range(min(10, self.nodes - uid + 1)):
+                lines.append(f'<Action ID="Simulated" name="action_{uid}" _uid="{uid}" port="{{value_{uid % 50}}}"/>')
+                uid += 1
+            lines.append('</Fallback>')
+        lines += ['</Sequence>', '</BehaviorTree>', '</root>']
+        return "\n".join(lines)
+
+    def _tick(self, pub):
+        interval = 1.0 / self.tick_rate if self.tick_rate > 0 else POLL_INTERVAL
+        next_breakpoint = time.monotonic() + self.breakpoint_interval
+        while not self._stop.wait(interval):
+            with self._lock:
+                if self._running and self.tick_rate > 0:
+                    self._advance()
+            if self.breakpoint_interval > 0 and time.monotonic() >= next_breakpoint:
+                next_breakpoint += self.breakpoint_interval
+                pub.send_multipart([struct.pack('!BBi', 2, ord('N'), 0), str(self._breakpoint_uid()).encode()])
+        pub.close()
+
+    def _advance(self):
+        self._ticks += 1
+        now = time.time()
+        for _ in range(max(1, int(self.nodes * self.churn))):
+            index = self._random.randrange(self.nodes)
+            status = self._random.choice(STATUS_CHOICES)
+            if status == self._status[index]:
+                continue
+            self._status[index] = status
+            if self._recording_started is not None:
+                elapsed = int((now - self._recording_started) * 1e6)
+                self._transitions += elapsed.to_bytes(6, "big") + struct.pack('!HB', index + 1, status)
+
+    def _breakpoint_uid(self):
+        with self._lock:
+            uids = [uid for uid, _ in self._hooks] or [self._random.randrange(1, self.nodes + 1)]
+            return self._random.choice(uids)
+
+    # ------------------------------------------------------------------
+    # REQ/REP
+    # ------------------------------------------------------------------
+
+    def _serve(self, rep):
+        poller = zmq.Poller()
+        poller.register(rep, zmq.POLLIN)
+        while not self._stop.is_set():
+            if not poller.poll(POLL_INTERVAL * 1000):
+                continue
+            header, *body = rep.recv_multipart()
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            if len(header) >= 2 and header[1] == ord('T'):
+                delay += self.tree_latency
+            if delay:
+                time.sleep(delay)
+            self.requests += 1
+            with self._lock:
+                reply = self._handle(header, body)
+            rep.send_multipart(reply)
+        rep.close()
+
+    def _handle(self, header, body):
+        if len(header) != 6 or header[0] != 2:
+            return [b"error", b"Invalid request header"]
+        type_char = chr(header[1])
+        reply_header = header + self.tree_id
+        data = body[0] if body else b""
+        try:
+            if type_char == 'T':
+                return [reply_header, self._xml]
+            if type_char == 'S':
+                return [reply_header, self._status_payload()]
+            if type_char == 'B':
+                return [reply_header, self._blackboard_payload(data.decode("utf-8").split(";"))]
+            if type_char == 'D':
+                # Like BT.CPP, only PRE hooks are dumped
+                pre_hooks = [hook for (_, position), hook in self._hooks.items() if position == 0]
+                return [reply_header, json.dumps(pre_hooks).encode()]
+            if type_char == 'I':
+                hooks = json.loads(data)
+                for hook in hooks if isinstance(hooks, list) else [hooks]:
+                    # Like BT.CPP, hooks on nodes that don't exist are skipped without an error
+                    if 1 <= hook["uid"] <= self.nodes:
+                        self._hooks[hook["uid"], hook.get("position", 0)] = hook
+                return [reply_header]
+            if type_char == 'R':
+                hook = json.loads(data)
+                if self._hooks.pop((hook["uid"], hook.get("position", 0)), None) is None:
+                    return [b"error", b"Node ID not found"]
+                return [reply_header]
+            if type_char == 'U':
+                return [reply_header]
+            if type_char == 'A':
+                self._hooks.clear()
+                return [reply_header]
+            if type_char == 'X':
+                for hook in self._hooks.values():
+                    hook["enabled"] = False
+                return [reply_header]
+            if type_char == 'r':
+                if data == b"start":
+                    self._recording_started = time.time()
+                    self._transitions.clear()
+                    return [reply_header, str(int(self._recording_started * 1e6)).encode()]
+                self._recording_started = None
+                return [reply_header]
+            if type_char == 't':
+                transitions, self._transitions = bytes(self._transitions), bytearray()
+                return [reply_header, transitions]
+            if type_char in CONTROL_TYPES:
+                self._running = type_char in ">s"
+                if type_char == 's':
+                    self._advance()
+                    self._running = False
+                return [reply_header]
+        except (ValueError, KeyError, TypeError) as e:
+            return [b"error", str(e).encode()]
+        return [b"error", b"Request not recognized"]
+
+    def _status_payload(self):
+        payload = bytearray(3 * self.nodes)
+        payload[0::3] = bytes((uid >> 8) & 0xFF for uid in range(1, self.nodes + 1))
+        payload[1::3] = bytes(uid & 0xFF for uid in range(1, self.nodes + 1))
+        payload[2::3] = self._status
+        return bytes(payload)
+
+    def _blackboard_payload(self, names):
+        # BT.CPP packs blackboards from JSON, so large values are strings or arrays, never msgpack bin
+        blob = chr(ord("a") + self._ticks % 26) * self.value_size
+        return msgpack.packb({
+            name: {
+                "tick": self._ticks,
+                "blob": blob,
+                **{f"value_{i}": (self._ticks // (i + 1)) % 100 for i in range(max(0, self.entries - 2))},
+            }
+            for name in names if name in self.blackboard_names
+        })
+
+
+def add_simulation_arguments(parser):
+    """Command-line options shared with load_benchmark.py."""
+    parser.add_argument("--nodes", type=int, default=200, help="Nodes in the simulated tree")
+    parser.add_argument("--tick-rate", type=float, default=10.0, help="Status changes per second")
+    parser.add_argument("--churn", type=float, default=0.05, help="Fraction of nodes changing per tick")
+    parser.add_argument("--blackboards", type=int, default=1, help="Simulated blackboards (MainTree, SubTree_1, ...)")
+    parser.add_argument("--entries", type=int, default=20, help="Values per blackboard")
+    parser.add_argument("--value-size", type=int, default=256, help="Characters of the large string value in each blackboard")
+    parser.add_argument("--breakpoint-interval", type=float, default=0.0, help="Seconds between BREAKPOINT_REACHED events (0 disables)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds spent before every reply")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds per reply")
+    parser.add_argument("--tree-latency", type=float, default=0.0, help="Extra seconds spent before FULLTREE replies")
+
+
+def simulation_options(args):
+    return {
+        "nodes": args.nodes, "tick_rate": args.tick_rate, "churn": args.churn,
+        "blackboards": args.blackboards, "entries": args.entries, "value_size": args.value_size,
+        "breakpoint_interval": args.breakpoint_interval,
+        "latency": args.latency, "jitter": args.jitter, "tree_latency": args.tree_latency,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Groot2 publisher")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="REQ/REP port; PUB is port + 1")
+    add_simulation_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeGroot2Server(args.host, args.port, **simulation_options(args)).start()
+    print(f"Fake Groot2 server on {server.req_endpoint} / {server.pub_endpoint} ({args.nodes} nodes)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
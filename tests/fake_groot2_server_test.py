@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the simulated Groot2 publisher and the load benchmark helpers.
+
+Usage:
+  python3 -m pytest -q tests/fake_groot2_server_test.py
+"""
+
+import json
+import struct
+
+import msgpack
+import zmq
+
+from fake_groot2_server import FakeGroot2Server
+from load_benchmark import free_port_pair, parse_weights, percentile
+from groot2_protocol import split_reply
+from groot2_decoding import decode_status, decode_transitions
+
+
+def request(socket, type_char, *body):
+    socket.send_multipart([struct.pack('!BBi', 2, ord(type_char), 7), *body])
+    return socket.recv_multipart()
+
+
+def test_fake_server_speaks_the_groot2_protocol():
+    port = free_port_pair()
+    with FakeGroot2Server(port=port, nodes=25, tick_rate=200, churn=0.5, seed=1) as server:
+        context = zmq.Context()
+        socket = context.socket(zmq.REQ)
+        socket.setsockopt(zmq.RCVTIMEO, 2000)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(server.req_endpoint)
+        try:
+            header, xml = split_reply(request(socket, 'T'))
+            assert header["type"] == 'T' and xml.count(b"_uid=") == 25
+
+            _, status = split_reply(request(socket, 'S'))
+            assert list(decode_status(status).uid) == list(range(1, 26))
+
+            _, blackboard = split_reply(request(socket, 'B', b"MainTree;Unknown"))
+            assert list(msgpack.unpackb(blackboard)) == ["MainTree"]
+
+            request(socket, 'I', json.dumps({"uid": 3, "position": 0, "mode": 0, "enabled": True}).encode())
+            assert json.loads(request(socket, 'D')[1])[0]["uid"] == 3
+            assert request(socket, 'R', json.dumps({"uid": 9}).encode())[0] == b"error"
+
+            request(socket, 'r', b"start")
+            server._stop.wait(0.05)
+            _, transitions = split_reply(request(socket, 't'))
+            assert len(transitions) % 9 == 0 and len(decode_transitions(transitions).uid) > 0
+
+            assert request(socket, 'Q')[0] == b"error"
+        finally:
+            socket.close()
+            context.term()
+
+
+def test_benchmark_helpers():
+    assert parse_weights("getStatus=8, getTree") == {"getStatus": 8.0, "getTree": 1.0}
+    values = [i / 100 for i in range(1, 101)]
+    assert (percentile(values, 0.5), percentile(values, 0.99), percentile([], 0.5)) == (0.5, 0.99, 0.0)
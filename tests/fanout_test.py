@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the multi-process hub and the workers' link to it.
+
+Usage:
+  python3 -m pytest -q tests/fanout_test.py
+"""
+
+import asyncio
+import struct
+import time
+
+import pytest
+import zmq
+import zmq.asyncio
+
+import fanout
+from fanout import Hub, HubCallError, HubLink, RemoteClient, RemotePoolManager, endpoint_key, worker_topic
+
+TREE_ID = bytes(range(16))
+ENDPOINT = ("127.0.0.1", 1667, 1668)
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    def send_multipart(self, parts):
+        self.sent.append(parts)
+
+    def close(self):
+        pass
+
+
+class FakeQueue:
+    """Stands in for a worker's SendQueue."""
+
+    subprotocol = None
+    remote_address = ("127.0.0.1", 4321)
+
+    def __init__(self):
+        self.frames = []
+
+    def push(self, frame, stream=None):
+        self.frames.append((frame, stream))
+
+
+class FakeHandler:
+    """Answers "request" with a reply carrying TREE_ID and relays events of `pool` on demand."""
+
+    def __init__(self, pool=None):
+        self.hub = None
+        self.pool = pool
+        self.calls = []
+        self.released = []
+
+    async def call(self, worker_id, client, endpoint, method, args):
+        self.calls.append((worker_id, client, endpoint, method, args))
+        if method == "request":
+            return [args[0][0] + TREE_ID, b"ok"]
+        if method == "events":
+            if args[0]:
+                self.hub.forward_events(worker_id, endpoint_key(endpoint), self.pool)
+            else:
+                self.hub.stop_events(worker_id, endpoint_key(endpoint))
+            return None
+        if method == "send":
+            await client.send(b'{"type": "reply"}')
+            return None
+        raise KeyError(method)
+
+    def release(self, client):
+        self.released.append(client)
+
+
+class FakePool:
+    def __init__(self):
+        self.listeners = []
+
+    def add_listener(self):
+        queue = asyncio.Queue()
+        self.listeners.append(queue)
+        return queue
+
+    def remove_listener(self, queue):
+        self.listeners.remove(queue)
+
+
+async def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def run_with_link(tmp_path, scenario, handler=None):
+    """Runs scenario(hub, link) against a hub and a connected worker link."""
+    async def main():
+        hub = Hub(str(tmp_path), handler or FakeHandler())
+        hub.handler.hub = hub
+        hub.push_registry({"default": "r1", "backends": {"r1": {"host": "127.0.0.1"}}})
+        link = HubLink(worker_topic(0), str(tmp_path))
+        tasks = [asyncio.ensure_future(hub.run())]
+        try:
+            await asyncio.wait_for(link.connect(), 5.0)
+            tasks.append(asyncio.ensure_future(link.run()))
+            return await scenario(hub, link)
+        finally:
+            for task in tasks:
+                task.cancel()
+            link.close()
+            hub.close()
+    return asyncio.run(main())
+
+
+def test_stream_frames_are_published_once_per_worker_and_control_frames_sent_reliably(tmp_path):
+    hub = Hub(str(tmp_path))
+    hub._pub.close()
+    hub._pub = FakeSocket()
+    reliable = []
+    hub._send = lambda worker_id, parts: reliable.append([worker_id, *parts]) or True
+    clients = [RemoteClient(hub, worker, bytes([0, 0, 0, i]), "", "peer")
+               for i, worker in enumerate([b"w0", b"w1", b"w0"])]
+
+    hub.broadcast(clients, b'{"type": "statusUpdate"}', stream="status")
+    hub.broadcast(clients[1:2], b'{"type": "hooksChanged"}')
+
+    assert hub._pub.sent == [
+        [b"w0", b"send", b"\x00\x00\x00\x00\x00\x00\x00\x02", b'{"type": "statusUpdate"}', b"status"],
+        [b"w1", b"send", b"\x00\x00\x00\x01", b'{"type": "statusUpdate"}', b"status"],
+    ]
+    assert reliable == [[b"w1", b"send", b"\x00\x00\x00\x01", b'{"type": "hooksChanged"}', b""]]
+    assert hub.stats()["frames_out"] == 3 and hub.stats()["stream_frames_out"] == 2
+    hub.close()
+
+
+def test_calls_and_control_frames_survive_a_worker_that_falls_behind(tmp_path, monkeypatch):
+    # A PUB socket would drop all but a frame or two for a worker this far behind
+    monkeypatch.setattr(fanout, "PUB_HIGH_WATER_MARK", 1)
+    queue = FakeQueue()
+
+    async def scenario(hub, link):
+        link.open_client(queue)
+        await wait_for(lambda: hub.stats()["clients"] == 1)
+        client = next(iter(hub._clients.values()))
+        for i in range(500):
+            await client.send(f"reply {i}")
+        reply = await link.call(queue, ENDPOINT, "send")
+        with pytest.raises(HubCallError) as failure:
+            await link.call(queue, ENDPOINT, "unknown")
+        link.close_client(queue)
+        await wait_for(lambda: hub.stats()["clients"] == 0)
+        return reply, failure.value
+
+    reply, failure = run_with_link(tmp_path, scenario)
+    # Results come after the frames sent before them
+    assert reply is None
+    assert queue.frames == [(f"reply {i}".encode(), None) for i in range(500)] + [(b'{"type": "reply"}', None)]
+    assert failure.kind == "KeyError"
+
+
+def test_remote_pool_requests_go_through_the_hub_and_track_the_tree(tmp_path):
+    changes = []
+
+    async def scenario(hub, link):
+        pool = RemotePoolManager(link).get_pool(*ENDPOINT)
+        pool.add_tree_change_callback(changes.append)
+        header = struct.pack('!BBi', 2, ord('S'), 7)
+        reply = await pool.request([header])
+        await pool.request([header])
+        return reply, pool.tree_id, hub.handler.calls
+
+    reply, tree_id, calls = run_with_link(tmp_path, scenario)
+    assert reply == [struct.pack('!BBi', 2, ord('S'), 7) + TREE_ID, b"ok"]
+    assert changes == [tree_id] and tree_id == "00010203-0405-0607-0809-0a0b0c0d0e0f"
+    assert [(worker, client, endpoint, method) for worker, client, endpoint, method, _ in calls] == \
+        [(b"w0000", None, ENDPOINT, "request")] * 2
+
+
+def test_pub_messages_are_relayed_while_the_worker_listens(tmp_path):
+    backend = FakePool()
+
+    async def scenario(hub, link):
+        pool = RemotePoolManager(link).get_pool(*ENDPOINT)
+        first, second = pool.add_listener(), pool.add_listener()
+        await wait_for(lambda: backend.listeners)
+        backend.listeners[0].put_nowait([b"N", b"42"])
+        received = await asyncio.wait_for(first.get(), 2.0), await asyncio.wait_for(second.get(), 2.0)
+        pool.remove_listener(first)
+        relays = hub.stats()["eventRelays"]
+        pool.remove_listener(second)
+        await wait_for(lambda: not backend.listeners)
+        return received, relays
+
+    received, relays = run_with_link(tmp_path, scenario, FakeHandler(backend))
+    # One relay per worker, however many of its sessions listen
+    assert received == ([b"N", b"42"], [b"N", b"42"])
+    assert relays == 1
+
+
+def test_registry_changes_reach_the_workers(tmp_path):
+    documents = []
+
+    async def scenario(hub, link):
+        first = link.registry_document
+        link.on_registry = documents.append
+        hub.push_registry({"default": "r2", "backends": {"r2": {"host": "10.0.0.2"}}})
+        await wait_for(lambda: documents)
+        return first
+
+    first = run_with_link(tmp_path, scenario)
+    assert first["default"] == "r1"
+    assert documents == [{"default": "r2", "backends": {"r2": {"host": "10.0.0.2"}}}]
+
+
+def test_unreachable_worker_releases_its_clients(tmp_path):
+    async def run():
+        hub = Hub(str(tmp_path), FakeHandler())
+        try:
+            # Known to the hub, but nothing is connected under this id
+            hub._workers.add(b"w0009")
+            client = hub._clients[(b"w0009", b"\x00\x00\x00\x01")] = RemoteClient(hub, b"w0009", b"\x00\x00\x00\x01",
+                                                                                  "", "peer")
+            await client.send(b'{"type": "reply"}')
+            return client, hub.stats(), hub.handler.released
+        finally:
+            hub.close()
+
+    client, stats, released = asyncio.run(run())
+    assert released == [client]
+    assert stats["undeliverable"] == 1 and stats["workers"] == 0 and stats["clients"] == 0
+
+
+def test_worker_topics_do_not_leak_between_workers(tmp_path):
+    # Worker 1 must not see frames for workers 10..11, which a b"w1" prefix subscription would match
+    topics = [worker_topic(index) for index in range(12)]
+    assert len(set(map(len, topics))) == 1
+
+    hub = Hub(str(tmp_path))
+    context = zmq.Context()
+    subs = []
+    for topic in topics:
+        sub = context.socket(zmq.SUB)
+        sub.setsockopt(zmq.LINGER, 0)
+        sub.connect(hub.events_endpoint)
+        sub.subscribe(topic)
+        subs.append(sub)
+    time.sleep(0.2)  # let the subscriptions reach the PUB socket
+    try:
+        for index, topic in enumerate(topics):
+            hub.publish(topic, [bytes([0, 0, 0, 1])], f"frame {index}", stream="status")
+        for index, sub in enumerate(subs):
+            received = []
+            while sub.poll(200):
+                received.append(sub.recv_multipart())
+            assert [(parts[0], parts[3]) for parts in received] == [(topics[index], f"frame {index}".encode())]
+    finally:
+        for sub in subs:
+            sub.close()
+        context.term()
+        hub.close()
+
+
+def test_bad_worker_messages_do_not_end_the_hub(tmp_path):
+    async def run():
+        hub = Hub(str(tmp_path), FakeHandler())
+        context = zmq.asyncio.Context()
+        dealer = context.socket(zmq.DEALER)
+        dealer.setsockopt(zmq.IDENTITY, b"w0000")
+        dealer.setsockopt(zmq.LINGER, 0)
+        dealer.connect(hub.hub_endpoint)
+        task = asyncio.ensure_future(hub.run())
+        try:
+            await dealer.send_multipart([b"hello"])
+            await dealer.send_multipart([b"open", b"\x00\x00\x00\x01"])  # malformed
+            await dealer.send_multipart([b"call", b"\x00\x00\x00\x01", b"", b"\xc1"])  # not msgpack
+            await dealer.send_multipart([b"open", b"\x00\x00\x00\x01", b"", b"peer"])
+            await wait_for(lambda: hub.stats()["clients"] == 1)
+            assert not task.done()
+            return hub.stats()
+        finally:
+            task.cancel()
+            dealer.close()
+            context.term()
+            hub.close()
+
+    stats = asyncio.run(run())
+    assert stats["bad_messages"] == 2
+    assert stats["workers"] == 1
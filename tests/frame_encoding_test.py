@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Unit tests for outbound frame encoding.
+
+Usage:
+  python3 -m pytest -q tests/frame_encoding_test.py
+"""
+
+import json
+
+from frame_encoding import FrameCache, encode_json, is_text_frame
+
+
+def test_encoders_agree():
+    message = {"type": "blackboardUpdate", "payload": {"data": {"bb": {1: "int key", "pose": [1.5, -2],
+                                                                       "name": "défaut"}}}}
+    fast, stdlib = encode_json(message), encode_json(message, use_orjson=False)
+    assert isinstance(fast, bytes) and isinstance(stdlib, bytes)
+    assert json.loads(fast) == json.loads(stdlib) == {"type": "blackboardUpdate", "payload": {
+        "data": {"bb": {"1": "int key", "pose": [1.5, -2], "name": "défaut"}}}}
+
+
+def test_json_frames_are_told_apart_from_binary_frames():
+    assert is_text_frame(encode_json({"type": "x"})) and is_text_frame('{"type": "x"}')
+    assert not is_text_frame(b"\x01binary")
+
+
+def test_values_only_the_stdlib_accepts_still_encode():
+    assert json.loads(encode_json({"big": 2 ** 70})) == {"big": 2 ** 70}
+
+
+def test_frame_cache_encodes_each_key_once():
+    cache = FrameCache(max_entries=2)
+    builds = []
+
+    def build(xml):
+        builds.append(xml)
+        return {"type": "treeData", "payload": {"xml": xml}}
+
+    first = cache.get(("tree-a", True), lambda: build("<a/>"))
+    assert cache.get(("tree-a", True), lambda: build("<a/>")) is first
+    cache.get(("tree-b", True), lambda: build("<b/>"))
+    cache.get(("tree-c", True), lambda: build("<c/>"))
+    cache.get(("tree-a", True), lambda: build("<a/>"))
+
+    assert builds == ["<a/>", "<b/>", "<c/>", "<a/>"]
+    assert cache.stats()["hits"] == 1 and cache.stats()["entries"] == 2
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Unit tests for bulk STATUS / GET_TRANSITIONS decoding.
+
+Usage:
+  python3 -m pytest -q tests/groot2_decoding_test.py
+"""
+
+import random
+import struct
+
+import pytest
+
+import groot2_decoding
+from groot2_decoding import decode_status, decode_transitions, status_to_records, changed_indices
+
+BACKENDS = [True, pytest.param(False, id="stdlib")]
+
+
+def make_status(count, byteorder):
+    prefix = '>' if byteorder == "big" else '<'
+    records = [(random.randrange(65536), random.choice([0, 1, 2, 3, 12, 13, 14])) for _ in range(count)]
+    return records, b''.join(struct.pack(prefix + 'HB', uid, status) for uid, status in records)
+
+
+def make_transitions(count, byteorder):
+    records = [(random.randrange(2 ** 48), random.randrange(65536), random.randrange(4)) for _ in range(count)]
+    payload = b''.join(
+        timestamp.to_bytes(6, byteorder) + uid.to_bytes(2, byteorder) + bytes([status])
+        for timestamp, uid, status in records
+    )
+    return records, payload
+
+
+@pytest.mark.parametrize("use_numpy", BACKENDS)
+@pytest.mark.parametrize("byteorder", ["big", "little"])
+def test_decode_status_matches_struct(use_numpy, byteorder):
+    if use_numpy and groot2_decoding.np is None:
+        pytest.skip("NumPy not installed")
+    records, payload = make_status(500, byteorder)
+    columns = decode_status(payload + b'\x01', byteorder=byteorder, use_numpy=use_numpy)
+    assert list(zip(columns.uid.tolist(), list(columns.status))) == records
+
+
+@pytest.mark.parametrize("use_numpy", BACKENDS)
+@pytest.mark.parametrize("byteorder", ["big", "little"])
+def test_decode_transitions_matches_struct(use_numpy, byteorder):
+    if use_numpy and groot2_decoding.np is None:
+        pytest.skip("NumPy not installed")
+    records, payload = make_transitions(500, byteorder)
+    columns = decode_transitions(payload, byteorder=byteorder, use_numpy=use_numpy)
+    decoded = zip(columns.timestamp.tolist(), columns.uid.tolist(), list(columns.status))
+    assert list(decoded) == records
+
+
+def test_status_records_are_json_friendly():
+    records = status_to_records(decode_status(struct.pack('!HBHB', 1, 2, 300, 14)))
+    assert records == [{"uid": 1, "status": 2}, {"uid": 300, "status": 14}]
+    assert all(type(value) is int for record in records for value in record.values())
+
+
+def test_changed_indices():
+    assert changed_indices(b'\x00\x01\x02\x03', b'\x00\x02\x02\x00') == [1, 3]
+    assert changed_indices(b'', b'') == []
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Unit tests for batched hook changes and the hook table mirror (scripts/hooks.py).
+
+Usage:
+  python3 -m pytest -q tests/hooks_test.py
+"""
+
+import asyncio
+import json
+import logging
+from uuid import UUID
+
+import pytest
+
+from backend_transport import BackendRequestTimeout
+from fake_groot2_server import FakeGroot2Server
+from hooks import HookTable, hook_key, insert_hooks, remove_hooks, normalize_hook
+from proxy import handle_generic_command
+
+
+class FakePool:
+    """Answers requests from an unstarted FakeGroot2Server and records their types."""
+
+    req_endpoint = "tcp://fake:1667"
+
+    def __init__(self, reject_arrays=False, delay=0.0):
+        self.server = FakeGroot2Server(nodes=50)
+        self.tree_id = str(UUID(bytes=self.server.tree_id))
+        self.reject_arrays = reject_arrays
+        self.delay = delay
+        self.types = []
+        self.callbacks = []
+        self.unanswered = set()  # request bodies that time out
+        self.lost_replies = set()  # request bodies that are applied, then time out
+
+    def add_tree_change_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_tree_change_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    async def request(self, frames):
+        self.types.append(chr(frames[0][1]))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if len(frames) > 1 and frames[1] in self.unanswered:
+            raise BackendRequestTimeout("No reply within 0.1s")
+        if len(frames) > 1 and frames[1] in self.lost_replies:
+            self.server._handle(frames[0], frames[1:])
+            raise BackendRequestTimeout("No reply within 0.1s")
+        if self.reject_arrays and len(frames) > 1 and frames[1].startswith(b"["):
+            return [b"error", b"Malformed JSON"]
+        return self.server._handle(frames[0], frames[1:])
+
+
+def test_normalize_hook_fills_defaults_and_rejects_bad_items():
+    assert normalize_hook(7) == {"uid": 7, "enabled": True, "mode": 0, "once": False,
+                                 "desired_status": "SUCCESS", "position": 0}
+    assert normalize_hook({"uid": 7}, {"position": 1})["position"] == 1
+    for item in ({"uid": -1}, {"uid": 3, "position": 2}, {"uid": 3, "mode": 5}, "3", True):
+        with pytest.raises(ValueError):
+            normalize_hook(item)
+
+
+def test_insert_sends_one_request_per_chunk_and_reports_each_item():
+    pool = FakePool()
+    items = list(range(1, 11)) + [{"uid": "x"}, 999]
+    outcome = asyncio.run(insert_hooks(pool, items, verify=True, max_per_request=4))
+
+    assert pool.types == ['I', 'I', 'I', 'D']
+    assert outcome["requests"] == 4
+    assert (outcome["succeeded"], outcome["failed"]) == (10, 2)
+    assert [result["success"] for result in outcome["results"]] == [True] * 10 + [False, False]
+    assert outcome["results"][11]["error"] == "Node ID not found"
+    assert len(pool.server._hooks) == 10
+
+
+def test_post_hooks_are_not_verified_against_the_dump():
+    pool = FakePool()
+    outcome = asyncio.run(insert_hooks(pool, [1, {"uid": 2, "position": 1}], verify=True))
+    assert [result["success"] for result in outcome["results"]] == [True, True]
+    assert "verified" not in outcome["results"][0] and outcome["results"][1]["verified"] is False
+
+
+def test_rejected_batch_is_retried_per_hook():
+    pool = FakePool(reject_arrays=True)
+    outcome = asyncio.run(insert_hooks(pool, [1, 2, 3]))
+    assert pool.types == ['I'] * 4 and outcome["requests"] == 4
+    assert outcome["succeeded"] == 3
+
+
+def test_remove_reports_missing_hooks():
+    pool = FakePool()
+    asyncio.run(insert_hooks(pool, [1, 2]))
+    outcome = asyncio.run(remove_hooks(pool, [1, {"uid": 2}, 3]))
+    assert [result["success"] for result in outcome["results"]] == [True, True, False]
+    assert "Node ID not found" in outcome["results"][2]["error"]
+    assert json.loads(pool.server._handle(b"\x02D\x00\x00\x00\x01", [])[1]) == []
+
+
+def test_timed_out_removals_stay_in_the_mirror():
+    pool = FakePool()
+    table = HookTable(pool)
+
+    async def scenario():
+        await table.reconcile()
+        await insert_hooks(pool, [1, 2, 3], table=table)
+        pool.unanswered.add(json.dumps({"uid": 2, "position": 0}).encode())
+        outcome = await remove_hooks(pool, [1, 2, 4], table=table)
+        assert [result["success"] for result in outcome["results"]] == [True, False, False]
+        # The missing hook is gone from the mirror too, the timed out one is kept until a dump
+        assert sorted(table._hooks) == [(2, 0), (3, 0)] and not table.synced
+        assert [hook["uid"] for hook in await table.hooks()] == [2, 3]
+        assert pool.types[-1] == 'D'
+
+    asyncio.run(scenario())
+
+
+def test_insert_with_an_unknown_outcome_resyncs_the_mirror():
+    pool = FakePool(reject_arrays=True)
+    table = HookTable(pool)
+
+    async def scenario():
+        await table.reconcile()
+        # A clean rejection leaves the backend as it was
+        outcome = await insert_hooks(pool, [1], table=table)
+        assert not outcome["results"][0]["success"] and table.synced
+        # The backend applies the insert but its reply never arrives
+        pool.reject_arrays = False
+        pool.lost_replies.add(json.dumps([normalize_hook(2)]).encode())
+        outcome = await insert_hooks(pool, [2], table=table)
+        assert not outcome["results"][0]["success"] and not table.synced
+        assert [hook["uid"] for hook in await table.hooks()] == [2]
+        assert pool.types[-1] == 'D'
+
+    asyncio.run(scenario())
+
+
+def test_single_hook_command_failures_resync_only_when_the_outcome_is_unknown():
+    pool = FakePool()
+    table = HookTable(pool)
+    sent = []
+
+    class WebSocket:
+        async def send(self, frame):
+            sent.append(json.loads(frame))
+
+    async def command(command_type, uid):
+        await handle_generic_command(WebSocket(), pool, logging.getLogger("test"), command_type,
+                                     {"params": {"uid": uid, "position": 0}}, hooks=table)
+
+    async def scenario():
+        await table.reconcile()
+        await command("setBreakpoint", 1)
+        assert table.synced and sent[-1]["payload"]["success"]
+        # The backend definitely did not change anything
+        await command("removeBreakpoint", 2)
+        assert "Node ID not found" in sent[-1]["payload"]["message"] and table.synced
+        # The hook may or may not have been set
+        pool.unanswered.add(json.dumps({"uid": 2, "position": 0}).encode())
+        await command("setBreakpoint", 2)
+        assert sent[-1]["type"] == "error" and not table.synced
+
+    asyncio.run(scenario())
+
+
+def test_hook_table_serves_locally_and_pushes_changes():
+    pool = FakePool()
+    events = []
+    table = HookTable(pool, broadcast=lambda targets, frame: events.append((targets, json.loads(frame)["payload"])))
+
+    async def scenario():
+        table.add_listener("ws")
+        await asyncio.sleep(0)
+        await table.reconcile()  # shares the listener's initial dump
+        await insert_hooks(pool, [1, {"uid": 2, "once": True}], table=table)
+        assert [hook["uid"] for hook in await table.hooks()] == [1, 2]
+        assert (await table.node_hooks(2))[0]["once"] is True
+        table.apply('U', {"uid": 2, "position": 0})
+        table.apply('X')
+        table.close()
+
+    asyncio.run(scenario())
+    assert pool.types == ['D', 'I']  # reads were served by the mirror
+    assert [payload["reason"] for _, payload in events] == ["insert", "unlock", "disableAll"]
+    assert events[0][0] == ["ws"] and [hook["uid"] for hook in events[0][1]["set"]] == [1, 2]
+    assert events[1][1]["removed"] == [{"uid": 2, "position": 0}]
+    assert events[2][1]["set"][0]["enabled"] is False and table.version == 3
+
+
+def test_reconcile_catches_drift_and_drops_stale_dumps():
+    pool = FakePool(delay=0.01)
+    table = HookTable(pool)
+
+    async def scenario():
+        await table.reconcile()
+        assert table.synced and table.stats()["hooks"] == 0
+
+        # Another Groot2 client sets a hook behind the proxy's back
+        pool.server._hooks[5, 0] = {"uid": 5, "position": 0}
+        await table.reconcile()
+        assert table.stats()["drift"] == 1 and [hook["uid"] for hook in await table.hooks()] == [5]
+
+        # A dump answered before a local change must not undo it
+        dump = asyncio.ensure_future(table.reconcile())
+        await asyncio.sleep(0.005)
+        table.apply('A')
+        await dump
+        assert table.stats()["stale_dumps"] == 1 and await table.hooks() == []
+
+        pool.callbacks[0]("another-tree")
+        assert not table.synced
+
+    asyncio.run(scenario())
+
+
+def test_wake_up_during_a_reconcile_is_not_lost():
+    pool = FakePool(delay=0.02)
+    table = HookTable(pool, reconcile_interval=60.0)
+
+    async def scenario():
+        table.add_listener("ws")
+        await asyncio.sleep(0.01)  # the listener's first dump is on its way
+        table.invalidate()
+        await asyncio.sleep(0.1)
+        reconciles = table.stats()["reconciles"]
+        table.close()
+        return reconciles
+
+    # The wake-up got a second dump right away, not after reconcile_interval
+    assert asyncio.run(scenario()) == 2
+
+
+def test_post_hooks_survive_reconciles_of_the_same_tree():
+    pool = FakePool()
+    events = []
+    table = HookTable(pool, broadcast=lambda targets, frame: events.append(json.loads(frame)["payload"]))
+
+    async def scenario():
+        table.add_listener("ws")
+        await table.reconcile()
+        await insert_hooks(pool, [{"uid": 4, "position": 1}, 5], table=table)
+        await table.reconcile()  # the dump lists only the PRE hook
+        assert sorted(hook_key(hook) for hook in await table.hooks()) == [(4, 1), (5, 0)]
+        assert table.stats()["drift"] == 0 and [event["reason"] for event in events] == ["insert"]
+
+        # A dump of another tree drops them
+        table.replace([], {"tree_id": "another-tree"})
+        assert table.stats()["hooks"] == 0
+        assert events[-1]["removed"] == [{"uid": 4, "position": 1}, {"uid": 5, "position": 0}]
+        table.close()
+
+    asyncio.run(scenario())
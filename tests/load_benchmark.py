@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+WebSocket load generator for scripts/proxy.py.
+
+Starts a simulated Groot2 backend (tests/fake_groot2_server.py) and the
+proxy on free local ports, opens N WebSocket clients that send a weighted
+mix of commands for a fixed time, and reports throughput and p50/p90/p99
+latency per command type. Latency is measured from sending a command to
+receiving the reply carrying its requestId.
+
+Pass --ws to load an already running proxy instead (its backend is then
+whatever that proxy points at). --max-p99 turns the run into a gate: the
+exit status is 1 when a command's p99 exceeds its limit or any command
+failed, so proxy changes can be checked against numbers.
+
+Usage:
+  python3 tests/load_benchmark.py [--clients 50] [--duration 10] [--concurrency 1]
+      [--mix getStatus=8,getBlackboard=2,getTree=1] [--subscribe-status] [--subscribe-breakpoints]
+      [--nodes 2000 --latency 0.001 ...] [--proxy-args "--workers 2"]
+      [--max-p99 getStatus=20,getTree=200] [--json results.json]
+  python3 tests/load_benchmark.py --ws ws://localhost:8080 --clients 10
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import websockets
+
+from fake_groot2_server import FakeGroot2Server, add_simulation_arguments, simulation_options
+
+PROXY_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "proxy.py")
+DEFAULT_MIX = "getStatus=8,getBlackboard=2,getTree=1"
+COMMAND_PAYLOADS = {
+    "getBlackboard": {"names": "MainTree"},
+}
+PROXY_START_TIMEOUT = 15.0
+
+
+def parse_weights(text, value_type=float):
+    """Parses "getStatus=8,getTree=1" into {"getStatus": 8.0, "getTree": 1.0}."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, value = item.partition("=")
+        weights[name] = value_type(value or 1)
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
+
+
+def free_port_pair():
+    """Two consecutive free TCP ports for the fake backend's REQ and PUB sockets."""
+    while True:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        try:
+            with socket.socket() as first, socket.socket() as second:
+                first.bind(("127.0.0.1", port))
+                second.bind(("127.0.0.1", port + 1))
+            return port
+        except OSError:
+            continue
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def wait_for_port(port, process, timeout=PROXY_START_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Proxy exited with status {process.returncode}")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"Proxy did not listen on port {port} within {timeout}s")
+
+
+class Results:
+    """Latencies (seconds) and failures per command type, plus unsolicited frames."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.stream_frames = 0
+        self.stream_bytes = 0
+
+    def record(self, command, latency):
+        self.latencies.setdefault(command, []).append(latency)
+
+    def fail(self, command, reason):
+        errors = self.errors.setdefault(command, {})
+        errors[reason] = errors.get(reason, 0) + 1
+
+    def summary(self, elapsed):
+        rows = {}
+        for command in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(command, []))
+            rows[command] = {
+                "count": len(values),
+                "errors": sum(self.errors.get(command, {}).values()),
+                "errorReasons": self.errors.get(command, {}),
+                "throughput": len(values) / elapsed,
+                "p50Ms": percentile(values, 0.50) * 1000,
+                "p90Ms": percentile(values, 0.90) * 1000,
+                "p99Ms": percentile(values, 0.99) * 1000,
+                "maxMs": (values[-1] if values else 0.0) * 1000,
+            }
+        return {
+            "duration": elapsed,
+            "commands": rows,
+            "total": sum(row["count"] for row in rows.values()) / elapsed,
+            "streamFrames": self.stream_frames,
+            "streamBytes": self.stream_bytes,
+        }
+
+
+async def run_client(url, mix, deadline, concurrency, timeout, subscriptions, results, client_index):
+    names, weights = list(mix), list(mix.values())
+    pending = {}  # requestId -> future of the reply
+    ids = itertools.count(1)
+    rng = random.Random(client_index)
+
+    async with websockets.connect(url, max_size=None) as ws:
+        async def read():
+            async for message in ws:
+                reply = json.loads(message) if isinstance(message, str) else None
+                future = pending.pop(reply.get("requestId"), None) if reply else None
+                if future is not None:
+                    future.set_result(reply)
+                else:
+                    results.stream_frames += 1
+                    results.stream_bytes += len(message)
+
+        reader = asyncio.create_task(read())
+        for subscription in subscriptions:
+            await ws.send(json.dumps(subscription))
+
+        async def drive():
+            while time.monotonic() < deadline:
+                command = rng.choices(names, weights)[0]
+                request_id = f"{client_index}-{next(ids)}"
+                future = pending[request_id] = asyncio.get_running_loop().create_future()
+                sent_at = time.perf_counter()
+                await ws.send(json.dumps({"type": command, "requestId": request_id,
+                                          "payload": COMMAND_PAYLOADS.get(command, {})}))
+                try:
+                    reply = await asyncio.wait_for(future, timeout)
+                except asyncio.TimeoutError:
+                    pending.pop(request_id, None)
+                    results.fail(command, "timeout")
+                    continue
+                if reply.get("type") == "error":
+                    results.fail(command, reply.get("payload", {}).get("message", "error"))
+                else:
+                    results.record(command, time.perf_counter() - sent_at)
+
+        try:
+            await asyncio.gather(*(drive() for _ in range(concurrency)))
+        finally:
+            reader.cancel()
+
+
+async def run_load(url, args):
+    mix = parse_weights(args.mix)
+    results = Results()
+    subscriptions = []
+    if args.subscribe_status:
+        subscriptions.append({"type": "subscribeStatus", "payload": {"mode": "delta"}})
+    if args.subscribe_breakpoints:
+        subscriptions.append({"type": "subscribe", "payload": {"topic": "N"}})
+    # Clients start sending as soon as they are connected and all stop at the same deadline
+    deadline = time.monotonic() + args.duration + args.ramp_up
+    started = time.monotonic()
+    clients = [run_client(url, mix, deadline, args.concurrency, args.timeout, subscriptions, results, i)
+               for i in range(args.clients)]
+    outcomes = await asyncio.gather(*clients, return_exceptions=True)
+    elapsed = time.monotonic() - started
+    failed = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+    if failed:
+        print(f"{len(failed)} client(s) failed, e.g.: {failed[0]!r}")
+    return results.summary(elapsed), len(failed)
+
+
+def report(summary):
+    print(f"\n{'command':<16}{'count':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for command, row in summary["commands"].items():
+        print(f"{command:<16}{row['count']:>8}{row['errors']:>8}{row['throughput']:>10.1f}"
+              f"{row['p50Ms']:>10.2f}{row['p90Ms']:>10.2f}{row['p99Ms']:>10.2f}{row['maxMs']:>10.2f}")
+        for reason, count in row["errorReasons"].items():
+            print(f"    {count} x {reason}")
+    print(f"\ntotal {summary['total']:.1f} req/s over {summary['duration']:.1f}s; "
+          f"{summary['streamFrames']} stream frames ({summary['streamBytes'] / 1e6:.1f} MB)")
+
+
+def check_gates(summary, max_p99):
+    violations = []
+    for command, limit in max_p99.items():
+        row = summary["commands"].get(command)
+        if row is None:
+            violations.append(f"{command}: no replies")
+        elif row["p99Ms"] > limit:
+            violations.append(f"{command}: p99 {row['p99Ms']:.2f} ms > {limit:g} ms")
+    violations += [f"{command}: {row['errors']} errors" for command, row in summary["commands"].items() if row["errors"]]
+    return violations
+
+
+async def main_async(args):
+    if args.ws:
+        return await run_load(args.ws, args)
+
+    backend_port = free_port_pair()
+    ws_port = free_port()
+    server = FakeGroot2Server(port=backend_port, **simulation_options(args)).start()
+    command = [sys.executable, PROXY_SCRIPT, "--host", "127.0.0.1", "--bt-ip", "127.0.0.1",
+               "--req-port", str(backend_port), "--pub-port", str(backend_port + 1),
+               "--ws-port", str(ws_port), *shlex.split(args.proxy_args)]
+    log = open(args.proxy_log, "w") if args.proxy_log else subprocess.DEVNULL
+    proxy = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        await wait_for_port(ws_port, proxy)
+        print(f"Proxy on ws://127.0.0.1:{ws_port}, fake backend on {server.req_endpoint} ({args.nodes} nodes)")
+        return await run_load(f"ws://127.0.0.1:{ws_port}", args)
+    finally:
+        # SIGINT lets the proxy shut down cleanly (workers, ipc directory)
+        proxy.send_signal(signal.SIGINT)
+        try:
+            proxy.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proxy.kill()
+        server.stop()
+        if log is not subprocess.DEVNULL:
+            log.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket load generator for the Groot2 proxy")
+    parser.add_argument("--ws", help="Load this running proxy instead of starting a proxy and a fake backend")
+    parser.add_argument("--clients", type=int, default=20, help="WebSocket clients")
+    parser.add_argument("--concurrency", type=int, default=1, help="Commands each client keeps outstanding")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Extra seconds of load to make up for slow connects with many clients")
+    parser.add_argument("--timeout", type=float, default=5.0, help="Seconds before a command counts as timed out")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted command mix, e.g. getStatus=8,getTree=1")
+    parser.add_argument("--subscribe-status", action="store_true", help="Also subscribe every client to delta status updates")
+    parser.add_argument("--subscribe-breakpoints", action="store_true", help="Also subscribe every client to BREAKPOINT_REACHED events")
+    parser.add_argument("--proxy-args", default="", help="Extra arguments for scripts/proxy.py, e.g. \"--workers 2\"")
+    parser.add_argument("--proxy-log", help="File for the proxy's output (discarded by default)")
+    parser.add_argument("--max-p99", type=lambda text: parse_weights(text), default={}, help="Fail when a command's p99 exceeds this many ms, e.g. getStatus=20")
+    parser.add_argument("--json", help="Also write the results to this file")
+    add_simulation_arguments(parser)
+    args = parser.parse_args()
+
+    summary, failed_clients = asyncio.run(main_async(args))
+    report(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+    violations = check_gates(summary, args.max_p99) if args.max_p99 else []
+    if failed_clients:
+        violations.append(f"{failed_clients} client(s) failed")
+    for violation in violations:
+        print(f"FAIL {violation}")
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
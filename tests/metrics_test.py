@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the Prometheus metrics registry and endpoint.
+
+Usage:
+  python3 -m pytest -q tests/metrics_test.py
+"""
+
+import asyncio
+
+from metrics import MetricsRegistry, MetricsServer
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("rtt_seconds", "Round trips", ("backend",), buckets=(0.01, 0.1))
+    for value in (0.005, 0.05, 0.05, 3.0):
+        histogram.observe(value, "a")
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP rtt_seconds Round trips", "# TYPE rtt_seconds histogram"]
+    assert 'rtt_seconds_bucket{backend="a",le="0.01"} 1' in lines
+    assert 'rtt_seconds_bucket{backend="a",le="0.1"} 3' in lines
+    assert 'rtt_seconds_bucket{backend="a",le="+Inf"} 4' in lines
+    assert 'rtt_seconds_sum{backend="a"} 3.105' in lines
+    assert 'rtt_seconds_count{backend="a"} 4' in lines
+
+
+def test_counters_gauges_and_collectors():
+    registry = MetricsRegistry()
+    sent = registry.counter("sent_bytes_total", "Bytes", ("type",))
+    clients = registry.gauge("clients", "Clients")
+    sent.inc("getTree", amount=100)
+    sent.inc("getTree", amount=20)
+    clients.inc()
+    clients.inc()
+    clients.dec()
+    registry.add_collector(lambda: [("depth", "gauge", "Queued", [({"worker": 'w"1'}, 3)])])
+    registry.add_collector(lambda: 1 / 0)  # a failing collector doesn't break the scrape
+
+    lines = registry.render().splitlines()
+    assert 'sent_bytes_total{type="getTree"} 120' in lines
+    assert "clients 1" in lines
+    assert 'depth{worker="w\\"1"} 3' in lines
+
+
+def test_remote_samples_join_the_local_families():
+    local, worker = MetricsRegistry(), MetricsRegistry()
+    for registry in (local, worker):
+        registry.counter("sent_bytes_total", "Bytes", ("type",))
+        registry.histogram("rtt_seconds", "Round trips", buckets=(0.1,))
+    local._metrics["sent_bytes_total"].inc("getTree", amount=5)
+    worker._metrics["sent_bytes_total"].inc("getTree", amount=7)
+    worker._metrics["rtt_seconds"].observe(0.05)
+    worker.gauge("worker_only", "Only in workers").set(3)
+
+    local.set_remote("w0000", worker.export())
+    lines = local.render().splitlines()
+    assert lines.count("# TYPE sent_bytes_total counter") == 1
+    assert 'sent_bytes_total{type="getTree"} 5' in lines
+    assert 'sent_bytes_total{type="getTree",worker="w0000"} 7' in lines
+    assert 'rtt_seconds_bucket{le="0.1",worker="w0000"} 1' in lines
+    assert 'worker_only{worker="w0000"} 3' in lines
+
+    local.set_remote("w0000", None)
+    assert "worker_only" not in local.render()
+
+
+def test_server_answers_metrics_and_404():
+    registry = MetricsRegistry()
+    registry.counter("scrapes_total", "Test").inc()
+
+    async def get(port, path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    async def run():
+        server = MetricsServer(registry)
+        port = await server.start("127.0.0.1", 0)
+        try:
+            return await get(port, "/metrics"), await get(port, "/other"), await get(port, "/" + "x" * 70000)
+        finally:
+            server.close()
+
+    metrics, missing, too_long = asyncio.run(run())
+    assert metrics.startswith("HTTP/1.1 200 OK")
+    assert "version=0.0.4" in metrics
+    assert metrics.endswith("scrapes_total 1\n")
+    assert missing.startswith("HTTP/1.1 404")
+    # A request line over the stream limit is answered, not left to an unhandled task error
+    assert too_long.startswith("HTTP/1.1 400")
@@ -11,7 +11,9 @@ Usage:
 
 Notes:
   - Ensure the proxy is running: python3 scripts/proxy.py
-  - Ensure the backend BehaviorTree.CPP server is reachable by the proxy.
+  - Ensure the backend BehaviorTree.CPP server is reachable by the proxy
+    (or run the simulator instead: python3 tests/fake_groot2_server.py).
+  - For throughput and latency numbers use tests/load_benchmark.py.
 """
 
 import asyncio
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Unit tests for concurrent command dispatch within a client session.
+
+Usage:
+  python3 -m pytest -q tests/proxy_session_test.py
+"""
+
+import asyncio
+import json
+import os
+import struct
+from types import SimpleNamespace
+
+import proxy
+from backend_pool import ConnectionPoolManager
+from backend_registry import BackendRegistry
+from fanout import RemotePool
+from proxy import BackendServices, ClientSession, CommandReplies, tag_reply
+
+
+class FakeRegistry:
+    def add_change_callback(self, callback):
+        pass
+
+    def remove_change_callback(self, callback):
+        pass
+
+    def resolve(self, name=None):
+        if name not in (None, "default"):
+            raise proxy.UnknownBackendError(name)
+        return "default"
+
+    def get(self, name=None):
+        self.resolve(name)
+        return "services"
+
+
+class FakeWebSocket:
+    subprotocol = None
+    remote_address = ("127.0.0.1", 1234)
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+def test_tag_reply_prepends_request_id():
+    assert json.loads(tag_reply(json.dumps({"type": "treeData", "payload": {}}), 7)) == \
+        {"requestId": 7, "type": "treeData", "payload": {}}
+    assert json.loads(tag_reply("{}", "a")) == {"requestId": "a"}
+    assert json.loads(tag_reply(b'{"type": "x"}', [1])) == {"requestId": [1], "type": "x"}
+    assert tag_reply(b"\x03binary", 7) == b"\x03binary"
+
+
+def test_replies_carry_request_id_only_when_given():
+    ws = FakeWebSocket()
+    asyncio.run(CommandReplies(ws, "r1").send(json.dumps({"type": "x"})))
+    asyncio.run(CommandReplies(ws).send(json.dumps({"type": "y"})))
+    assert ws.sent == [{"requestId": "r1", "type": "x"}, {"type": "y"}]
+
+
+def test_reply_bytes_are_counted_on_the_wire():
+    def sent(label):
+        return proxy.SENT_BYTES._values.get((label,), 0)
+
+    before = sent("getTree")
+    message = json.dumps({"type": "treeData", "payload": {"xml": "<Döner/>"}}, ensure_ascii=False)
+    asyncio.run(CommandReplies(FakeWebSocket(), None, "getTree").send(message))
+    asyncio.run(CommandReplies(FakeWebSocket(), None, "getTree").send(message.encode()))
+    assert sent("getTree") - before == 2 * len(message.encode())
+
+
+def test_commands_run_concurrently_but_lanes_keep_order(monkeypatch):
+    log = []
+    delays = {"getBlackboard": 0.05, "setBreakpoint": 0.03, "unlockBreakpoint": 0.0, "pause": 0.0}
+
+    async def fake_handle_command(session, services, data):
+        log.append(("start", data["type"]))
+        await asyncio.sleep(delays.get(data["type"], 0))
+        log.append(("end", data["type"]))
+
+    monkeypatch.setattr(proxy, "handle_command", fake_handle_command)
+
+    async def run():
+        session = ClientSession(FakeWebSocket(), FakeRegistry())
+        for command in ["getBlackboard", "setBreakpoint", "unlockBreakpoint", "pause"]:
+            await session.dispatch({"type": command})
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    ends = [command for event, command in log if event == "end"]
+    # pause did not wait for the blackboard fetch ...
+    assert ends.index("pause") < ends.index("getBlackboard")
+    # ... but the unlock still followed the breakpoint insert, and pause the unlock
+    assert ends.index("setBreakpoint") < ends.index("unlockBreakpoint") < ends.index("pause")
+    assert log.index(("end", "setBreakpoint")) < log.index(("start", "unlockBreakpoint"))
+
+
+def test_unknown_backend_is_reported_with_request_id():
+    ws = FakeWebSocket()
+    session = ClientSession(ws, FakeRegistry())
+    asyncio.run(session.dispatch({"type": "getTree", "requestId": 9, "payload": {"backend": "nope"}}))
+    assert ws.sent == [{"requestId": 9, "type": "error", "replyTo": "getTree",
+                        "payload": {"message": "Unknown backend: nope"}}]
+
+
+def test_non_object_payload_gets_an_error_reply():
+    ws = FakeWebSocket()
+    session = ClientSession(ws, FakeRegistry())
+    asyncio.run(session.dispatch({"type": "getStatus", "requestId": 3, "payload": [1]}))
+    asyncio.run(session.dispatch({"type": "getStatus", "payload": {"backend": ["x"]}}))
+    assert ws.sent == [{"requestId": 3, "type": "error", "replyTo": "getStatus",
+                        "payload": {"message": "Command payload must be a JSON object"}},
+                       {"type": "error", "replyTo": "getStatus", "payload": {"message": "Unknown backend: ['x']"}}]
+
+
+def test_default_recording_files_are_private_to_the_process(tmp_path):
+    first, second = proxy.recording_path(None, "default"), proxy.recording_path(None, "r2")
+    # One private directory per process, one file per backend
+    assert os.path.dirname(first) == os.path.dirname(second)
+    assert os.stat(os.path.dirname(first)).st_mode & 0o077 == 0
+    assert str(os.getpid()) in os.path.basename(os.path.dirname(first))
+    assert first != second
+    # An explicit path is used as given
+    explicit = str(tmp_path / "recording.ring")
+    assert proxy.recording_path(explicit, "default") == explicit
+    assert proxy.recording_path(explicit, "r2") == str(tmp_path / "recording.r2.ring")
+
+
+def test_registry_reload_moves_sessions_and_releases_services(tmp_path):
+    config = tmp_path / "backends.json"
+    args = SimpleNamespace(status_rate=10.0, status_keyframe_interval=5.0, tree_revalidate_after=5.0,
+                           blackboard_interval=0.5, blackboard_max_value_bytes=4096,
+                           recording_file=str(tmp_path / "recording.ring"), recording_capacity=1000,
+                           transition_drain_interval=0.05, hook_reconcile_interval=30.0)
+
+    def write(backends):
+        config.write_text(json.dumps({"default": "r1", "backends": {
+            name: {"host": "127.0.0.1", "req_port": port, "pub_port": port + 1} for name, port in backends.items()}}))
+
+    async def run():
+        pools = ConnectionPoolManager(request_timeout=0.1)
+        registry = BackendRegistry(pools, lambda name, pool: BackendServices(name, pool, args), str(config))
+        try:
+            write({"r1": 41667, "r2": 41667})
+            registry.load()
+            shared = registry.get("r1")
+            assert registry.get("r2") is shared  # one endpoint, one set of services
+            old_pool = shared.pool
+            assert len(old_pool._tree_change_callbacks) == 2  # tree cache and hook table
+            session = ClientSession(FakeWebSocket(), registry, "r1")
+            session.listen_to_pub()
+
+            # r1 moves; r2 keeps the old endpoint and its services
+            write({"r1": 41677, "r2": 41667})
+            registry.reload()
+            moved = registry.get("r1")
+            assert registry.get("r2") is shared and moved is not shared
+            assert session._pub_services is moved and moved.hooks.stats()["listeners"] == 1
+            assert shared.hooks.stats()["listeners"] == 0 and len(old_pool._listeners) == 0
+            assert len(old_pool._tree_change_callbacks) == 2
+
+            # Nothing uses the old endpoint any more
+            write({"r1": 41677})
+            registry.reload()
+            assert old_pool._tree_change_callbacks == [] and len(moved.pool._tree_change_callbacks) == 2
+            assert [name for name, _ in registry.active()] == ["r1"]
+            session.close()
+            assert registry._change_callbacks == []
+        finally:
+            registry.close()
+            pools.close()
+
+    asyncio.run(run())
+
+
+def test_traces_are_only_served_when_exposed(monkeypatch):
+    monkeypatch.setattr(proxy.TRACER, "dump", lambda limit=None, command=None: [{"command": "getTree"}])
+    services = SimpleNamespace(pool=None)
+
+    hidden, exposed = FakeWebSocket(), FakeWebSocket()
+    asyncio.run(proxy.handle_command(ClientSession(hidden, FakeRegistry()), services,
+                                     {"type": "getTraces", "requestId": 4}))
+    asyncio.run(proxy.handle_command(ClientSession(exposed, FakeRegistry(), expose_traces=True), services,
+                                     {"type": "getTraces", "requestId": 5}))
+
+    assert hidden.sent == [{"requestId": 4, "type": "error", "replyTo": "getTraces", "payload": {
+        "message": "Traces are not exposed to clients; start the proxy with --expose-traces"}}]
+    assert exposed.sent[0]["type"] == "traces"
+    assert exposed.sent[0]["payload"]["traces"] == [{"command": "getTree"}]
+
+
+class FakeLink:
+    """HubLink stand-in answering every hub call with one reply frame."""
+
+    def __init__(self):
+        self.pools = {}
+        self.calls = []
+
+    async def call(self, client, endpoint, method, *args):
+        self.calls.append((client, endpoint, method, args))
+        return [b'{"type": "hooksDump", "payload": {}}']
+
+    def notify(self, client, endpoint, method, *args):
+        self.calls.append((client, endpoint, method, args))
+
+
+def test_workers_forward_hub_commands_and_tag_their_replies():
+    link = FakeLink()
+    args = SimpleNamespace(tree_revalidate_after=5.0, blackboard_max_value_bytes=4096)
+    services = proxy.WorkerServices("default", RemotePool(link, "127.0.0.1", 1667, 1668), args, link)
+    ws = FakeWebSocket()
+    session = ClientSession(ws, FakeRegistry())
+
+    asyncio.run(proxy.handle_command(session, services, {"type": "getHooks", "requestId": 3}))
+    asyncio.run(proxy.handle_command(session, services, {"type": "subscribe", "requestId": 4,
+                                                         "payload": {"topic": "N"}}))
+
+    # The hub runs getHooks and the worker tags its reply; subscribe never leaves the worker
+    assert ws.sent == [{"requestId": 3, "type": "hooksDump", "payload": {}},
+                       {"requestId": 4, "type": "subscribed", "payload": {"topic": "N"}}]
+    assert link.calls == [(ws, ("127.0.0.1", 1667, 1668), "command", ({"type": "getHooks", "requestId": 3}, "default"))]
+
+
+def test_hub_gives_worker_requests_ids_of_its_own():
+    sent = []
+
+    async def request(frames, timeout=None):
+        sent.append(frames[0])
+        return [frames[0] + bytes(16), b"ok"]
+
+    services = SimpleNamespace(pool=SimpleNamespace(request=request, request_shared=request))
+    registry = SimpleNamespace(add_change_callback=lambda callback: None, for_endpoint=lambda *endpoint: services)
+    calls = proxy.HubCalls(SimpleNamespace(), registry)
+    header = struct.pack('!BBi', 2, ord('S'), 1)
+
+    async def run():
+        # Both workers numbered their first request 1
+        return await asyncio.gather(calls.call(b"w0000", None, ("h", 1, 2), "request", [[header], None]),
+                                    calls.call(b"w0001", None, ("h", 1, 2), "request_shared", [[header], None]))
+
+    replies = asyncio.run(run())
+    assert len({frame[2:6] for frame in sent}) == 2 and all(frame[:2] == header[:2] for frame in sent)
+    # Each worker gets its own id back
+    assert [reply[0][:6] for reply in replies] == [header, header]
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the transition ring file and the recorder drain loop.
+
+Usage:
+  python3 -m pytest -q tests/recorder_test.py
+"""
+
+import asyncio
+import struct
+import uuid
+
+from recorder import Recorder, TransitionIndex, TransitionRing, BACKEND_TRANSITION_BUFFER
+
+
+def make_records(first, count):
+    """Packed 9-byte records whose timestamp is their sequence number."""
+    return b''.join(index.to_bytes(6, 'big') + struct.pack('!HB', *record_fields(index))
+                    for index in range(first, first + count))
+
+
+def record_fields(index):
+    return index % 10, index // 10 % 4
+
+
+def expected_snapshot(initial, first, last):
+    """Node statuses after replaying records [first, last) over `initial`."""
+    state = dict(initial)
+    state.update(record_fields(index) for index in range(first, last))
+    return state
+
+
+class FakeBackend:
+    """Answers r and t requests like the Groot2 publisher, handing out queued transitions."""
+
+    req_endpoint = "tcp://test:1667"
+
+    def __init__(self):
+        self.tree_uuid = uuid.uuid4()
+        self.pending = []
+        self.requests = []
+
+    async def request(self, frames, timeout=None):
+        type_char = chr(frames[0][1])
+        self.requests.append(type_char)
+        body = b''
+        if type_char == 'r' and frames[1] == b"start":
+            body = b"1700000000000000"
+        elif type_char == 'S':
+            # Node 10 is reported as IDLE after SUCCESS
+            body = b''.join(struct.pack('!HB', uid, 12 if uid == 10 else 0) for uid in range(11))
+        elif type_char == 't':
+            body = b''.join(self.pending[:BACKEND_TRANSITION_BUFFER])
+            del self.pending[:BACKEND_TRANSITION_BUFFER]
+        return [frames[0] + self.tree_uuid.bytes, body]
+
+
+def test_ring_wraps_and_keeps_newest_records(tmp_path):
+    ring = TransitionRing(str(tmp_path / "ring"), capacity=10)
+
+    ring.append(make_records(0, 7))
+    ring.append(make_records(7, 6))
+
+    assert (ring.total, ring.stored, ring.oldest) == (13, 10, 3)
+    assert ring.read(0, 100) == (3, make_records(3, 10))
+    assert ring.read(8, 3) == (8, make_records(8, 3))
+    assert ring.read(0, 2) == (3, make_records(3, 2))
+    ring.close()
+
+
+def test_ring_is_resumed_from_existing_file(tmp_path):
+    path = str(tmp_path / "ring")
+    tree_id = str(uuid.uuid4())
+    ring = TransitionRing(path, capacity=10)
+    ring.reset(start_time=42, tree_id=tree_id)
+    ring.append(make_records(0, 12))
+    ring.close()
+
+    reopened = TransitionRing(path, capacity=10)
+    assert (reopened.total, reopened.start_time, reopened.tree_id) == (12, 42, tree_id)
+    assert reopened.read(0, 100) == (2, make_records(2, 10))
+    reopened.close()
+
+    # A different layout starts over
+    resized = TransitionRing(path, capacity=20)
+    assert resized.total == 0
+    resized.close()
+
+
+def test_ring_without_resume_starts_empty(tmp_path):
+    path = str(tmp_path / "ring")
+    ring = TransitionRing(path, capacity=10)
+    ring.reset(start_time=42)
+    ring.append(make_records(0, 3))
+    ring.close()
+
+    fresh = TransitionRing(path, capacity=10, resume=False)
+    assert (fresh.total, fresh.start_time) == (0, 0)
+    fresh.close()
+
+
+def test_recorder_drains_until_stopped(tmp_path):
+    backend = FakeBackend()
+    recorder = Recorder(backend, str(tmp_path / "ring"), capacity=5000, drain_interval=0.01)
+
+    async def scenario():
+        status = await recorder.start()
+        assert status["recording"] and status["startTime"] == 1700000000000000
+        # More than the backend buffer holds between two drains
+        backend.pending = [make_records(index, 1) for index in range(2500)]
+        await asyncio.sleep(0.05)
+        backend.pending.append(make_records(2500, 1))
+        return await recorder.stop()
+
+    status = asyncio.run(scenario())
+
+    assert not status["recording"]
+    assert status["total"] == 2501
+    assert recorder.read(2490, 100) == (2490, make_records(2490, 11))
+    assert recorder.stats()["overflow_suspected"] >= 2
+    assert backend.requests[0] == 'r' and backend.requests[-2:] == ['r', 't']
+    recorder.close()
+
+
+def test_seek_rebuilds_statuses_from_checkpoints(tmp_path):
+    backend = FakeBackend()
+    recorder = Recorder(backend, str(tmp_path / "ring"), capacity=200, drain_interval=10)
+    recorder.index = TransitionIndex(stride=8, checkpoint_every=2)
+    initial = {uid: 0 for uid in range(11)}
+
+    async def scenario():
+        await recorder.start()
+        for first in range(0, 150, 50):
+            backend.pending = [make_records(first, 50)]
+            await recorder.drain_once()
+        await recorder.stop()
+
+    asyncio.run(scenario())
+
+    for timestamp in (0, 1, 37, 64, 149):
+        first, records, snapshot, complete = recorder.seek(timestamp, 5)
+        assert first == timestamp
+        assert records == make_records(timestamp, min(5, 150 - timestamp))
+        assert snapshot == expected_snapshot(initial, 0, timestamp)
+        assert complete
+    recorder.close()
+
+
+def test_seek_after_wrap_and_reopen(tmp_path):
+    backend = FakeBackend()
+    path = str(tmp_path / "ring")
+    recorder = Recorder(backend, path, capacity=100, drain_interval=10)
+    recorder.index = TransitionIndex(stride=8, checkpoint_every=2)
+
+    async def scenario():
+        await recorder.start()
+        backend.pending = [make_records(0, 250)]
+        await recorder.drain_once()
+        await recorder.stop()
+
+    asyncio.run(scenario())
+
+    # Checkpoints from before the wrap are gone, later ones are still complete
+    first, _, snapshot, complete = recorder.seek(200, 1)
+    assert (first, complete) == (200, True)
+    assert snapshot == expected_snapshot({uid: 0 for uid in range(11)}, 0, 200)
+    # Older than the ring: lands on its oldest record
+    assert recorder.seek(10, 1)[0] == 150
+    recorder.close()
+
+    reopened = Recorder(backend, path, capacity=100)
+    reopened.index = TransitionIndex(stride=8, checkpoint_every=2)
+    first, records, snapshot, complete = reopened.seek(200, 3)
+    assert (first, records) == (200, make_records(200, 3))
+    assert snapshot == expected_snapshot({}, 150, 200)
+    assert not complete
+    reopened.close()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Replays a proxy capture file (scripts/proxy.py --capture-file) as a Groot2 backend.
+
+The captured replies are served on a REP socket and the captured PUB
+messages re-published, so a user's session (their tree, status churn,
+blackboards, breakpoints) can be reproduced against a proxy under test.
+
+A request is answered with a captured reply to the same request (type and
+body), falling back to the latest reply of the same type; the reply header
+carries the new request id and the captured tree UUID. Unknown requests
+get an error reply.
+
+- --speed 1 (the default) keeps the original timing: the replay clock
+  starts with the first request, each request gets the captured reply
+  that was current at that point of the capture after its captured round
+  trip time, and PUB messages go out at their captured times. --speed 2
+  plays twice as fast.
+- --speed 0 replays at maximum speed: no delays, identical requests cycle
+  through all their captured replies, PUB messages are sent back to back.
+
+Without --loop, requests keep getting the last captured replies once the
+capture has played; --loop starts over instead. --info only prints a
+summary of the capture.
+
+Usage:
+  python3 tests/replay_capture.py capture.bin [--port 1667] [--speed 1] [--loop] [--endpoint tcp://host:1667]
+  python3 tests/replay_capture.py capture.bin --info
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from bisect import bisect_right
+
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from traffic_capture import read_capture, KIND_ENDPOINT, KIND_REQUEST, KIND_REPLY, KIND_PUB  # noqa: E402
+
+DEFAULT_PORT = 1667
+POLL_INTERVAL = 0.1  # seconds; how quickly stop() is noticed
+REQUEST_HEADER_SIZE = 6
+REPLY_HEADER_SIZE = 22
+
+
+class Exchange:
+    """A captured request and its reply, with times in seconds since the capture start."""
+
+    __slots__ = ("at", "rtt", "reply")
+
+    def __init__(self, at, rtt, reply):
+        self.at = at
+        self.rtt = rtt
+        self.reply = reply
+
+
+class CaptureReplay:
+    """Exchanges and PUB messages of one endpoint of a capture, indexed for replay."""
+
+    def __init__(self, records, endpoint=None):
+        endpoints = {}  # index -> (req endpoint, pub endpoint)
+        for record in records:
+            if record.kind == KIND_ENDPOINT:
+                endpoints[record.endpoint] = tuple(frame.decode() for frame in record.frames)
+        if not endpoints:
+            raise ValueError("The capture declares no endpoint")
+        self.endpoints = sorted(set(endpoints.values()))
+        if endpoint is None:
+            endpoint = endpoints[min(endpoints)][0]
+        # A pool closed and created again declares its endpoint again under a new index
+        indexes = {index for index, (req, _) in endpoints.items() if req == endpoint}
+        if not indexes:
+            raise ValueError(f"{endpoint} is not in the capture (it has {', '.join(req for req, _ in self.endpoints)})")
+        self.endpoint = endpoint
+
+        requests = {}  # seq -> request record
+        self.by_request = {}  # (type byte, body) -> [Exchange], by time
+        self.by_type = {}  # type byte -> [Exchange], by time
+        self.pubs = []  # (seconds, frames)
+        self.duration = 0.0
+        for record in records:
+            if record.endpoint not in indexes:
+                continue
+            seconds = record.timestamp / 1e6
+            self.duration = max(self.duration, seconds)
+            if record.kind == KIND_REQUEST:
+                requests[record.seq] = record
+            elif record.kind == KIND_REPLY:
+                request = requests.pop(record.seq, None)
+                if request is None or not request.frames:
+                    continue
+                exchange = Exchange(request.timestamp / 1e6, (record.timestamp - request.timestamp) / 1e6, record.frames)
+                type_byte = request.frames[0][1:2]
+                self.by_request.setdefault(request_key(request.frames), []).append(exchange)
+                self.by_type.setdefault(type_byte, []).append(exchange)
+            elif record.kind == KIND_PUB:
+                self.pubs.append((seconds, record.frames))
+        self._starts = {key: [exchange.at for exchange in exchanges] for key, exchanges in self.by_request.items()}
+        self._type_starts = {key: [exchange.at for exchange in exchanges] for key, exchanges in self.by_type.items()}
+        self._cursors = {}
+
+    def lookup(self, frames, at=None):
+        """The Exchange answering `frames`, or None.
+
+        With `at` (seconds into the capture) it is the latest one captured
+        before that point; without, identical requests cycle through all
+        captured replies.
+        """
+        key = request_key(frames)
+        exchanges, starts = self.by_request.get(key), self._starts.get(key)
+        if exchanges is None:
+            key = frames[0][1:2]
+            exchanges, starts = self.by_type.get(key), self._type_starts.get(key)
+            if exchanges is None:
+                return None
+        if at is None:
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            return exchanges[cursor % len(exchanges)]
+        return exchanges[max(0, bisect_right(starts, at) - 1)]
+
+    def summary(self):
+        counts = {}
+        for exchanges in self.by_type.values():
+            for exchange in exchanges:
+                type_char = chr(exchange.reply[0][1]) if len(exchange.reply[0]) >= 2 else "?"
+                counts[type_char] = counts.get(type_char, 0) + 1
+        return {
+            "endpoint": self.endpoint,
+            "duration": self.duration,
+            "exchanges": counts,
+            "pubs": len(self.pubs),
+        }
+
+
+def request_key(frames):
+    return (frames[0][1:2], b"".join(frames[1:]))
+
+
+def reply_for(header, exchange):
+    """The captured reply with the request id of `header`."""
+    reply = exchange.reply
+    if len(reply[0]) == REPLY_HEADER_SIZE:
+        return [header[:REQUEST_HEADER_SIZE] + reply[0][REQUEST_HEADER_SIZE:], *reply[1:]]
+    return reply
+
+
+class CaptureReplayServer:
+    """Serves a CaptureReplay on REP and PUB sockets (port and port + 1) from background threads."""
+
+    def __init__(self, replay, host="127.0.0.1", port=DEFAULT_PORT, speed=1.0, loop=False):
+        self.replay = replay
+        self.req_endpoint = f"tcp://{host}:{port}"
+        self.pub_endpoint = f"tcp://{host}:{port + 1}"
+        self.speed = speed
+        self.loop = loop
+        self.requests = 0
+        self.misses = 0
+        self.published = 0
+        self._started = threading.Event()  # set by the first request
+        self._t0 = None
+        self._stop = threading.Event()
+        self._threads = []
+        self._context = None
+
+    def start(self):
+        self._context = zmq.Context()
+        rep = self._context.socket(zmq.REP)
+        rep.setsockopt(zmq.LINGER, 0)
+        rep.bind(self.req_endpoint)
+        pub = self._context.socket(zmq.PUB)
+        pub.setsockopt(zmq.LINGER, 0)
+        pub.bind(self.pub_endpoint)
+        self._threads = [threading.Thread(target=self._serve, args=(rep,), daemon=True),
+                         threading.Thread(target=self._publish, args=(pub,), daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._started.set()
+        for thread in self._threads:
+            thread.join()
+        self._context.term()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def finished(self):
+        """True once a non-looping replay has played the whole capture."""
+        return not self.loop and self._t0 is not None and self._position() > self.replay.duration
+
+    def _position(self):
+        """Seconds into the capture."""
+        elapsed = (time.monotonic() - self._t0) * (self.speed or 1.0)
+        if self.loop and self.replay.duration > 0:
+            return elapsed % self.replay.duration
+        return elapsed
+
+    def _serve(self, rep):
+        poller = zmq.Poller()
+        poller.register(rep, zmq.POLLIN)
+        while not self._stop.is_set():
+            if not poller.poll(POLL_INTERVAL * 1000):
+                continue
+            frames = rep.recv_multipart()
+            if self._t0 is None:
+                self._t0 = time.monotonic()
+                self._started.set()
+            self.requests += 1
+            exchange = None
+            if len(frames[0]) == REQUEST_HEADER_SIZE:
+                exchange = self.replay.lookup(frames, self._position() if self.speed else None)
+            if exchange is None:
+                self.misses += 1
+                rep.send_multipart([b"error", b"Request not in the capture"])
+                continue
+            if self.speed:
+                time.sleep(exchange.rtt / self.speed)
+            rep.send_multipart(reply_for(frames[0], exchange))
+        rep.close()
+
+    def _publish(self, pub):
+        self._started.wait()
+        while not self._stop.is_set():
+            started = time.monotonic()
+            for seconds, frames in self.replay.pubs:
+                if self.speed and self._stop.wait(max(0.0, started + seconds / self.speed - time.monotonic())):
+                    break
+                if self._stop.is_set():
+                    break
+                pub.send_multipart(frames)
+                self.published += 1
+            if not self.loop:
+                break
+            if self.speed:
+                self._stop.wait(max(0.0, started + self.replay.duration / self.speed - time.monotonic()))
+            elif not self.replay.pubs:
+                self._stop.wait(POLL_INTERVAL)
+        pub.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a Groot2 proxy capture file as a backend")
+    parser.add_argument("capture", help="File written by scripts/proxy.py --capture-file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="REQ/REP port; PUB is port + 1")
+    parser.add_argument("--endpoint", help="Captured backend to replay, e.g. tcp://localhost:1667 (default: the first one)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Playback speed; 1 keeps the captured timing, 0 replays at maximum speed")
+    parser.add_argument("--loop", action="store_true", help="Start over at the end of the capture")
+    parser.add_argument("--info", action="store_true", help="Print a summary of the capture and exit")
+    args = parser.parse_args()
+
+    start_time, records = read_capture(args.capture)
+    replay = CaptureReplay(records, args.endpoint)
+    captured_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time / 1e6))
+    summary = replay.summary()
+    print(f"{args.capture}: captured {captured_at}, {summary['duration']:.1f}s of {summary['endpoint']}, "
+          f"{sum(summary['exchanges'].values())} exchanges "
+          f"({', '.join(f'{t}={n}' for t, n in sorted(summary['exchanges'].items()))}), {summary['pubs']} PUB messages")
+    if len(replay.endpoints) > 1:
+        print(f"Other endpoints: {', '.join(req for req, _ in replay.endpoints if req != replay.endpoint)}")
+    if args.info:
+        return
+
+    server = CaptureReplayServer(replay, args.host, args.port, args.speed, args.loop).start()
+    print(f"Replaying on {server.req_endpoint} / {server.pub_endpoint} at "
+          f"{'maximum speed' if not args.speed else f'{args.speed:g}x'}{' in a loop' if args.loop else ''}")
+    try:
+        announced = False
+        while True:
+            time.sleep(POLL_INTERVAL)
+            if server.finished and not announced:
+                announced = True
+                print("End of capture; requests keep getting its last replies")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(f"{server.requests} requests ({server.misses} not in the capture), {server.published} PUB messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Unit tests for backend request priority scheduling.
+
+Usage:
+  python3 -m pytest -q tests/request_scheduler_test.py
+"""
+
+import asyncio
+
+import pytest
+
+from groot2_protocol import serialize_request_header
+from request_scheduler import RequestScheduler, parse_class_limits, request_class
+
+
+def test_requests_are_classified_by_type():
+    classes = {char: request_class([serialize_request_header(2, char, 1)]) for char in "UsSBTt"}
+    assert classes == {"U": "control", "s": "control", "S": "status", "B": "blackboard",
+                       "T": "bulk", "t": "bulk"}
+
+
+def test_parse_class_limits():
+    assert parse_class_limits("control=8, bulk=2") == {"control": 8, "bulk": 2}
+    with pytest.raises(ValueError):
+        parse_class_limits("heartbeat=1")
+
+
+def test_control_overtakes_queued_bulk_requests():
+    order = []
+
+    async def request(scheduler, cls, name, duration):
+        async with scheduler.slot(cls):
+            order.append(name)
+            await asyncio.sleep(duration)
+
+    async def run():
+        scheduler = RequestScheduler({"bulk": 1, "blackboard": 1}, max_active=2)
+        tasks = [asyncio.create_task(request(scheduler, "bulk", "tree-1", 0.03)),
+                 asyncio.create_task(request(scheduler, "blackboard", "bb-1", 0.02)),
+                 asyncio.create_task(request(scheduler, "bulk", "tree-2", 0.01)),
+                 asyncio.create_task(request(scheduler, "blackboard", "bb-2", 0.01))]
+        await asyncio.sleep(0.005)
+        tasks.append(asyncio.create_task(request(scheduler, "control", "unlock", 0)))
+        await asyncio.gather(*tasks)
+        return scheduler.stats()
+
+    stats = asyncio.run(run())
+    # The unlock arrived last but took the first free slot
+    assert order == ["tree-1", "bb-1", "unlock", "bb-2", "tree-2"]
+    assert stats["control"]["waits"] == 1 and stats["bulk"]["waits"] == 1
+    assert stats["bulk"]["wait_time_max"] > 0 and stats["active"] == 0
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def run():
+        scheduler = RequestScheduler({"bulk": 1})
+        await scheduler.acquire("bulk")
+        waiter = asyncio.create_task(scheduler.acquire("bulk"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        scheduler.release("bulk")
+        return scheduler.stats()["bulk"]
+
+    stats = asyncio.run(run())
+    assert (stats["active"], stats["queued"]) == (0, 0)
+
+
+def test_waiter_cancelled_while_a_slot_is_released():
+    async def run():
+        scheduler = RequestScheduler({"bulk": 1})
+        await scheduler.acquire("bulk")
+        waiter = asyncio.create_task(scheduler.acquire("bulk"))
+        await asyncio.sleep(0)
+        # The release runs before the cancelled waiter resumes and skips its future
+        waiter.cancel()
+        scheduler.release("bulk")
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return scheduler.stats()["bulk"]
+
+    stats = asyncio.run(run())
+    assert (stats["active"], stats["queued"]) == (0, 0)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Unit tests for per-client send queues.
+
+Usage:
+  python3 -m pytest -q tests/send_queue_test.py
+"""
+
+import asyncio
+
+import pytest
+
+from send_queue import SendQueues, broadcast, SEND_FAILED_CLOSE_CODE, SLOW_CLIENT_CLOSE_CODE
+
+
+class SlowWebSocket:
+    """Accepts frames only when `drain()` lets them through."""
+
+    subprotocol = None
+    remote_address = ("127.0.0.1", 1234)
+
+    def __init__(self):
+        self.received = []
+        self.text = []
+        self.closed_with = None
+        self._gate = asyncio.Event()
+
+    async def send(self, frame, text=None):
+        await self._gate.wait()
+        self.received.append(frame)
+        self.text.append(text)
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = (code, reason)
+
+    async def drain(self):
+        self._gate.set()
+        await asyncio.sleep(0.01)
+
+
+def test_stream_policies_keep_control_frames():
+    async def run():
+        queues = SendQueues(max_size=2, max_lag=0)
+        ws = SlowWebSocket()
+        queue = queues.wrap(ws)
+
+        await queue.send("reply-1")
+        for i in range(5):
+            broadcast([queue], f"status-{i}", stream="status")
+            broadcast([queue], f"bb-{i}", stream="blackboard")
+        await queue.send("reply-2")
+        # The writer is blocked sending "reply-1"
+        await asyncio.sleep(0)
+        stats = queues.stats()
+        await ws.drain()
+        return ws.received, stats
+
+    received, stats = asyncio.run(run())
+    assert received == ["reply-1", "bb-3", "status-4", "bb-4", "reply-2"]
+    assert (stats["coalesced"], stats["dropped"]) == (4, 3)
+    assert stats["depth"] == 4 and stats["clients"] == 1
+
+
+def test_stalled_client_is_disconnected():
+    async def run():
+        queues = SendQueues(max_lag=0.01)
+        ws = SlowWebSocket()
+        queue = queues.wrap(ws)
+        await queue.send("reply")
+        broadcast([queue], "status-1", stream="status")
+        await asyncio.sleep(0.02)
+        broadcast([queue], "status-2", stream="status")
+        await asyncio.sleep(0)
+        return ws, queue, queues.stats()
+
+    ws, queue, stats = asyncio.run(run())
+    assert ws.closed_with == (SLOW_CLIENT_CLOSE_CODE, "Client too slow")
+    assert queue.closed and queue.depth == 0
+    assert stats["disconnects"] == 1 and stats["clients"] == 0
+
+
+def test_stalled_client_is_disconnected_without_further_frames():
+    async def run():
+        queues = SendQueues(max_lag=0.02)
+        ws = SlowWebSocket()
+        queue = queues.wrap(ws)
+        await queue.send("reply")
+        broadcast([queue], "status-1", stream="status")
+        # Nothing else is sent to this client; the lag timer notices it is stuck
+        await asyncio.sleep(0.05)
+        return ws, queue, queues.stats()
+
+    ws, queue, stats = asyncio.run(run())
+    assert ws.closed_with == (SLOW_CLIENT_CLOSE_CODE, "Client too slow")
+    assert queue.closed and stats["disconnects"] == 1
+
+
+def test_client_making_progress_is_kept():
+    async def run():
+        queues = SendQueues(max_lag=0.02)
+        ws = SlowWebSocket()
+        queue = queues.wrap(ws)
+        await queue.send("reply")
+        await ws.drain()
+        await asyncio.sleep(0.05)
+        return ws, queue
+
+    ws, queue = asyncio.run(run())
+    assert ws.closed_with is None and not queue.closed
+    assert queue._lag_timer is None
+
+
+def test_json_bytes_are_sent_as_text_frames():
+    async def run():
+        ws = SlowWebSocket()
+        queue = SendQueues().wrap(ws)
+        await queue.send(b'{"type": "reply"}')
+        broadcast([queue], b"\x01binary", stream="status")
+        await ws.drain()
+        return ws.text
+
+    assert asyncio.run(run()) == [True, False]
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        SendQueues(policies={"status": "drop-newest"})
+
+
+def test_failed_send_disconnects_the_client():
+    class BrokenWebSocket(SlowWebSocket):
+        async def send(self, frame, text=None):
+            raise TypeError("data must be str or bytes-like")
+
+    async def run():
+        queues = SendQueues()
+        ws = BrokenWebSocket()
+        queue = queues.wrap(ws)
+        await queue.send(b'{"type": "reply"}')
+        await asyncio.sleep(0.01)
+        await queue.send(b'{"type": "later"}')
+        return ws, queue
+
+    ws, queue = asyncio.run(run())
+    assert ws.closed_with == (SEND_FAILED_CLOSE_CODE, "Send failed")
+    assert queue.closed and queue.depth == 0
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Unit tests for single-flight request coalescing.
+
+Usage:
+  python3 -m pytest -q tests/single_flight_test.py
+"""
+
+import asyncio
+
+import pytest
+
+from groot2_protocol import serialize_request_header
+from single_flight import SingleFlight, request_key
+
+
+class CountingFetch:
+    def __init__(self, delay=0.01, error=None):
+        self.calls = 0
+        self.delay = delay
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return [b"reply", str(self.calls).encode()]
+
+
+def test_key_ignores_request_id():
+    first = [serialize_request_header(2, 'B', 1), b"MainTree"]
+    second = [serialize_request_header(2, 'B', 2), b"MainTree"]
+    assert request_key(first) == request_key(second)
+    assert request_key(first) != request_key([serialize_request_header(2, 'B', 3), b"Sub"])
+    assert request_key([serialize_request_header(2, 'S', 1)]) != request_key([serialize_request_header(2, 'T', 1)])
+
+
+def test_concurrent_callers_share_one_request():
+    flight = SingleFlight()
+    fetch = CountingFetch()
+
+    async def run():
+        return await asyncio.gather(*(flight.do(("S",), fetch) for _ in range(10)))
+
+    replies = asyncio.run(run())
+    assert fetch.calls == 1
+    assert all(reply is replies[0] for reply in replies)
+    assert flight.stats()["joined"] == 9 and flight.stats()["in_flight"] == 0
+
+    # Nothing is kept without a freshness window
+    asyncio.run(run())
+    assert fetch.calls == 2
+
+
+def test_freshness_window_reuses_recent_reply():
+    flight = SingleFlight(freshness=60)
+    fetch = CountingFetch(delay=0)
+
+    async def run():
+        first = await flight.do(("T",), fetch)
+        second = await flight.do(("T",), fetch)
+        other = await flight.do(("B", b"Sub"), fetch)
+        return first, second, other
+
+    first, second, other = asyncio.run(run())
+    assert first is second and other != first
+    assert fetch.calls == 2 and flight.stats()["fresh_hits"] == 1
+
+
+def test_errors_are_shared_but_not_cached():
+    flight = SingleFlight(freshness=60)
+    fetch = CountingFetch(error=ValueError("Backend error: busy"))
+
+    async def run():
+        return await asyncio.gather(*(flight.do(("S",), fetch) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(run()))
+    assert fetch.calls == 1
+    with pytest.raises(ValueError):
+        asyncio.run(flight.do(("S",), fetch))
+    assert fetch.calls == 2
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    flight = SingleFlight()
+    fetch = CountingFetch(delay=0.05)
+
+    async def run():
+        leader = asyncio.ensure_future(flight.do(("T",), fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do(("T",), fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await waiter
+
+    assert asyncio.run(run()) == [b"reply", b"1"]
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the status poller's fan-out and delta encoding.
+
+Usage:
+  python3 -m pytest -q tests/status_poller_test.py
+"""
+
+import asyncio
+import json
+import struct
+import uuid
+
+import status_poller
+from status_poller import StatusPoller, compute_status_delta
+from binary_frames import decode_frame, FRAME_STATUS_KEYFRAME, FRAME_STATUS_DELTA
+from send_queue import SendQueues
+
+TREE_ID = bytes(range(16))
+
+
+def status_vector(statuses):
+    return b''.join(struct.pack('!HB', uid, status) for uid, status in statuses)
+
+
+def test_delta_lists_only_changed_nodes():
+    previous = status_vector([(1, 0), (2, 1), (300, 2)])
+    current = status_vector([(1, 0), (2, 2), (300, 3)])
+    assert compute_status_delta(previous, current) == [[2, 2], [300, 3]]
+
+
+def test_delta_is_empty_when_nothing_changed():
+    vector = status_vector([(1, 0), (2, 1)])
+    assert compute_status_delta(vector, vector) == []
+
+
+def test_delta_requires_keyframe_when_layout_changes():
+    previous = status_vector([(1, 0), (2, 1)])
+    assert compute_status_delta(previous, status_vector([(1, 0), (3, 1)])) is None
+    assert compute_status_delta(previous, status_vector([(1, 0)])) is None
+
+
+class FakeBackend:
+    req_endpoint = "tcp://test:1667"
+
+
+def test_publish_sends_keyframe_then_sequenced_deltas(monkeypatch):
+    sent = []
+    monkeypatch.setattr(status_poller, "queue_broadcast",
+                        lambda targets, frame, stream: sent.append((list(targets), json.loads(frame))))
+
+    poller = StatusPoller(FakeBackend(), keyframe_interval=60.0)
+    poller._subscribers = {"full": ("full", False), "delta": ("delta", False)}
+    poller._needs_keyframe.add("delta")
+    header = {"tree_id": "tree-a"}
+
+    poller._publish(header, status_vector([(1, 0), (2, 0)]), now=100.0)
+    assert [(targets, frame["type"]) for targets, frame in sent] == [(["full"], "statusUpdate"),
+                                                                     (["delta"], "statusUpdate")]
+    keyframe_seq = sent[-1][1]["payload"]["seq"]
+
+    sent.clear()
+    poller._publish(header, status_vector([(1, 0), (2, 1)]), now=100.1)
+    delta = [frame for targets, frame in sent if targets == ["delta"]]
+    assert delta[0]["type"] == "statusDelta"
+    assert delta[0]["payload"]["changes"] == [[2, 1]]
+    assert delta[0]["payload"]["seq"] == keyframe_seq + 1
+
+    sent.clear()
+    poller._publish(header, status_vector([(1, 0), (2, 1)]), now=100.2)
+    assert [targets for targets, _ in sent] == [["full"]]
+
+    sent.clear()
+    poller._publish({"tree_id": "tree-b"}, status_vector([(1, 0), (2, 1)]), now=100.3)
+    assert [(targets, frame["type"]) for targets, frame in sent] == [(["full"], "statusUpdate"),
+                                                                     (["delta"], "statusUpdate")]
+
+
+def test_binary_subscribers_get_binary_frames(monkeypatch):
+    sent = []
+    monkeypatch.setattr(status_poller, "queue_broadcast",
+                        lambda targets, frame, stream: sent.append((list(targets), frame)))
+
+    poller = StatusPoller(FakeBackend(), keyframe_interval=60.0)
+    poller._subscribers = {"text": ("delta", False), "bin": ("delta", True)}
+    poller._needs_keyframe.update(["text", "bin"])
+    tree_id = str(uuid.uuid4())
+
+    poller._publish({"tree_id": tree_id}, status_vector([(1, 0), (2, 0)]), now=100.0)
+    poller._publish({"tree_id": tree_id}, status_vector([(1, 3), (2, 0)]), now=100.1)
+
+    binary = [decode_frame(frame) for targets, frame in sent if targets == ["bin"]]
+    text = [json.loads(frame) for targets, frame in sent if targets == ["text"]]
+    assert [kind for kind, _ in binary] == [FRAME_STATUS_KEYFRAME, FRAME_STATUS_DELTA]
+    assert binary[0][1]["records"] == [[1, 0], [2, 0]]
+    assert binary[1][1] == {"seq": text[1]["payload"]["seq"], "tree_id": tree_id, "records": [[1, 3]]}
+
+
+class SlowWebSocket:
+    """Accepts frames only once `gate` is set."""
+
+    remote_address = ("127.0.0.1", 1234)
+
+    def __init__(self):
+        self.received = []
+        self.gate = asyncio.Event()
+
+    async def send(self, frame, text=None):
+        await self.gate.wait()
+        self.received.append(json.loads(frame))
+
+
+def test_queued_keyframe_is_not_coalesced_by_the_next_delta():
+    async def run():
+        ws = SlowWebSocket()
+        queues = SendQueues(max_lag=0)
+        queue = queues.wrap(ws)
+        # The writer blocks on this reply, so everything pushed afterwards stays queued
+        await queue.send(b'{"type": "busy"}')
+        await asyncio.sleep(0)
+
+        poller = StatusPoller(FakeBackend(), keyframe_interval=60.0)
+        poller._subscribers = {queue: ("delta", False)}
+        poller._needs_keyframe.add(queue)
+        poller._publish({"tree_id": "tree-a"}, status_vector([(1, 0), (2, 0)]), now=100.0)
+        poller._publish({"tree_id": "tree-a"}, status_vector([(1, 2), (2, 0)]), now=100.1)
+        poller._publish({"tree_id": "tree-a"}, status_vector([(1, 2), (2, 3)]), now=100.2)
+        ws.gate.set()
+        await asyncio.sleep(0.01)
+        return ws.received[1:], queues.stats()
+
+    received, stats = asyncio.run(run())
+    # The keyframe survives; only the older delta is coalesced
+    assert [frame["type"] for frame in received] == ["statusUpdate", "statusDelta"]
+    assert received[0]["payload"]["data"] == [{"uid": 1, "status": 0}, {"uid": 2, "status": 0}]
+    assert received[1]["payload"]["changes"] == [[2, 3]]
+    assert stats["coalesced"] == 1
+
+
+class PollingBackend:
+    """Answers STATUS requests from a list of replies; an Exception entry is raised instead."""
+
+    req_endpoint = "tcp://test:1667"
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.requests = []
+
+    async def request(self, frames, timeout=None):
+        self.requests.append(frames)
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if isinstance(reply, Exception):
+            raise reply
+        return [frames[0] + TREE_ID, reply]
+
+
+def run_poller(monkeypatch, backend, polls, subscribers=("first", "second")):
+    """Runs a poller until it has polled `polls` times and returns the frames it broadcast."""
+    sent = []
+    monkeypatch.setattr(status_poller, "queue_broadcast",
+                        lambda targets, frame, stream: sent.append((sorted(targets), json.loads(frame))))
+
+    async def main():
+        poller = StatusPoller(backend, rate=100.0)
+        for websocket in subscribers:
+            poller.subscribe(websocket)
+        while poller.stats()["polls"] < polls:
+            await asyncio.sleep(0.005)
+        for websocket in subscribers:
+            poller.unsubscribe(websocket)
+        await asyncio.wait_for(poller._task, 1.0)
+        return poller.stats()
+
+    return sent, asyncio.run(main())
+
+
+def test_each_poll_is_sent_once_to_all_subscribers(monkeypatch):
+    backend = PollingBackend([status_vector([(1, 0), (2, 1)])])
+    sent, stats = run_poller(monkeypatch, backend, polls=2)
+
+    assert all(targets == ["first", "second"] for targets, _ in sent)
+    frame = sent[0][1]
+    assert frame["type"] == "statusUpdate"
+    assert frame["payload"]["header"]["type"] == "S"
+    assert frame["payload"]["data"] == [{"uid": 1, "status": 0}, {"uid": 2, "status": 1}]
+    assert len(backend.requests) == stats["polls"]
+    # The poller stops once its last subscriber has left
+    assert not stats["running"] and stats["subscribers"] == 0
+
+
+def test_poll_errors_are_reported_once_until_they_change(monkeypatch):
+    failure = ConnectionError("backend down")
+    backend = PollingBackend([failure, failure, failure, status_vector([(1, 2)])])
+    sent, stats = run_poller(monkeypatch, backend, polls=4)
+
+    frames = [frame for _, frame in sent]
+    assert [frame["type"] for frame in frames[:2]] == ["error", "statusUpdate"]
+    assert frames[0]["payload"]["message"] == "Status poll failed: backend down"
+    assert stats["errors"] == 3
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Unit tests for request tracing and queued logging.
+
+Usage:
+  python3 -m pytest -q tests/tracing_test.py
+"""
+
+import asyncio
+import logging
+
+from tracing import Tracer, current_span, set_current_span, reset_current_span, trace_event, queue_logging
+
+
+def test_spans_follow_tasks_and_ring_keeps_latest():
+    tracer = Tracer(capacity=2)
+
+    async def command(name):
+        trace_event("start")
+        await asyncio.sleep(0)
+        trace_event("backend_send", "S")
+        trace_event("backend_reply", 42)
+        tracer.finish(current_span())
+
+    async def run():
+        tasks = []
+        for name in ("getStatus", "getTree", "pause"):
+            span = tracer.start(name, "default", request_id=name)
+            token = set_current_span(span)
+            tasks.append(asyncio.create_task(command(name)))
+            reset_current_span(token)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    spans = tracer.dump()
+    assert [span["command"] for span in spans] == ["getTree", "pause"]
+    assert [event["name"] for event in spans[0]["events"]] == ["recv", "start", "backend_send", "backend_reply", "end"]
+    assert spans[0]["events"][2]["detail"] == "S"
+    assert tracer.stats() == {"capacity": 2, "spans": 2, "finished": 3}
+    assert tracer.dump(command="pause", limit=1)[0]["requestId"] == "pause"
+
+
+def test_finished_span_ignores_inherited_tasks_and_disabled_tracer_is_free():
+    tracer = Tracer(capacity=4)
+    span = tracer.start("subscribeStatus")
+    token = set_current_span(span)
+    tracer.finish(span)
+    trace_event("backend_send", "S")  # e.g. the poller task the command started
+    reset_current_span(token)
+    assert [event["name"] for event in tracer.dump()[0]["events"]] == ["recv", "end"]
+
+    assert Tracer(capacity=0).start("getTree") is None
+    trace_event("ws_send")  # no current span: nothing to do
+
+
+def test_queue_logging_hands_records_to_background_thread():
+    root = logging.getLogger("tracing_test")
+    records = []
+
+    class Collect(logging.Handler):
+        def emit(self, record):
+            records.append(record.getMessage())
+
+    root.addHandler(Collect())
+    root.propagate = False
+    listener = queue_logging(root)
+    root.warning("queued %d", 1)
+    listener.stop()
+    assert records == ["queued 1"]
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Unit tests for traffic capture (scripts/traffic_capture.py) and its replay tool.
+
+Usage:
+  python3 -m pytest -q tests/traffic_capture_test.py
+"""
+
+import asyncio
+import struct
+
+import zmq
+import zmq.asyncio
+
+from backend_pool import BackendPool
+from fake_groot2_server import FakeGroot2Server
+from load_benchmark import free_port_pair
+from replay_capture import CaptureReplay, CaptureReplayServer
+from traffic_capture import TrafficCapture, read_capture, KIND_ENDPOINT, KIND_REQUEST, KIND_REPLY, KIND_PUB
+
+
+def header(type_char, request_id):
+    return struct.pack('!BBi', 2, ord(type_char), request_id)
+
+
+def test_capture_round_trip_and_size_limit(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    capture = TrafficCapture(path, max_bytes=200)
+    endpoint = capture.endpoint("tcp://a:1667", "tcp://a:1668")
+    seq = capture.request(endpoint, [header('B', 1), b"MainTree"])
+    capture.reply(endpoint, seq, [header('B', 1) + bytes(16), b"\x80"])
+    capture.pub(endpoint, [header('N', 0), b"7"])
+    capture.pub(endpoint, [header('N', 0), b"x" * 200])  # over the limit
+    assert capture.stats()["dropped"] == 1
+    capture.close()
+
+    _, records = read_capture(path)
+    assert [record.kind for record in records] == [KIND_ENDPOINT, KIND_REQUEST, KIND_REPLY, KIND_PUB]
+    assert records[1].seq == records[2].seq == seq
+    assert records[2].frames == [header('B', 1) + bytes(16), b"\x80"]
+    assert records[1].timestamp <= records[2].timestamp
+
+    # A record cut short by a crash ends the capture
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:-1])
+    assert len(read_capture(path)[1]) == 3
+
+
+def test_captured_pool_traffic_replays(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    port = free_port_pair()
+
+    async def capture_session():
+        context = zmq.asyncio.Context()
+        capture = TrafficCapture(path)
+        pool = BackendPool(context, "127.0.0.1", port, port + 1, capture=capture)
+        try:
+            status = await pool.request([header('S', 1)])
+            blackboard = await pool.request([header('B', 2), b"MainTree"])
+            return status, blackboard
+        finally:
+            pool.close()
+            capture.close()
+            context.term()
+
+    with FakeGroot2Server(port=port, nodes=30, tick_rate=0, seed=3):
+        status, blackboard = asyncio.run(capture_session())
+
+    replay = CaptureReplay(read_capture(path)[1])
+    assert replay.endpoint == f"tcp://127.0.0.1:{port}"
+    assert replay.summary()["exchanges"] == {"S": 1, "B": 1}
+
+    replay_port = free_port_pair()
+    with CaptureReplayServer(replay, port=replay_port, speed=0) as server:
+        context = zmq.Context()
+        socket = context.socket(zmq.REQ)
+        socket.setsockopt(zmq.RCVTIMEO, 2000)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(server.req_endpoint)
+        try:
+            socket.send_multipart([header('S', 41)])
+            reply = socket.recv_multipart()
+            # New request id, captured tree UUID and payload
+            assert reply[0] == header('S', 41) + status[0][6:] and reply[1:] == status[1:]
+
+            socket.send_multipart([header('B', 42), b"MainTree"])
+            assert socket.recv_multipart()[1:] == blackboard[1:]
+
+            socket.send_multipart([header('T', 43)])
+            assert socket.recv_multipart()[0] == b"error"
+            assert (server.requests, server.misses) == (3, 1)
+        finally:
+            socket.close()
+            context.term()
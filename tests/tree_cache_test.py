@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the tree_id keyed tree cache.
+
+Usage:
+  python3 -m pytest -q tests/tree_cache_test.py
+"""
+
+import asyncio
+import gzip
+import uuid
+
+from binary_frames import decode_frame, encode_compressed_tree, FRAME_COMPRESSED_TREE
+from tree_cache import TreeCache
+
+
+class FakeBackend:
+    """Answers T and S requests and reports tree changes like BackendPool does."""
+
+    req_endpoint = "tcp://test:1667"
+
+    def __init__(self):
+        self.tree_uuid = uuid.uuid4()
+        self.xml = "<root/>"
+        self.tree_id = None
+        self.age = 0.0
+        self.requests = []
+        self._callbacks = []
+
+    def add_tree_change_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def tree_id_age(self):
+        return self.age
+
+    async def request(self, frames, timeout=None):
+        type_char = chr(frames[0][1])
+        self.requests.append(type_char)
+        if self.tree_id != str(self.tree_uuid):
+            self.tree_id = str(self.tree_uuid)
+            for callback in self._callbacks:
+                callback(self.tree_id)
+        self.age = 0.0
+        body = self.xml.encode() if type_char == 'T' else b''
+        return [frames[0] + self.tree_uuid.bytes, body]
+
+    request_shared = request
+
+
+def test_second_get_is_served_from_cache():
+    backend = FakeBackend()
+    cache = TreeCache(backend)
+
+    first, cached_first = asyncio.run(cache.get())
+    second, cached_second = asyncio.run(cache.get())
+
+    assert (cached_first, cached_second) == (False, True)
+    assert second.etag == first.etag
+    assert backend.requests == ['T']
+
+
+def test_stale_tree_id_is_revalidated_with_status():
+    backend = FakeBackend()
+    cache = TreeCache(backend, revalidate_after=1.0)
+    asyncio.run(cache.get())
+
+    backend.age = 5.0
+    _, cached = asyncio.run(cache.get())
+
+    assert cached
+    assert backend.requests == ['T', 'S']
+
+
+def test_new_tree_id_invalidates_cache():
+    backend = FakeBackend()
+    cache = TreeCache(backend, revalidate_after=1.0)
+    first, _ = asyncio.run(cache.get())
+
+    backend.tree_uuid = uuid.uuid4()
+    backend.xml = "<root><BehaviorTree/></root>"
+    backend.age = 5.0
+    second, cached = asyncio.run(cache.get())
+
+    assert not cached
+    assert second.tree_id != first.tree_id
+    assert second.etag != first.etag
+    assert backend.requests == ['T', 'S', 'T']
+
+
+def test_gzip_copy_is_compressed_once_and_framed_with_etag():
+    backend = FakeBackend()
+    backend.xml = "<root>" + "<Action ID='Wait'/>" * 1000 + "</root>"
+    cache = TreeCache(backend)
+
+    async def run():
+        entry, _ = await cache.get()
+        first, second = await asyncio.gather(cache.compressed(entry), cache.compressed(entry))
+        return entry, first, second
+
+    entry, first, second = asyncio.run(run())
+    assert first is second
+    assert gzip.decompress(first).decode() == backend.xml
+    assert cache.stats()["compressions"] == 1
+    assert cache.stats()["compressed_bytes"] == len(first) < entry.size
+
+    kind, fields = decode_frame(encode_compressed_tree(entry.tree_id, entry.etag, first))
+    assert kind == FRAME_COMPRESSED_TREE
+    assert fields == {"tree_id": entry.tree_id, "etag": entry.etag, "data": first}
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the thresholded permessage-deflate extension.
+
+Usage:
+  python3 -m pytest -q tests/ws_compression_test.py
+"""
+
+import zlib
+
+from websockets.frames import Frame, Opcode
+
+from ws_compression import server_extensions
+
+PRECOMPRESSED = 0x05
+
+
+def negotiate(**options):
+    factory, = server_extensions(skip_kinds=(PRECOMPRESSED,), **options)
+    _, extension = factory.process_request_params([], [])
+    return factory, extension
+
+
+def test_small_and_precompressed_messages_skip_compression():
+    factory, extension = negotiate(threshold=100)
+
+    small = extension.encode(Frame(Opcode.TEXT, b'{"type": "statusDelta"}'))
+    assert not small.rsv1 and small.data == b'{"type": "statusDelta"}'
+
+    large_data = b'{"xml": "' + b"<Action/>" * 100 + b'"}'
+    large = extension.encode(Frame(Opcode.TEXT, large_data))
+    assert large.rsv1 and len(large.data) < len(large_data)
+    assert zlib.decompressobj(-12).decompress(large.data + b"\x00\x00\xff\xff") == large_data
+
+    precompressed = extension.encode(Frame(Opcode.BINARY, bytes([PRECOMPRESSED]) + bytes(500)))
+    assert not precompressed.rsv1
+
+    assert factory.stats()["connections"] == 1
+    assert factory.stats()["compressed"] == 1
+    assert factory.stats()["skipped"] == 2
+
+
+def test_continuation_frames_follow_the_first_frame():
+    _, extension = negotiate(threshold=10)
+    first = extension.encode(Frame(Opcode.TEXT, b"abc", fin=False))
+    rest = extension.encode(Frame(Opcode.CONT, b"x" * 100))
+    assert not first.rsv1 and rest.data == b"x" * 100
+
+
+def test_settings_are_negotiated():
+    factory, _ = negotiate(window_bits=10, memory_level=3)
+    params, _ = factory.process_request_params([("client_max_window_bits", None)], [])
+    assert ("server_max_window_bits", "10") in params
+    assert factory.stats()["memory_level"] == 3
+    assert server_extensions(enabled=False) == []